@@ -8,12 +8,18 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 django.setup()
 
 from streams.routing import websocket_urlpatterns
+from streams.consumers import stream_manager
+from streams.lifespan import BackgroundServicesMiddleware
+from streams.thumbnail_scheduler import thumbnail_scheduler
+from streams.thumbnail_service import thumbnail_service
 
-application = ProtocolTypeRouter({
+# The thumbnail disk cache warm-up, thumbnail scheduler, pinned cameras and FFmpeg resource
+# sampling start with the server's lifespan events, or on the first request
+application = BackgroundServicesMiddleware(ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": AuthMiddlewareStack(
         URLRouter(
             websocket_urlpatterns
         )
     ),
-})
+}), [thumbnail_service, thumbnail_scheduler, stream_manager])
@@ -150,6 +150,90 @@ REST_FRAMEWORK = {
 }
 
 # FFmpeg settings
-FFMPEG_TIMEOUT = 10  # seconds
+FFMPEG_TIMEOUT = 10  # seconds; also the RTSP socket timeout after which FFmpeg gives up on a silent camera
+# FFmpeg option carrying that socket timeout: '-timeout' since FFmpeg 5, '-stimeout' before
+FFMPEG_RTSP_TIMEOUT_OPTION = '-timeout'
+# Restart an ingest whose FFmpeg keeps running but hasn't produced video for this many seconds
+# (twice as long before the first frame); None turns the stall watchdog off
+STREAM_STALL_TIMEOUT = 10
+# Seconds between samples of every running FFmpeg's CPU time and RSS (from /proc, Linux only);
+# None turns sampling off
+STREAM_RESOURCE_SAMPLE_INTERVAL = 5
+FFMPEG_READ_SIZE = 188 * 174  # bytes requested per stdout read (whole TS packets)
+# MPEG-1 renditions encoded by each camera's single ingest ('low', 'medium', 'high');
+# viewers pick one with ?quality= on /ws/stream. Add 'source' to also offer the camera's
+# H.264/HEVC copied into MPEG-TS for MSE players (?quality=source); ['source'] alone skips
+# re-encoding entirely.
+STREAM_RENDITIONS = ['low', 'medium']
+# Keep an ingest running this many seconds after its last viewer leaves, so tab switches and
+# re-mounts attach to the running stream instead of reconnecting to the camera (0 = stop at once).
+# Lingering ingests give up their slot early when another camera is waiting for one.
+STREAM_LINGER = 15
+# Cameras kept running even without viewers: stream ids or RTSP URLs
+STREAM_PINNED = []
+# When FFmpeg exits while a camera is being watched it is restarted after STREAM_RESTART_BACKOFF
+# seconds, doubling (with jitter) up to STREAM_RESTART_MAX_BACKOFF; viewers stay connected.
+# Permanent errors (AUTH, NOT_FOUND) are not retried. None = no limit on attempts.
+STREAM_RESTART_BACKOFF = 1
+STREAM_RESTART_MAX_BACKOFF = 60
+STREAM_RESTART_MAX_ATTEMPTS = None
 MAX_CONCURRENT_STREAMS = 10
 MAX_STREAMS_PER_CLIENT = 5
+# New ingests wait this many seconds for a free slot before being rejected (close code 4503)
+STREAM_ADMISSION_QUEUE_TIMEOUT = 10
+STREAM_ADMISSION_QUEUE_SIZE = 50
+
+# Per-viewer fan-out: chunks buffered for each video viewer before it counts as lagging
+STREAM_SUBSCRIBER_QUEUE_SIZE = 64
+# Lagging viewers: 'drop_until_keyframe', 'downgrade' or 'disconnect'
+STREAM_SLOW_SUBSCRIBER_POLICY = 'drop_until_keyframe'
+# Upper bound on the bytes kept since the last keyframe for late-joiner replay
+STREAM_GOP_BUFFER_BYTES = 4 * 1024 * 1024
+
+# Broadcast pacing: reads are coalesced into WebSocket frames of up to this many bytes
+STREAM_FRAME_MAX_BYTES = 64 * 1024
+# ...or until this many seconds have passed since the first read of the frame
+STREAM_FRAME_MAX_DELAY = 0.005
+# Optional ceiling in bytes per second per stream (None = no throttle)
+STREAM_MAX_RATE = None
+
+# Cross-process stream sharing. 'streams.relay.LocalRelay' lets every worker run its own
+# FFmpeg; 'streams.relay.UnixSocketRelay' makes one worker per camera own the ingest and
+# relay it to the other workers on the host (options: path, max_buffer, connect_timeout)
+STREAM_RELAY_BACKEND = 'streams.relay.LocalRelay'
+STREAM_RELAY_OPTIONS = {}
+# With 'streams.relay.IngestRelay', `manage.py run_ingest` runs every FFmpeg in its own
+# worker pool; an ingest keeps running this many seconds after its last web worker left
+STREAM_INGEST_IDLE_GRACE = 30
+
+# Thumbnails: concurrent FFmpeg captures, cache lifetime, and how long an expired
+# thumbnail may still be served while a fresh one is captured in the background
+THUMBNAIL_MAX_CONCURRENT = 4
+THUMBNAIL_CACHE_TTL = 300
+THUMBNAIL_STALE_WHILE_REVALIDATE = True
+THUMBNAIL_MAX_STALE = 3600
+# Running ingests also emit a JPEG still this often (seconds) so thumbnails of live cameras
+# never open a second RTSP session; None turns it off
+THUMBNAIL_LIVE_INTERVAL = 5
+# Memory budget of the thumbnail cache in bytes; least recently used thumbnails are evicted
+THUMBNAIL_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# Optional directory for a second, on-disk cache tier that survives restarts (None = memory only)
+THUMBNAIL_DISK_CACHE_DIR = None
+THUMBNAIL_DISK_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Background thumbnail refresh: every active stream is captured about this often (seconds,
+# None = off), a little under THUMBNAIL_CACHE_TTL so visitors find fresh thumbnails.
+# Runs are jittered by THUMBNAIL_REFRESH_JITTER (fraction of the interval) and failing
+# cameras are retried with exponential backoff up to THUMBNAIL_REFRESH_MAX_BACKOFF seconds
+THUMBNAIL_REFRESH_INTERVAL = 240
+THUMBNAIL_REFRESH_MAX_CONCURRENT = 2
+THUMBNAIL_REFRESH_JITTER = 0.1
+THUMBNAIL_REFRESH_MAX_BACKOFF = 3600
+
+# ffprobe check of stream URLs on create and update: timeout in seconds, and how long a
+# result is reused for the same camera
+STREAM_PROBE_TIMEOUT = 10
+STREAM_PROBE_CACHE_TTL = 300
+# POST /api/streams/bulk/: streams per request, and URLs probed at the same time
+STREAM_BULK_MAX = 1000
+STREAM_BULK_PROBE_CONCURRENCY = 32
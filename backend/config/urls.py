@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.urls import path, include
+from streams.views import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('streams.urls')),
+    path('metrics', metrics, name='metrics'),
 ]
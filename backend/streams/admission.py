@@ -0,0 +1,144 @@
+import asyncio
+import itertools
+import logging
+from collections import defaultdict, Counter
+from typing import Optional, Dict, Any, Callable, List
+
+logger = logging.getLogger(__name__)
+
+# WebSocket close codes sent when a viewer is not admitted
+CLOSE_CODE_CLIENT_LIMIT = 4029
+CLOSE_CODE_SERVER_BUSY = 4503
+
+class AdmissionRejected(Exception):
+    """Raised when a viewer or an ingest cannot be admitted"""
+
+    def __init__(self, close_code: int, error_code: str, message: str):
+        super().__init__(message)
+        self.close_code = close_code
+        self.error_code = error_code
+        self.message = message
+
+class _Waiter:
+    def __init__(self, key: str, priority: Callable[[], int], future: asyncio.Future, sequence: int, label: str):
+        self.key = key
+        self.label = label
+        self.priority = priority
+        self.future = future
+        self.sequence = sequence
+
+class AdmissionController:
+    """Enforces MAX_CONCURRENT_STREAMS and MAX_STREAMS_PER_CLIENT.
+
+    An ingest slot is held by every running FFmpeg pipeline. Attaching to a
+    stream that already holds a slot is always free, so streams that already
+    have viewers never wait. New ingests queue for up to queue_timeout seconds
+    and are granted freed slots in order of how many viewers are waiting on
+    them, then first come first served.
+    """
+
+    def __init__(self, max_streams: int, max_streams_per_client: int,
+                 queue_timeout: float = 10.0, max_queue: int = 50):
+        self.max_streams = max_streams
+        self.max_streams_per_client = max_streams_per_client
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.active = set()  # stream keys holding an ingest slot
+        self.waiting: List[_Waiter] = []
+        self.clients: Dict[str, Counter] = defaultdict(Counter)  # client -> stream key -> connections
+        self.rejected = 0
+        self._sequence = itertools.count()
+        # Called when an ingest has to queue; may free a slot held by an idle (lingering) ingest
+        self.reclaim: Optional[Callable[[], Any]] = None
+
+    def register_client(self, client: str, key: str):
+        """Count a connection from `client` to stream `key`, enforcing the per-client limit"""
+        streams = self.clients[client]
+        if key not in streams and len(streams) >= self.max_streams_per_client:
+            self.rejected += 1
+            raise AdmissionRejected(
+                CLOSE_CODE_CLIENT_LIMIT,
+                'TOO_MANY_STREAMS',
+                f'Client is already watching {len(streams)} streams (limit {self.max_streams_per_client})'
+            )
+        streams[key] += 1
+
+    def unregister_client(self, client: str, key: str):
+        streams = self.clients.get(client)
+        if not streams or key not in streams:
+            return
+        streams[key] -= 1
+        if streams[key] <= 0:
+            del streams[key]
+        if not streams:
+            del self.clients[client]
+
+    async def acquire(self, key: str, priority: Callable[[], int] = lambda: 0,
+                      on_queued: Optional[Callable[[int], Any]] = None, label: Optional[str] = None):
+        """Wait for an ingest slot for stream `key`, or raise AdmissionRejected.
+
+        label is what logs and stats show instead of the key, which may hold credentials.
+        """
+        label = label or key
+        if key in self.active:
+            return
+        if len(self.active) < self.max_streams and not self.waiting:
+            self.active.add(key)
+            return
+        if len(self.waiting) >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(CLOSE_CODE_SERVER_BUSY, 'SERVER_BUSY', 'Stream queue is full')
+
+        waiter = _Waiter(key, priority, asyncio.get_running_loop().create_future(), next(self._sequence), label)
+        self.waiting.append(waiter)
+        logger.info(f"Queued ingest {label} for a stream slot ({len(self.active)}/{self.max_streams} in use, {len(self.waiting)} waiting)")
+        if self.reclaim:
+            self.reclaim()
+
+        try:
+            if on_queued:
+                await on_queued(len(self.waiting))
+            await asyncio.wait_for(waiter.future, self.queue_timeout)
+        except asyncio.CancelledError:
+            # Granted just before the caller went away; don't leak the slot
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(key)
+            raise
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise AdmissionRejected(
+                CLOSE_CODE_SERVER_BUSY,
+                'SERVER_BUSY',
+                f'No stream slot became available within {self.queue_timeout:g}s'
+            )
+        finally:
+            if waiter in self.waiting:
+                self.waiting.remove(waiter)
+
+    def release(self, key: str):
+        """Free the slot held by stream `key` and hand it to the best waiting ingest"""
+        if key not in self.active:
+            return
+        self.active.discard(key)
+        self._grant()
+
+    def _grant(self):
+        while len(self.active) < self.max_streams and self.waiting:
+            waiter = max(self.waiting, key=lambda w: (w.priority(), -w.sequence))
+            self.waiting.remove(waiter)
+            if waiter.future.done():
+                continue
+            self.active.add(waiter.key)
+            waiter.future.set_result(True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Current slot usage"""
+        return {
+            'max_concurrent_streams': self.max_streams,
+            'active_streams': len(self.active),
+            'available_slots': max(0, self.max_streams - len(self.active)),
+            'queued': [{'stream': waiter.label, 'viewers': waiter.priority()} for waiter in self.waiting],
+            'max_streams_per_client': self.max_streams_per_client,
+            'clients': len(self.clients),
+            'rejected': self.rejected,
+        }
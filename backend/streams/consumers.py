@@ -1,150 +1,903 @@
 import json
+import time
+import random
 import asyncio
 import logging
+from collections import Counter
+from functools import partial
+from urllib.parse import parse_qsl
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.shortcuts import get_object_or_404
 from .models import Stream
-from .ffmpeg_helper import FFmpegProcess
+from .ffmpeg_helper import FFmpegProcess, resolve_quality, supported_renditions, passthrough_renditions, normalize_rtsp_url, SNAPSHOT_OUTPUT, PASSTHROUGH, PERMANENT_ERRORS
+from .fanout import Subscriber
+from .gop_buffer import GopBuffer
+from .pacing import ChunkPacer
+from .admission import AdmissionController, AdmissionRejected
+from .relay import load_relay, IngestFailed
+from .probe_service import probe_service
+from .metrics import Histogram, SEND_LATENCY_BUCKETS
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
+PINNED_CHECK_INTERVAL = 30  # seconds between checks that every pinned camera is running
+RESTART_JITTER = 0.2  # fraction of the restart backoff
+STALL_CHECK_INTERVAL = 1  # seconds between stall watchdog checks, also the input rate window
+CLOSE_CODE_UNSUPPORTED_QUALITY = 4415  # the requested rendition isn't produced for this camera
+# Subscriber counters summed into a stream's outbound traffic
+TRAFFIC_FIELDS = ('sent_bytes', 'sent_chunks', 'dropped_bytes', 'dropped_chunks')
+
 # Global stream manager to share FFmpeg processes between connections
 class StreamManager:
     def __init__(self):
-        self.streams = {}  # stream_id -> StreamInfo
+        self.streams = {}  # canonical RTSP URL -> StreamInfo, one per physical camera
         self.lock = asyncio.Lock()
+        self.admission = AdmissionController(
+            max_streams=settings.MAX_CONCURRENT_STREAMS,
+            max_streams_per_client=settings.MAX_STREAMS_PER_CLIENT,
+            queue_timeout=settings.STREAM_ADMISSION_QUEUE_TIMEOUT,
+            max_queue=settings.STREAM_ADMISSION_QUEUE_SIZE,
+        )
+        self.admission.reclaim = self._reclaim_slot
+        self.relay = load_relay()  # shares each camera's ingest with other worker processes
+        self.pinned = list(settings.STREAM_PINNED)  # stream ids or RTSP URLs kept running without viewers
+        # Time from a viewer attaching to its first video chunk, by whether the ingest was already running
+        self.attach_latency = {'cold': Histogram(), 'warm': Histogram()}
+        self.first_frame_latency = Histogram()  # FFmpeg start to first video chunk
+        self.send_latency = Histogram(SEND_LATENCY_BUCKETS)  # one WebSocket send of a video chunk
+        self.exit_errors = Counter()  # error code -> FFmpeg exits, across all streams
+        self.restarts = 0
+        self.sample_interval = settings.STREAM_RESOURCE_SAMPLE_INTERVAL  # None turns sampling off
+        self._pinned_task = None
+        self._sampler_task = None
     
     async def get_or_create_stream(self, stream_id, rtsp_url):
+        """Shared stream for a camera, keyed by its canonical URL whether it came from the DB or ?url="""
+        key = normalize_rtsp_url(rtsp_url)
         async with self.lock:
-            if stream_id not in self.streams:
-                self.streams[stream_id] = StreamInfo(stream_id, rtsp_url)
-            return self.streams[stream_id]
+            if key not in self.streams:
+                self.streams[key] = StreamInfo(stream_id, rtsp_url, admission=self.admission, key=key,
+                                               relay=self.relay, manager=self)
+            return self.streams[key]
     
-    async def remove_stream(self, stream_id):
+    async def release_stream(self, stream_info):
+        """Forget a stream once it has no connections and is neither playing, waiting to restart nor pinned"""
         async with self.lock:
-            if stream_id in self.streams:
-                await self.streams[stream_id].stop()
-                del self.streams[stream_id]
+            # A restarting or pinned stream stays ours; dropping it would orphan its restart task
+            # and let the next viewer or _keep_pinned_warm start a second ingest of the camera
+            idle = not (stream_info.connections or stream_info.is_playing or stream_info.is_restarting or stream_info.pinned)
+            if idle and self.streams.get(stream_info.key) is stream_info:
+                del self.streams[stream_info.key]
+    
+    def register_client(self, client, key):
+        """Count a client's connection to a stream; raises AdmissionRejected over MAX_STREAMS_PER_CLIENT"""
+        self.admission.register_client(client, key)
+    
+    def unregister_client(self, client, key):
+        self.admission.unregister_client(client, key)
+    
+    def get_stats(self):
+        """Stats for every shared stream in this process"""
+        return [stream_info.get_stats() for stream_info in list(self.streams.values())]
+    
+    def get_attach_stats(self):
+        """Cold-start vs warm-attach counts and latency histograms"""
+        return {
+            'linger': settings.STREAM_LINGER,
+            'pinned': sum(1 for stream_info in list(self.streams.values()) if stream_info.pinned),
+            'lingering': sum(1 for stream_info in list(self.streams.values()) if stream_info.is_lingering),
+            **{kind: histogram.get_stats() for kind, histogram in self.attach_latency.items()},
+        }
+    
+    def record_attach(self, kind, seconds):
+        self.attach_latency[kind].observe(seconds)
+    
+    def _reclaim_slot(self):
+        """A new ingest is waiting for a slot; stop the ingest that has lingered longest"""
+        lingering = [stream_info for stream_info in self.streams.values() if stream_info.is_lingering]
+        if lingering:
+            stream_info = min(lingering, key=lambda s: s.idle_since)
+            logger.info(f"Stopping lingering stream {stream_info.stream_id} early to free a slot")
+            stream_info.stop_lingering()
+    
+    def start(self):
+        """Keep the pinned cameras running and sample FFmpeg resource usage, where configured and not already started"""
+        if self.pinned and not (self._pinned_task and not self._pinned_task.done()):
+            self._pinned_task = asyncio.create_task(self._keep_pinned_warm())
+            logger.info(f"Keeping {len(self.pinned)} pinned cameras warm")
+        if self.sample_interval and not (self._sampler_task and not self._sampler_task.done()):
+            self._sampler_task = asyncio.create_task(self._sample_resources())
+    
+    async def stop(self):
+        tasks = [task for task in (self._pinned_task, self._sampler_task) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._pinned_task = self._sampler_task = None
+        for stream_info in list(self.streams.values()):
+            if stream_info.is_playing:
+                await stream_info.stop()
+    
+    async def _keep_pinned_warm(self):
+        while True:
+            for stream_id, rtsp_url in await self._resolve_pinned():
+                stream_info = await self.get_or_create_stream(stream_id, rtsp_url)
+                stream_info.pinned = True
+                if stream_info.is_playing:
+                    continue
+                try:
+                    if not await stream_info.start():
+                        logger.warning(f"Could not start pinned stream {stream_id}, retrying in {PINNED_CHECK_INTERVAL}s")
+                except AdmissionRejected as e:
+                    logger.warning(f"No slot for pinned stream {stream_id}: {e.message}")
+            await asyncio.sleep(PINNED_CHECK_INTERVAL)
+    
+    async def _sample_resources(self):
+        """One timer for every stream: read each running FFmpeg's CPU time and RSS from /proc"""
+        while True:
+            for stream_info in list(self.streams.values()):
+                if stream_info.ffmpeg_process and stream_info.is_playing:
+                    stream_info.ffmpeg_process.sample_resources()
+            await asyncio.sleep(self.sample_interval)
+    
+    async def get_ingest_stats(self):
+        """Stats of the run_ingest workers running FFmpeg for us (IngestRelay); empty with other relays"""
+        get_ingest_stats = getattr(self.relay, 'get_ingest_stats', None)
+        return await get_ingest_stats() if get_ingest_stats else []
+    
+    def get_stream_resource_stats(self, key, ingest_workers=()):
+        """Resource stats of one camera, from this process or the ingest worker running it; None if neither is"""
+        stream_info = self.streams.get(key)
+        url = StreamInfo._mask_url(key)
+        local = [stream_info.get_resource_stats()] if stream_info else []
+        return next((stats for stats in self._merge_ingest(local, ingest_workers) if stats['url'] == url), None)
+    
+    def _merge_ingest(self, streams, ingest_workers):
+        """Fill in the FFmpeg side of streams we follow from the ingest workers running them,
+        and add the ones they run for other web workers"""
+        owned = {}
+        for worker in ingest_workers:
+            for stats in worker['resources']:
+                owned[stats['url']] = dict(stats, ingest_worker=worker['worker'])
+        merged = []
+        for stats in streams:
+            ingest = owned.pop(stats['url'], None)
+            if ingest and stats['ingest'] == 'relay':
+                stats = dict(stats, ffmpeg=ingest['ffmpeg'], input=ingest['input'], ingest_worker=ingest['ingest_worker'])
+            merged.append(stats)
+        return merged + list(owned.values())
+    
+    def get_resource_stats(self, sort='cpu', limit=None, ingest_workers=()):
+        """Streams of this process, and of the ingest workers running FFmpeg for it, ranked by cost, most expensive first"""
+        keys = {
+            'cpu': lambda stats: (stats['ffmpeg'] or {}).get('cpu_percent') or 0,
+            'rss': lambda stats: (stats['ffmpeg'] or {}).get('rss_bytes') or 0,
+            'backlog': lambda stats: sum((stats['ffmpeg'] or {}).get('backlog_bytes', {}).values()),
+            'bitrate': lambda stats: (stats['input'] or {}).get('bytes_per_second') or 0,
+            'viewers': lambda stats: stats['viewers']['video'] + stats['viewers']['control'],
+        }
+        if sort not in keys:
+            raise ValueError(f"sort must be one of: {', '.join(keys)}")
+        streams = self._merge_ingest(
+            [stream_info.get_resource_stats() for stream_info in list(self.streams.values())], ingest_workers
+        )
+        ranked = sorted(streams, key=keys[sort], reverse=True)
+        running = [stats['ffmpeg'] for stats in streams if stats['ffmpeg']]
+        return {
+            'sort': sort,
+            'sample_interval': self.sample_interval,
+            'totals': {
+                'ffmpeg_processes': len(running),
+                'cpu_percent': round(sum(ffmpeg['cpu_percent'] or 0 for ffmpeg in running), 1),
+                'rss_bytes': sum(ffmpeg['rss_bytes'] or 0 for ffmpeg in running),
+            },
+            'streams': ranked[:limit] if limit else ranked,
+        }
+    
+    async def _resolve_pinned(self):
+        """(stream id, RTSP URL) of every pinned camera; ids are looked up among the active streams"""
+        urls = [entry for entry in self.pinned if entry.startswith('rtsp://')]
+        ids = [entry for entry in self.pinned if not entry.startswith('rtsp://')]
+        pinned = [('direct', url) for url in urls]
+        if ids:
+            try:
+                pinned += [(str(stream_id), url) async for stream_id, url in
+                           Stream.objects.filter(id__in=ids, is_active=True).values_list('id', 'url')]
+            except Exception as e:
+                logger.error(f"Could not load pinned streams: {e}")
+        return pinned
+    
+    def get_slot_stats(self):
+        """Ingest slot usage against MAX_CONCURRENT_STREAMS / MAX_STREAMS_PER_CLIENT"""
+        return self.admission.get_stats()
+    
+    async def remove_stream(self, key):
+        async with self.lock:
+            if key in self.streams:
+                await self.streams[key].stop()
+                del self.streams[key]
 
 class StreamInfo:
-    def __init__(self, stream_id, rtsp_url):
+    def __init__(self, stream_id, rtsp_url, admission=None, key=None, relay=None, manager=None):
         self.stream_id = stream_id
         self.rtsp_url = rtsp_url
+        self.key = key or normalize_rtsp_url(rtsp_url)  # canonical URL shared by every viewer of this camera
+        self.admission = admission  # AdmissionController handing out ingest slots
+        self.relay = relay  # STREAM_RELAY_BACKEND deciding which process ingests this camera
+        self.manager = manager  # StreamManager to report attaches to and leave once stopped
+        self.lease = None  # our claim on the camera: owner (runs FFmpeg) or follower
         self.ffmpeg_process = None
+        self.source = None  # FFmpeg process or relayed frames feeding the broadcast
         self.is_playing = False
+        self.start_lock = asyncio.Lock()
         self.connections = set()  # Set of WebSocket connections
-        self.video_buffer = asyncio.Queue(maxsize=100)  # Buffer for video chunks
+        self.subscribers = {}  # video connection -> Subscriber
+        # Renditions produced by the shared ingest: MPEG-1 cheapest first, then the 'source' passthrough
+        self.renditions = supported_renditions(settings.STREAM_RENDITIONS)
+        self.gop_buffers = self._new_gop_buffers()  # replay for late joiners, per rendition
+        self.input_profile = None  # stored profile the current ingest was started with
+        self.started_at = None  # when our FFmpeg was started, for time-to-first-frame
+        self.time_to_first_frame = None
+        self._profile_task = None
+        self._profile_rejected = False  # a stored profile failed; don't learn one back this session
+        self.linger = settings.STREAM_LINGER  # seconds the ingest outlives its last viewer
+        self.pinned = False  # kept running without viewers (STREAM_PINNED)
+        self.idle_since = None  # when the last viewer left, while lingering
+        self._linger_task = None
+        self.restart_attempts = 0  # restarts since FFmpeg last produced video
+        self.restarts = 0
+        self.exit_errors = Counter()  # error code -> FFmpeg exits
+        self.last_error = None
+        self.failure = None  # {code, message} of the FFmpeg error the ingest last gave up on
+        self.failed_at = None
+        self._restart_task = None
+        self.last_data_at = None  # when our FFmpeg last produced video
+        self.stalls = 0
+        self.input_rate = {'bytes_per_second': 0, 'frames_per_second': 0}
+        # Traffic counters: plain increments on the broadcast path, never reset
+        self.bytes_in = 0
+        self.chunks_in = 0
+        self.frames_in = 0  # pictures of the first rendition, counted by its GOP buffer
+        self.departed = Counter()  # TRAFFIC_FIELDS of subscribers that have left
+        self._stalled = False
+        self._watchdog_task = None
+    
+    @property
+    def is_lingering(self):
+        return self._linger_task is not None and not self._linger_task.done()
+    
+    @property
+    def is_restarting(self):
+        return self._restart_task is not None and not self._restart_task.done()
+    
+    def _new_gop_buffers(self):
+        return {name: GopBuffer(settings.STREAM_GOP_BUFFER_BYTES) for name in self.renditions}
     
     async def add_connection(self, connection):
         self.connections.add(connection)
+        self._cancel_linger()
         client_id = getattr(connection, 'client_id', 'unknown')
         video_only = getattr(connection, 'video_only', False)
+        if video_only and connection not in self.subscribers:
+            rendition = resolve_quality(getattr(connection, 'quality', None), self.renditions)
+            if rendition is None:
+                # e.g. ?quality=source for a camera whose codec can't be passed through
+                self.connections.discard(connection)
+                await connection.close(code=CLOSE_CODE_UNSUPPORTED_QUALITY)
+                return
+            subscriber = Subscriber(
+                connection,
+                max_queue=settings.STREAM_SUBSCRIBER_QUEUE_SIZE,
+                policy=settings.STREAM_SLOW_SUBSCRIBER_POLICY,
+                on_downgrade=self._downgrade_subscriber,
+                on_error=self._on_subscriber_error,
+                on_first_chunk=partial(self._record_attach, 'warm' if self.is_playing else 'cold'),
+                send_latency=self.manager.send_latency if self.manager else None,
+                rendition=rendition,
+            )
+            self.subscribers[connection] = subscriber
+            # Start from the latest keyframe; no await between replay and registration,
+            # so the live fan-out continues exactly where the replay ends
+            subscriber.start(self.gop_buffers[rendition].replay())
         logger.info(f"Added connection to stream {self.stream_id} (client: {client_id}, video_only: {video_only}) - total connections: {len(self.connections)}")
-        if not self.is_playing:
+        if not self.is_playing and not self.is_restarting:
             logger.info(f"Starting stream for {self.stream_id} - no connections were playing")
-            await self.start()
+            if not await self.start() and self.failure:
+                await self._notify_exit(self.failure)
     
     async def remove_connection(self, connection):
         self.connections.discard(connection)
+        subscriber = self.subscribers.pop(connection, None)
+        if subscriber:
+            await subscriber.close()
+            self.departed.update({field: getattr(subscriber, field) for field in TRAFFIC_FIELDS})
         client_id = getattr(connection, 'client_id', 'unknown')
         video_only = getattr(connection, 'video_only', False)
         logger.info(f"Removed connection from stream {self.stream_id} (client: {client_id}, video_only: {video_only}) - total connections: {len(self.connections)}")
+        if not self.connections and self.is_restarting and not self.pinned and not (self.lease and self.lease.followers):
+            logger.info(f"Not restarting stream {self.stream_id} - no more connections")
+            await self._abandon_restart()
         if not self.connections and self.is_playing:
-            logger.info(f"Stopping stream for {self.stream_id} - no more connections")
+            if self.lease and self.lease.followers:
+                logger.info(f"Keeping stream {self.stream_id} running for {self.lease.followers} relay followers")
+                return
+            await self._on_idle()
+    
+    async def _on_relay_idle(self):
+        """The last follower process left; stop if nobody here is watching either"""
+        if not self.connections and self.is_restarting and not self.pinned:
+            logger.info(f"Not restarting stream {self.stream_id} - no more relay followers")
+            await self._abandon_restart()
+        elif not self.connections and self.is_playing:
+            await self._on_idle()
+    
+    async def _on_idle(self):
+        """Nobody is watching any more: keep pinned ingests running, linger, or stop"""
+        if self.pinned:
+            logger.info(f"Keeping pinned stream {self.stream_id} running without viewers")
+            return
+        if self.is_lingering:
+            return
+        if self.linger:
+            # A viewer that comes back (tab switch, re-mount) attaches to the running ingest
+            logger.info(f"Keeping stream {self.stream_id} warm for {self.linger:g}s - no more connections")
+            self.idle_since = time.monotonic()
+            self._linger_task = asyncio.create_task(self._stop_after_linger())
+            return
+        logger.info(f"Stopping stream for {self.stream_id} - no more connections")
+        await self.stop()
+    
+    async def _stop_after_linger(self, delay=None):
+        await asyncio.sleep(self.linger if delay is None else delay)
+        if self.connections or self.pinned or (self.lease and self.lease.followers):
+            return
+        if self.is_playing:
+            logger.info(f"Stopping stream for {self.stream_id} - no connections for {time.monotonic() - self.idle_since:.0f}s")
+            self._linger_task = None  # stop() must not cancel us
             await self.stop()
+        if self.manager:
+            await self.manager.release_stream(self)
+    
+    def stop_lingering(self):
+        """Stop a lingering ingest now instead of at the end of its linger period"""
+        if self.is_lingering:
+            self._linger_task.cancel()
+            self._linger_task = asyncio.create_task(self._stop_after_linger(delay=0))
+    
+    def _cancel_linger(self):
+        if self.is_lingering:
+            self._linger_task.cancel()
+        self._linger_task = None
+        self.idle_since = None
+    
+    def _record_attach(self, kind, subscriber):
+        latency = subscriber.first_chunk_at - subscriber.attached_at
+        logger.info(f"{kind.capitalize()} attach to stream {self.stream_id} by {subscriber.client_id}: first video after {latency:.2f}s")
+        if self.manager:
+            self.manager.record_attach(kind, latency)
+    
+    def _replay(self, rendition):
+        if rendition == SNAPSHOT_OUTPUT:
+            snapshot = self.get_snapshot()
+            return snapshot[0] if snapshot else None
+        return self.gop_buffers[rendition].replay() if rendition in self.gop_buffers else None
+    
+    def get_snapshot(self):
+        """Latest JPEG still of the live feed and when it was taken, or None"""
+        source = self.source
+        if not self.is_playing or not source or not getattr(source, 'latest_snapshot', None):
+            return None
+        return source.latest_snapshot, source.latest_snapshot_at
+    
+    def _publish_snapshot(self, jpeg):
+        if self.lease:
+            self.lease.publish(SNAPSHOT_OUTPUT, jpeg)
     
     async def start(self):
+        """Start the shared ingest; raises AdmissionRejected if no slot frees up in time"""
+        async with self.start_lock:
+            return await self._start()
+    
+    async def _start(self):
         if self.is_playing:
             logger.info(f"Stream {self.stream_id} already playing")
             return True
         
+        # Every process serving the camera derives its renditions from the same stored profile,
+        # so owner and followers agree on whether the passthrough exists
+        self.input_profile = await self._load_input_profile()
+        await self._set_renditions(passthrough_renditions(supported_renditions(settings.STREAM_RENDITIONS), self.input_profile))
+        
+        # A restart keeps the owner lease it held through the backoff
+        restarting = self.lease is not None and self.lease.owner
+        if self.relay and not restarting:
+            self.failure = None
+            try:
+                self.lease = await self.relay.join(self.key, self.renditions, self._replay, on_idle=self._on_relay_idle)
+            except IngestFailed as e:
+                # The ingest worker just gave up on this camera; don't make it try again
+                logger.error(f"Ingest worker gave up on stream {self.stream_id}: {e.error['code']}")
+                self.last_error = e.error['code']
+                self.failure = e.error
+                return False
+            except OSError as e:
+                logger.error(f"Could not join relay for stream {self.stream_id}: {e}")
+                return False
+            if not self.lease.owner:
+                # Another process runs FFmpeg for this camera; broadcast its frames
+                self.gop_buffers = self._new_gop_buffers()
+                self.source = self.lease.source
+                self.started_at = None
+                self.is_playing = True
+                for rendition in self.renditions:
+                    asyncio.create_task(self._stream_video_data(rendition))
+                logger.info(f"Following relayed stream for: {self._mask_url(self.rtsp_url)}")
+                return True
+        
+        if self.admission:
+            try:
+                await self.admission.acquire(
+                    self.key,
+                    priority=lambda: len(self.connections),
+                    on_queued=self._notify_queued,
+                    label=self._mask_url(self.key),
+                )
+            except BaseException:
+                if not restarting:
+                    await self._close_lease()
+                raise
+        
         try:
             logger.info(f"Starting FFmpeg for stream {self.stream_id}")
-            self.ffmpeg_process = FFmpegProcess(self.rtsp_url)
+            self.started_at = time.monotonic()
+            self.time_to_first_frame = None
+            self.ffmpeg_process = FFmpegProcess(
+                self.rtsp_url,
+                read_size=settings.FFMPEG_READ_SIZE,
+                renditions=self.renditions,
+                snapshot_interval=settings.THUMBNAIL_LIVE_INTERVAL,
+                on_snapshot=self._publish_snapshot,
+                input_profile=self.input_profile,
+                socket_timeout=settings.FFMPEG_TIMEOUT,
+                socket_timeout_option=settings.FFMPEG_RTSP_TIMEOUT_OPTION,
+            )
+            self.gop_buffers = self._new_gop_buffers()
             success = await self.ffmpeg_process.start()
             
             if success:
+                self.source = self.ffmpeg_process
                 self.is_playing = True
                 logger.info(f"FFmpeg started successfully for stream {self.stream_id}")
-                asyncio.create_task(self._stream_video_data())
+                if settings.STREAM_STALL_TIMEOUT:
+                    self._watchdog_task = asyncio.create_task(self._watchdog(self.ffmpeg_process))
+                for rendition in self.ffmpeg_process.renditions:
+                    asyncio.create_task(self._stream_video_data(rendition))
                 logger.info(f"Started shared stream for: {self._mask_url(self.rtsp_url)}")
                 return True
             else:
                 logger.error(f"Failed to start FFmpeg for stream: {self._mask_url(self.rtsp_url)}")
+                self._release_slot()
+                if not restarting:
+                    await self._close_lease()
                 return False
-                
+        
         except Exception as e:
             logger.error(f"Error starting stream: {e}")
+            self._release_slot()
+            if not restarting:
+                await self._close_lease()
             return False
     
+    async def _set_renditions(self, renditions):
+        """Produce these renditions from now on, closing video connections to any that went away"""
+        if renditions == self.renditions:
+            return
+        if PASSTHROUGH in self.renditions and PASSTHROUGH not in renditions:
+            codec = (self.input_profile or {}).get('codec')
+            logger.warning(f"Not offering passthrough for stream {self.stream_id}: camera sends {codec}")
+        self.renditions = renditions
+        self.gop_buffers = self._new_gop_buffers()
+        for connection, subscriber in list(self.subscribers.items()):
+            if subscriber.rendition in renditions:
+                continue
+            del self.subscribers[connection]
+            await subscriber.close()
+            self.departed.update({field: getattr(subscriber, field) for field in TRAFFIC_FIELDS})
+            # Its disconnect removes it from connections like any other
+            await connection.close(code=CLOSE_CODE_UNSUPPORTED_QUALITY)
+    
     async def stop(self):
+        # Mark stopped before awaiting so the broadcast tasks don't report the shutdown as a crash
+        self.source = None
+        self.is_playing = False
+        self._cancel_linger()
+        self._cancel_restart()
+        self.restart_attempts = 0
+        if self._watchdog_task:
+            self._watchdog_task.cancel()
+            self._watchdog_task = None
+        self._stalled = False
+        # Stop taking relay followers first so none of them attach to an ingest that is going away
+        await self._close_lease()
         if self.ffmpeg_process:
             await self.ffmpeg_process.stop()
             self.ffmpeg_process = None
-        self.is_playing = False
+        self._release_slot()
         logger.info(f"Stopped shared stream for: {self._mask_url(self.rtsp_url)}")
     
-    async def _stream_video_data(self):
-        """Stream video data to all connected WebSockets"""
-        logger.info(f"Starting video streaming for stream {self.stream_id}")
+    async def _close_lease(self, error=None):
+        if self.lease:
+            lease, self.lease = self.lease, None
+            await lease.close(error)
+    
+    def _release_slot(self):
+        if self.admission:
+            self.admission.release(self.key)
+    
+    async def _notify_queued(self, position):
+        """Tell control connections the ingest is waiting for a slot"""
+        await self._notify_control({
+            'type': 'status',
+            'phase': 'queued',
+            'position': position
+        })
+    
+    async def _notify_control(self, message):
+        for connection in [conn for conn in self.connections if not conn.video_only]:
+            try:
+                await connection.send(text_data=json.dumps(message))
+            except Exception as e:
+                logger.error(f"Error notifying control connection: {e}")
+    
+    async def _stream_video_data(self, rendition):
+        """Stream one rendition's video data to its connected WebSockets"""
+        logger.info(f"Starting video streaming for stream {self.stream_id} ({rendition})")
         try:
             chunk_count = 0
-            while self.is_playing and self.ffmpeg_process and self.ffmpeg_process.is_alive():
-                chunk = await self.ffmpeg_process.read_output()
-                
-                if chunk is None:
-                    logger.info(f"FFmpeg process ended for stream {self.stream_id}")
+            source = self.source
+            lease = self.lease
+            gop_buffer = self.gop_buffers[rendition]
+            primary = rendition == self.renditions[0]
+            pacer = ChunkPacer(
+                max_frame_bytes=settings.STREAM_FRAME_MAX_BYTES,
+                max_delay=settings.STREAM_FRAME_MAX_DELAY,
+                max_rate=settings.STREAM_MAX_RATE,
+            )
+            async for frame in pacer.frames_from(source, rendition):
+                if not self.is_playing or self.source is not source:
                     break
                 
+                # Index the frame at packet boundaries, then copy it once for the wire
+                keyframe_offset = None
+                position = 0
+                pictures = gop_buffer.pictures
+                for batch in frame:
+                    offset = gop_buffer.push(batch)
+                    if offset is not None:
+                        keyframe_offset = position + offset
+                    position += batch.nbytes
+                chunk = frame[0].data.tobytes() if len(frame) == 1 else b''.join(batch.data for batch in frame)
+                
+                # Input counters for the stall watchdog and /metrics
+                self.last_data_at = time.monotonic()
+                self.bytes_in += len(chunk)
+                self.chunks_in += 1
+                if primary:
+                    self.frames_in += gop_buffer.pictures - pictures
+                
+                if lease:
+                    lease.publish(rendition, chunk)
+                
                 chunk_count += 1
+                if chunk_count == 1 and self.started_at is not None and self.time_to_first_frame is None:
+                    self._on_first_frame()
                 if chunk_count % 100 == 0:  # Log every 100 chunks
-                    logger.info(f"Stream {self.stream_id}: sent {chunk_count} chunks, chunk size: {len(chunk)} bytes")
+                    logger.info(f"Stream {self.stream_id} ({rendition}): sent {chunk_count} chunks, chunk size: {len(chunk)} bytes")
                 
                 # Log first few chunks for debugging
                 if chunk_count <= 5:
-                    logger.info(f"Stream {self.stream_id}: chunk {chunk_count}, size: {len(chunk)} bytes, first 16 bytes: {chunk[:16].hex()}")
-                
-                # Send to all video-only connections
-                video_connections = [conn for conn in self.connections if conn.video_only]
-                control_connections = [conn for conn in self.connections if not conn.video_only]
+                    logger.info(f"Stream {self.stream_id} ({rendition}): chunk {chunk_count}, size: {len(chunk)} bytes, first 16 bytes: {chunk[:16].hex()}")
                 
-                logger.debug(f"Stream {self.stream_id}: {len(video_connections)} video connections, {len(control_connections)} control connections")
-                
-                if video_connections:
-                    logger.debug(f"Sending chunk to {len(video_connections)} video connections, chunk size: {len(chunk)} bytes")
-                    for connection in video_connections:
-                        try:
-                            await connection.send(bytes_data=chunk)
-                        except Exception as e:
-                            logger.error(f"Error sending video to connection: {e}")
-                            await self.remove_connection(connection)
+                # Hand the chunk to every subscriber of this rendition without waiting on any of them
+                if self.subscribers:
+                    for subscriber in list(self.subscribers.values()):
+                        if subscriber.rendition == rendition:
+                            subscriber.offer(chunk, keyframe_offset)
                 else:
                     logger.debug(f"No video connections to send chunk to")
-                
-                await asyncio.sleep(0.01)
             
             # Stream ended
-            if self.is_playing:
+            if self.is_playing and self.source is source:
                 self.is_playing = False
+                self.source = None
+                self._release_slot()
+                if lease and not lease.owner and source.error:
+                    # The owner gave up on the camera (e.g. AUTH); taking over would only repeat its failure
+                    logger.warning(f"Relay owner for stream {self.stream_id} gave up: {source.error['code']}")
+                    await self._close_lease()
+                    self.last_error = source.error['code']
+                    self.failure = source.error
+                    await self._notify_exit(source.error)
+                    return
+                if lease and not lease.owner and self.connections:
+                    # The owning process went away; one of its followers takes over the ingest
+                    logger.info(f"Relay owner for stream {self.stream_id} went away, taking over")
+                    await self._close_lease()
+                    await self._take_over()
+                    return
+                logger.info(f"FFmpeg process ended for stream {self.stream_id}")
+                watched = bool(self.connections or self.pinned or (lease and lease.followers))
+                if self.started_at is not None and self.input_profile and self.time_to_first_frame is None:
+                    await self._forget_input_profile()
                 logger.info(f"Stream {self.stream_id} ended - total chunks sent: {chunk_count}")
-                # Notify control connections
-                control_connections = [conn for conn in self.connections if not conn.video_only]
-                for connection in control_connections:
-                    try:
-                        await connection.send(text_data=json.dumps({
-                            'type': 'error',
-                            'code': 'FFMPEG_EXIT',
-                            'message': 'Stream ended unexpectedly'
-                        }))
-                    except Exception as e:
-                        logger.error(f"Error notifying control connection: {e}")
-                        await self.remove_connection(connection)
-                
+                await self._supervise_exit(watched)
+        
         except Exception as e:
             logger.error(f"Error streaming video data: {e}")
 
+    async def _supervise_exit(self, watched):
+        """FFmpeg ended on its own: restart it with backoff while someone is watching, unless the error is permanent.
+
+        The owner lease is held until we give up, so relay followers wait out the
+        backoff with us instead of taking over and retrying the camera at once.
+        """
+        error = {}
+        if self.ffmpeg_process:
+            error = await self.ffmpeg_process.get_error_info()
+            await self.ffmpeg_process.stop()
+            self.ffmpeg_process = None
+        if self._stalled:
+            # We killed it; whatever it logged is not the reason
+            error = {'code': 'STALL', 'message': 'Stream stalled', 'details': ''}
+            self._stalled = False
+        code = error.get('code', 'UNKNOWN')
+        self.exit_errors[code] += 1
+        if self.manager:
+            self.manager.exit_errors[code] += 1
+        self.last_error = code
+        if error:
+            lines = error['details'].strip().splitlines()
+            last_line = lines[-1].replace(self.rtsp_url, self._mask_url(self.rtsp_url)) if lines else ''
+            logger.warning(f"FFmpeg for stream {self.stream_id} exited: {code}" + (f" ({last_line})" if last_line else ''))
+        
+        max_attempts = settings.STREAM_RESTART_MAX_ATTEMPTS
+        if code in PERMANENT_ERRORS:
+            logger.error(f"Not restarting stream {self.stream_id}: {error['message']}")
+        elif not watched:
+            logger.info(f"Not restarting stream {self.stream_id} - nobody is watching")
+        elif max_attempts is not None and self.restart_attempts >= max_attempts:
+            logger.error(f"Giving up on stream {self.stream_id} after {self.restart_attempts} restarts")
+        else:
+            delay = self._restart_delay()
+            self.restart_attempts += 1
+            logger.info(f"Restarting stream {self.stream_id} in {delay:.1f}s (attempt {self.restart_attempts})")
+            self._restart_task = asyncio.create_task(self._restart_after(delay))
+            await self._notify_control({
+                'type': 'status',
+                'phase': 'reconnecting',
+                'attempt': self.restart_attempts,
+                'retry_in': round(delay, 1),
+                'code': code,
+            })
+            return
+        # Followers hear why we gave up, so they pass it on instead of retrying the camera themselves
+        self.failure = {'code': code, 'message': error.get('message', 'Stream ended unexpectedly')}
+        self.failed_at = time.monotonic()
+        await self._close_lease(self.failure)
+        await self._notify_exit(error)
+        if self.manager and not self.connections:
+            # Kept while restarting; nobody is left to release it
+            self._cancel_restart()
+            await self.manager.release_stream(self)
+    
+    async def _watchdog(self, process):
+        """Kill an FFmpeg that is still running but has stopped producing video"""
+        timeout = settings.STREAM_STALL_TIMEOUT
+        self.last_data_at = None
+        counted = (self.bytes_in, self.frames_in)
+        while self.ffmpeg_process is process and self.is_playing:
+            await asyncio.sleep(STALL_CHECK_INTERVAL)
+            self.input_rate = {
+                'bytes_per_second': round((self.bytes_in - counted[0]) / STALL_CHECK_INTERVAL),
+                'frames_per_second': round((self.frames_in - counted[1]) / STALL_CHECK_INTERVAL, 1),
+            }
+            counted = (self.bytes_in, self.frames_in)
+            
+            # Connecting and input analysis get twice as long before the first frame
+            silent_for = time.monotonic() - (self.last_data_at or self.started_at)
+            if silent_for < (timeout if self.last_data_at else timeout * 2) or not process.is_alive():
+                continue
+            self.stalls += 1
+            self._stalled = True
+            logger.warning(f"Stream {self.stream_id} stalled: no video for {silent_for:.0f}s, restarting FFmpeg")
+            await self._notify_control({
+                'type': 'status',
+                'phase': 'stalled',
+                'silent_for': round(silent_for, 1),
+            })
+            # The outputs end, and the broadcast hands over to the restart supervisor
+            process.kill()
+            return
+    
+    def _restart_delay(self):
+        """Seconds before the next restart, doubling with every attempt"""
+        delay = min(settings.STREAM_RESTART_BACKOFF * 2 ** self.restart_attempts, settings.STREAM_RESTART_MAX_BACKOFF)
+        return delay * random.uniform(1 - RESTART_JITTER, 1 + RESTART_JITTER)
+    
+    async def _restart_after(self, delay):
+        await asyncio.sleep(delay)
+        try:
+            started = await self.start()
+        except AdmissionRejected as e:
+            logger.warning(f"No slot to restart stream {self.stream_id}: {e.message}")
+            started = False
+        if started:
+            self.restarts += 1
+            if self.manager:
+                self.manager.restarts += 1
+            # Viewers stayed connected; the new FFmpeg output starts with a keyframe
+            await self._notify_control({'type': 'status', 'phase': 'playing'})
+        else:
+            await self._supervise_exit(bool(self.connections or self.pinned or (self.lease and self.lease.followers)))
+    
+    async def _abandon_restart(self):
+        self._cancel_restart()
+        self.restart_attempts = 0
+        await self._close_lease()
+    
+    def _cancel_restart(self):
+        if self.is_restarting and self._restart_task is not asyncio.current_task():
+            self._restart_task.cancel()
+        self._restart_task = None
+    
+    def _on_first_frame(self):
+        self.restart_attempts = 0
+        self.time_to_first_frame = time.monotonic() - self.started_at
+        if self.manager:
+            self.manager.first_frame_latency.observe(self.time_to_first_frame)
+        logger.info(f"Time to first frame for stream {self.stream_id}: {self.time_to_first_frame:.2f}s "
+                    f"({'stored input profile' if self.input_profile else 'full input analysis'})")
+        if not self.input_profile and not self._profile_rejected:
+            # The camera works; learn its profile so the next start can skip input analysis
+            self._profile_task = asyncio.create_task(self._learn_input_profile())
+    
+    def _camera_streams(self):
+        """Active stream rows of this camera, whatever spelling of its URL they were saved with"""
+        return Stream.objects.filter(url_key=self.key, is_active=True)
+    
+    async def _load_input_profile(self):
+        try:
+            streams = self._camera_streams()
+            return await streams.filter(input_profile__isnull=False).values_list('input_profile', flat=True).afirst()
+        except Exception as e:
+            logger.warning(f"Could not load input profile for stream {self.stream_id}: {e}")
+            return None
+    
+    async def _learn_input_profile(self):
+        """Build the profile from the probe stored when the stream was added; probing again
+        would open a second RTSP session, which single-session cameras answer by dropping ours"""
+        try:
+            streams = self._camera_streams()
+            probed = await streams.filter(codec__isnull=False).order_by('-probed_at').values(
+                'codec', 'width', 'height', 'fps'
+            ).afirst()
+            profile = probe_service.input_profile({'ok': True, **probed}) if probed else None
+            if profile:
+                await streams.aupdate(input_profile=profile)
+                logger.info(f"Stored input profile for stream {self.stream_id}: {profile['codec']} "
+                            f"{profile['width']}x{profile['height']} from its stored probe")
+            else:
+                logger.info(f"Stream {self.stream_id} has no stored probe to build an input profile from; "
+                            f"`manage.py probe_streams` fills it in")
+        except Exception as e:
+            logger.warning(f"Could not learn input profile for stream {self.stream_id}: {e}")
+    
+    async def _forget_input_profile(self):
+        """The ingest died before its first frame; the camera may have changed since it was probed"""
+        logger.warning(f"Stream {self.stream_id} produced no frames with its stored input profile, "
+                       f"the next start analyzes the input again")
+        self._profile_rejected = True
+        try:
+            streams = self._camera_streams()
+            await streams.aupdate(input_profile=None)
+        except Exception as e:
+            logger.warning(f"Could not clear input profile for stream {self.stream_id}: {e}")
+    
+    async def _take_over(self):
+        try:
+            if await self.start():
+                return
+        except AdmissionRejected as e:
+            logger.warning(f"Could not take over stream {self.stream_id}: {e.message}")
+        await self._notify_exit(self.failure)
+    
+    async def _notify_exit(self, error=None):
+        """Tell control connections the stream ended, and why if FFmpeg said so"""
+        known = error and error.get('code', 'UNKNOWN') != 'UNKNOWN'
+        await self._notify_control({
+            'type': 'error',
+            'code': error['code'] if known else 'FFMPEG_EXIT',
+            'message': error['message'] if known else 'Stream ended unexpectedly'
+        })
+    
+    def _downgrade_subscriber(self, subscriber):
+        """Move a lagging subscriber to a cheaper rendition. Returns False when none is available."""
+        # The passthrough carries the camera's own codec; MPEG-1 players can't switch to or from it
+        ladder = [name for name in self.renditions if name != PASSTHROUGH]
+        index = ladder.index(subscriber.rendition) if subscriber.rendition in ladder else 0
+        if index == 0:
+            return False
+        lower = ladder[index - 1]
+        logger.info(f"Downgrading subscriber {subscriber.client_id} on stream {self.stream_id} from {subscriber.rendition} to {lower}")
+        subscriber.switch_to(lower, self.gop_buffers[lower].replay())
+        return True
+
+    async def _on_subscriber_error(self, subscriber):
+        """Drop a subscriber whose WebSocket failed or was closed for lagging"""
+        await self.remove_connection(subscriber.connection)
+
+    def get_resource_stats(self):
+        """What this stream costs: FFmpeg CPU, memory and pipe backlog, next to its throughput and viewers"""
+        ffmpeg = self.ffmpeg_process.get_resource_stats() if self.ffmpeg_process and self.is_playing else None
+        subscribers = list(self.subscribers.values())
+        return {
+            'stream_id': self.stream_id,
+            'url': self._mask_url(self.key),
+            'is_playing': self.is_playing,
+            'ingest': 'ffmpeg' if ffmpeg else ('relay' if self.is_playing else None),
+            'ffmpeg': ffmpeg,
+            'input': self.input_rate if ffmpeg else None,
+            'traffic': self.get_traffic(),
+            'viewers': {
+                'video': len(subscribers),
+                'control': len(self.connections) - len(subscribers),
+                'renditions': {
+                    name: sum(1 for subscriber in subscribers if subscriber.rendition == name)
+                    for name in self.renditions
+                },
+            },
+        }
+
+    def get_traffic(self):
+        """Bytes and chunks in and out over the life of this stream, including viewers that left"""
+        totals = Counter(self.departed)
+        for subscriber in list(self.subscribers.values()):
+            totals.update({field: getattr(subscriber, field) for field in TRAFFIC_FIELDS})
+        return {
+            'bytes_in': self.bytes_in,
+            'chunks_in': self.chunks_in,
+            **{field: totals[field] for field in TRAFFIC_FIELDS},
+        }
+
+    def get_stats(self):
+        """Viewer counts and per-subscriber fan-out counters"""
+        subscribers = list(self.subscribers.values())
+        return {
+            'stream_id': self.stream_id,
+            'url': self._mask_url(self.key),
+            'is_playing': self.is_playing,
+            'pinned': self.pinned,
+            'idle_for': round(time.monotonic() - self.idle_since) if self.is_lingering else None,
+            'restarting': self.is_restarting,
+            'restarts': self.restarts,
+            'last_error': self.last_error,
+            'exit_errors': dict(self.exit_errors),
+            'stalls': self.stalls,
+            'input': self.input_rate if self.ffmpeg_process and self.is_playing else None,
+            'traffic': self.get_traffic(),
+            'resources': self.ffmpeg_process.get_resource_stats() if self.ffmpeg_process and self.is_playing else None,
+            'relay': self.lease.get_stats() if self.lease else None,
+            'time_to_first_frame': round(self.time_to_first_frame, 3) if self.time_to_first_frame is not None else None,
+            'connections': len(self.connections),
+            'renditions': {
+                name: sum(1 for subscriber in subscribers if subscriber.rendition == name)
+                for name in self.renditions
+            },
+            'subscribers': [subscriber.get_stats() for subscriber in subscribers],
+        }
+
     async def send_video_data(self, data):
         """Send video data to this connection (only for video-only connections)"""
         if self.video_only:
@@ -155,7 +908,8 @@ class StreamInfo:
         if not self.video_only:
             await super().send(text_data=data)
     
-    def _mask_url(self, url):
+    @staticmethod
+    def _mask_url(url):
         """Mask credentials in URL for logging"""
         if not url:
             return url
@@ -182,18 +936,23 @@ class StreamConsumer(AsyncWebsocketConsumer):
         self.stream_id = None
         self.rtsp_url = None
         self.video_only = False
+        self.quality = None
         self.stream_info = None
+        self.stream_key = None
+        self.client_address = None
+        self.client_registered = False
 
     async def connect(self):
         """Handle WebSocket connection"""
         try:
             # Get stream ID or URL from query parameters
             query_string = self.scope.get('query_string', b'').decode('utf-8')
-            params = dict(item.split('=') for item in query_string.split('&') if '=' in item)
+            params = dict(parse_qsl(query_string))
             
             self.stream_id = params.get('id')
             self.rtsp_url = params.get('url')
             self.video_only = params.get('video_only', 'false').lower() == 'true'
+            self.quality = params.get('quality')
             self.client_id = params.get('client_id', 'unknown')
             
             logger.info(f"WebSocket connection attempt - stream_id: {self.stream_id}, client_id: {self.client_id}, video_only: {self.video_only}")
@@ -215,9 +974,21 @@ class StreamConsumer(AsyncWebsocketConsumer):
                 await self.close(code=4000, reason="Invalid RTSP URL")
                 return
             
-            # Accept the connection
+            # Accept the connection; closing before this would reject the handshake and the
+            # browser would only ever see 1006
             await self.accept()
             
+            if self.video_only and resolve_quality(self.quality, supported_renditions(settings.STREAM_RENDITIONS)) is None:
+                # e.g. ?quality=source when the passthrough isn't enabled
+                await self.close(code=CLOSE_CODE_UNSUPPORTED_QUALITY)
+                return
+            
+            # Enforce MAX_STREAMS_PER_CLIENT before attaching to the shared stream
+            self.stream_key = normalize_rtsp_url(self.rtsp_url)
+            self.client_address = self._get_client_address()
+            stream_manager.register_client(self.client_address, self.stream_key)
+            self.client_registered = True
+            
             # Get or create shared stream info
             self.stream_info = await stream_manager.get_or_create_stream(self.stream_id or 'direct', self.rtsp_url)
             await self.stream_info.add_connection(self)
@@ -236,6 +1007,8 @@ class StreamConsumer(AsyncWebsocketConsumer):
                 }))
                 logger.info(f"Control WebSocket connected for stream: {self._mask_url(self.rtsp_url)}, client: {self.client_id}")
             
+        except AdmissionRejected as e:
+            await self._reject(e)
         except Exception as e:
             logger.error(f"Error in WebSocket connect: {e}")
             await self.close(code=1011, reason="Internal server error")
@@ -245,6 +1018,11 @@ class StreamConsumer(AsyncWebsocketConsumer):
         try:
             if self.stream_info:
                 await self.stream_info.remove_connection(self)
+                await stream_manager.release_stream(self.stream_info)
+            
+            if self.client_registered:
+                stream_manager.unregister_client(self.client_address, self.stream_key)
+                self.client_registered = False
             
             logger.info(f"WebSocket disconnected for stream: {self._mask_url(self.rtsp_url) if self.rtsp_url else 'unknown'}, client: {getattr(self, 'client_id', 'unknown')}")
             
@@ -301,13 +1079,18 @@ class StreamConsumer(AsyncWebsocketConsumer):
             }))
             
             # Start the shared stream
-            success = await self.stream_info.start()
+            try:
+                success = await self.stream_info.start()
+            except AdmissionRejected as e:
+                await self._reject(e)
+                return
             
             if not success:
+                failure = self.stream_info.failure or {}
                 await self.send(text_data=json.dumps({
                     'type': 'error',
-                    'code': 'FFMPEG_START_FAILED',
-                    'message': 'Failed to start video stream'
+                    'code': failure.get('code', 'FFMPEG_START_FAILED'),
+                    'message': failure.get('message', 'Failed to start video stream')
                 }))
                 return
             
@@ -345,11 +1128,31 @@ class StreamConsumer(AsyncWebsocketConsumer):
             logger.error(f"Error stopping stream: {e}")
 
     async def _reconnect_stream(self):
-        """Reconnect the stream"""
-        await self._stop_stream()
-        await asyncio.sleep(1)  # Brief pause
+        """Restart the shared stream right away; viewers stay connected"""
+        if self.stream_info:
+            await self.stream_info.stop()
         await self._start_stream()
 
+    async def _reject(self, error):
+        """Close a connection that was not admitted, explaining why on control sockets"""
+        logger.warning(f"Rejected connection from {getattr(self, 'client_address', 'unknown')} to stream {self._mask_url(self.stream_key or self.rtsp_url or '')}: {error.message}")
+        if not self.video_only:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'code': error.error_code,
+                'message': error.message
+            }))
+        await self.close(code=error.close_code)
+
+    def _get_client_address(self):
+        """Client address used for MAX_STREAMS_PER_CLIENT, honouring X-Forwarded-For behind a proxy"""
+        headers = dict(self.scope.get('headers', []))
+        forwarded = headers.get(b'x-forwarded-for')
+        if forwarded:
+            return forwarded.decode('latin-1').split(',')[0].strip()
+        client = self.scope.get('client')
+        return client[0] if client else 'unknown'
+
     @database_sync_to_async
     def _get_stream(self, stream_id):
         """Get stream from database"""
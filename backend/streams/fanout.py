@@ -0,0 +1,200 @@
+import time
+import asyncio
+import logging
+from typing import Optional, Dict, Any, Callable
+
+from .metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# What to do with a viewer whose send queue is full
+POLICY_DROP_UNTIL_KEYFRAME = 'drop_until_keyframe'
+POLICY_DOWNGRADE = 'downgrade'
+POLICY_DISCONNECT = 'disconnect'
+SLOW_SUBSCRIBER_POLICIES = (POLICY_DROP_UNTIL_KEYFRAME, POLICY_DOWNGRADE, POLICY_DISCONNECT)
+
+# WebSocket close code sent to viewers dropped by the disconnect policy
+CLOSE_CODE_TOO_SLOW = 4008
+
+class Subscriber:
+    """A single video viewer with its own bounded send queue and writer task.
+
+    The broadcaster hands chunks over with offer(), which never awaits, so one
+    slow viewer can no longer stall the other viewers of the same camera.
+    """
+
+    def __init__(self, connection, max_queue: int = 64, policy: str = POLICY_DROP_UNTIL_KEYFRAME,
+                 on_downgrade: Optional[Callable[['Subscriber'], bool]] = None,
+                 on_error: Optional[Callable[['Subscriber'], Any]] = None,
+                 on_first_chunk: Optional[Callable[['Subscriber'], Any]] = None,
+                 rendition: Optional[str] = None, send_latency: Optional[Histogram] = None):
+        if policy not in SLOW_SUBSCRIBER_POLICIES:
+            raise ValueError(f"Unknown slow subscriber policy: {policy}")
+
+        self.connection = connection
+        self.rendition = rendition
+        self.client_id = getattr(connection, 'client_id', 'unknown')
+        self.policy = policy
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.on_downgrade = on_downgrade
+        self.on_error = on_error
+        self.on_first_chunk = on_first_chunk
+        self.send_latency = send_latency  # shared histogram of WebSocket send times
+        self.waiting_for_keyframe = False
+        self.closed = False
+        self.task: Optional[asyncio.Task] = None
+        self.attached_at = time.monotonic()
+        self.first_chunk_at: Optional[float] = None
+
+        # Counters
+        self.queued_bytes = 0
+        self.sent_chunks = 0
+        self.sent_bytes = 0
+        self.dropped_chunks = 0
+        self.dropped_bytes = 0
+        self.lag_events = 0
+        self.max_lag = 0
+        self.replayed_bytes = 0
+        self.downgrades = 0
+
+    def start(self, replay: Optional[bytes] = None):
+        """Start the writer task, sending the replay (if any) ahead of live chunks"""
+        if replay:
+            self.queue.put_nowait(replay)
+            self.queued_bytes += len(replay)
+            self.replayed_bytes = len(replay)
+        if not self.task:
+            self.task = asyncio.create_task(self._writer())
+
+    def switch_to(self, rendition: str, replay: Optional[bytes] = None):
+        """Move to another rendition, restarting from its latest keyframe"""
+        self._flush()
+        self.rendition = rendition
+        self.downgrades += 1
+        if replay:
+            self.queue.put_nowait(replay)
+            self.queued_bytes += len(replay)
+            self.waiting_for_keyframe = False
+        else:
+            self.waiting_for_keyframe = True
+
+    async def close(self):
+        """Stop the writer task and discard anything still queued"""
+        self.closed = True
+        self._flush()
+        if self.task and self.task is not asyncio.current_task():
+            self.task.cancel()
+            try:
+                await self.task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self.task = None
+
+    def offer(self, chunk: bytes, keyframe_offset: Optional[int] = None) -> bool:
+        """Queue a chunk for this viewer without blocking. Returns False if it was dropped.
+
+        keyframe_offset is where a new GOP starts inside the chunk, if it does.
+        """
+        if self.closed:
+            return False
+
+        if self.waiting_for_keyframe:
+            if keyframe_offset is None:
+                self._count_drop(chunk)
+                return False
+            self.waiting_for_keyframe = False
+            if keyframe_offset:
+                self.dropped_bytes += keyframe_offset
+                chunk = chunk[keyframe_offset:]
+
+        try:
+            self.queue.put_nowait(chunk)
+        except asyncio.QueueFull:
+            self.lag_events += 1
+            self._handle_lag()
+            self._count_drop(chunk)
+            return False
+
+        self.queued_bytes += len(chunk)
+        self.max_lag = max(self.max_lag, self.queue.qsize())
+        return True
+
+    def _handle_lag(self):
+        """Apply the slow subscriber policy once the queue is full"""
+        logger.debug(f"Subscriber {self.client_id} is lagging ({self.queue.qsize()} chunks queued), policy: {self.policy}")
+
+        if self.policy == POLICY_DISCONNECT:
+            logger.warning(f"Disconnecting slow subscriber {self.client_id}")
+            self.closed = True
+            self._flush()
+            asyncio.create_task(self._disconnect())
+            return
+
+        if self.policy == POLICY_DOWNGRADE and self.on_downgrade and self.on_downgrade(self):
+            return
+
+        # Drop the backlog and resume from the next keyframe so the viewer catches up to live
+        self._flush()
+        self.waiting_for_keyframe = True
+
+    def _flush(self):
+        """Drop every queued chunk"""
+        while not self.queue.empty():
+            self._count_drop(self.queue.get_nowait())
+        self.queued_bytes = 0
+
+    def _count_drop(self, chunk: bytes):
+        self.dropped_chunks += 1
+        self.dropped_bytes += len(chunk)
+
+    async def _disconnect(self):
+        try:
+            await self.connection.close(code=CLOSE_CODE_TOO_SLOW)
+        except Exception as e:
+            logger.debug(f"Error closing slow subscriber {self.client_id}: {e}")
+        if self.on_error:
+            await self.on_error(self)
+
+    async def _writer(self):
+        """Send queued chunks to the WebSocket one at a time"""
+        try:
+            while True:
+                chunk = await self.queue.get()
+                self.queued_bytes = max(0, self.queued_bytes - len(chunk))
+                started = time.monotonic()
+                await self.connection.send(bytes_data=chunk)
+                if self.send_latency:
+                    self.send_latency.observe(time.monotonic() - started)
+                self.sent_chunks += 1
+                self.sent_bytes += len(chunk)
+                if self.first_chunk_at is None:
+                    self.first_chunk_at = time.monotonic()
+                    if self.on_first_chunk:
+                        self.on_first_chunk(self)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Error sending video to connection: {e}")
+            self.closed = True
+            if self.on_error:
+                await self.on_error(self)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-subscriber lag and drop counters"""
+        return {
+            'client_id': self.client_id,
+            'rendition': self.rendition,
+            'policy': self.policy,
+            'lag_chunks': self.queue.qsize(),
+            'lag_bytes': self.queued_bytes,
+            'max_lag_chunks': self.max_lag,
+            'lag_events': self.lag_events,
+            'sent_chunks': self.sent_chunks,
+            'sent_bytes': self.sent_bytes,
+            'dropped_chunks': self.dropped_chunks,
+            'dropped_bytes': self.dropped_bytes,
+            'waiting_for_keyframe': self.waiting_for_keyframe,
+            'replayed_bytes': self.replayed_bytes,
+            'time_to_first_chunk': round(self.first_chunk_at - self.attached_at, 3) if self.first_chunk_at else None,
+            'downgrades': self.downgrades,
+        }
@@ -1,20 +1,251 @@
 import asyncio
 import logging
+import mmap
+import os
 import subprocess
 import sys
-from typing import Optional, Dict, Any
-from urllib.parse import urlparse
+import time
+from array import array
+from collections import deque
+from typing import Optional, Dict, Any, AsyncIterator, Deque, List, Callable
+from urllib.parse import urlparse, urlunparse, quote, unquote
 import re
 
 logger = logging.getLogger(__name__)
 
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+# Per-packet flags carried by TSBatch
+TS_FLAG_PAYLOAD_START = 0x01
+TS_FLAG_RANDOM_ACCESS = 0x02
+
+# Bytes requested per stdout read (174 TS packets); a read returns as soon as any data is buffered
+DEFAULT_READ_SIZE = TS_PACKET_SIZE * 174
+# Number of stderr lines kept for error classification
+STDERR_BUFFER_LINES = 200
+# Error codes from _parse_ffmpeg_errors that restarting FFmpeg won't fix
+PERMANENT_ERRORS = {'AUTH', 'NOT_FOUND'}
+# MPEG-1 sequence header start code; the encoder repeats it in front of every keyframe
+MPEG1_SEQUENCE_HEADER = b'\x00\x00\x01\xb3'
+
+# MPEG-1 rendition ladder, cheapest first. 'medium' matches the original single output.
+QUALITY_PRESETS = {
+    'low': {'width': 320, 'q': 10, 'fps': 15},     # grid tiles
+    'medium': {'width': None, 'q': 6, 'fps': 25},  # native resolution
+    'high': {'width': None, 'q': 3, 'fps': 25},
+}
+QUALITY_ORDER = ('low', 'medium', 'high')
+DEFAULT_QUALITY = 'medium'
+
+# Passthrough rendition: the camera's own H.264/HEVC, copied into MPEG-TS without re-encoding,
+# for clients that decode it themselves (MSE players). Only offered to viewers asking for it.
+PASSTHROUGH = 'source'
+PASSTHROUGH_CODECS = {'h264', 'hevc'}
+
+# Extra output carrying occasional JPEG stills of the live feed, used for thumbnails
+SNAPSHOT_OUTPUT = 'snapshot'
+SNAPSHOT_SIZE = (320, 240)
+JPEG_SOI = b'\xff\xd8'
+JPEG_EOI = b'\xff\xd9'
+# Give up on a JPEG that never ends rather than buffering forever
+MAX_SNAPSHOT_BYTES = 4 * 1024 * 1024
+
+# Units of the CPU times in /proc/<pid>/stat
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+# Input analysis for cameras without a known input profile: enough to catch SPS/PPS sent in-band
+DEFAULT_PROBE_OPTIONS = ['-probesize', '1000000', '-analyzeduration', '2000000']
+# Decoders we name explicitly once the profile says which one the camera needs
+FORCED_DECODERS = {'h264', 'hevc', 'mpeg4', 'mjpeg'}
+
+def input_options(profile: Optional[Dict[str, Any]]) -> List[str]:
+    """FFmpeg input options for a camera's input profile (see ProbeService.input_profile).
+    
+    When the camera's SDP carries the codec's parameter sets (extradata, i.e.
+    H.264 SPS/PPS) FFmpeg can set up the decoder before the first packet, so
+    input analysis is skipped. Without them it has to wait for them in-band,
+    and without a profile we don't know either way.
+    """
+    if not profile or not profile.get('codec'):
+        return list(DEFAULT_PROBE_OPTIONS)
+    if profile.get('extradata_size'):
+        options = ['-probesize', '32', '-analyzeduration', '0']
+    else:
+        options = ['-probesize', '500000', '-analyzeduration', '1000000']
+    if profile['codec'] in FORCED_DECODERS:
+        options += ['-c:v', profile['codec']]
+    return options
+
+def resolve_quality(requested: Optional[str], available) -> Optional[str]:
+    """Pick the rendition in `available` closest to the requested quality.
+    
+    Passthrough and the MPEG-1 ladder need different decoders, so a request is
+    never answered with the other kind; None means nothing suitable is available.
+    """
+    if requested == PASSTHROUGH:
+        return PASSTHROUGH if PASSTHROUGH in available else None
+    available = [name for name in QUALITY_ORDER if name in available]
+    if not available:
+        return None
+    if requested not in QUALITY_PRESETS:
+        requested = DEFAULT_QUALITY
+    if requested in available:
+        return requested
+    wanted = QUALITY_ORDER.index(requested)
+    # Closest rung of the ladder; ties go to the cheaper rendition
+    return min(available, key=lambda name: (abs(QUALITY_ORDER.index(name) - wanted), QUALITY_ORDER.index(name)))
+
+def supported_renditions(names) -> List[str]:
+    """Known renditions in ladder order (passthrough last), limited to one where extra output pipes are unavailable"""
+    renditions = [name for name in QUALITY_ORDER + (PASSTHROUGH,) if name in names] or [DEFAULT_QUALITY]
+    if len(renditions) > 1 and sys.platform == 'win32':
+        # Extra output pipes need pass_fds, which Windows does not support
+        single = resolve_quality(DEFAULT_QUALITY, renditions) or renditions[0]
+        logger.warning(f"Multiple renditions are not supported on Windows, using {single} only")
+        renditions = [single]
+    return renditions
+
+def passthrough_renditions(renditions, profile: Optional[Dict[str, Any]]) -> List[str]:
+    """renditions without the passthrough when the input profile says the camera sends a codec
+    MPEG-TS can't carry (MSE players couldn't decode it anyway), unless it is the only rendition"""
+    codec = (profile or {}).get('codec')
+    if PASSTHROUGH in renditions and codec and codec not in PASSTHROUGH_CODECS and len(renditions) > 1:
+        return [name for name in renditions if name != PASSTHROUGH]
+    return list(renditions)
+
+class TSBatch:
+    """A run of whole MPEG-TS packets plus per-packet metadata.
+
+    data is a memoryview over the bytes read from FFmpeg, so slicing out
+    packets never copies. pids and flags hold one entry per packet, and
+    payload_starts lists the packets with payload_unit_start set.
+    """
+    __slots__ = ('data', 'pids', 'flags', 'payload_starts')
+
+    def __init__(self, data: memoryview):
+        self.data = data
+        count = len(data) // TS_PACKET_SIZE
+        header_1 = data[1::TS_PACKET_SIZE]
+        header_2 = data[2::TS_PACKET_SIZE]
+        self.pids = array('H', [((high & 0x1F) << 8) | low for high, low in zip(header_1, header_2)])
+        self.flags = bytearray(count)
+        # Indices of packets that start a PES packet or PSI section
+        self.payload_starts = [index for index, high in enumerate(header_1) if high & 0x40]
+        for index in self.payload_starts:
+            self.flags[index] = TS_FLAG_PAYLOAD_START
+        for index, control in enumerate(data[3::TS_PACKET_SIZE]):
+            # Adaptation field present and long enough to carry the random access indicator
+            if control & 0x20:
+                offset = index * TS_PACKET_SIZE
+                if data[offset + 4] and data[offset + 5] & 0x40:
+                    self.flags[index] |= TS_FLAG_RANDOM_ACCESS
+
+    def __len__(self) -> int:
+        return len(self.flags)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data)
+
+    def packet(self, index: int) -> memoryview:
+        offset = index * TS_PACKET_SIZE
+        return self.data[offset:offset + TS_PACKET_SIZE]
+
+    def payload(self, index: int) -> Optional[memoryview]:
+        """Payload of a packet after any adaptation field, or None if it carries none"""
+        offset = index * TS_PACKET_SIZE
+        control = self.data[offset + 3]
+        start = 4
+        if control & 0x20:
+            start += 1 + self.data[offset + 4]
+        if not control & 0x10 or start >= TS_PACKET_SIZE:
+            return None
+        return self.data[offset + start:offset + TS_PACKET_SIZE]
+
+class TSDemuxer:
+    """Split an arbitrary byte stream into packet-aligned TSBatch objects.
+
+    Aligned runs are exposed as memoryviews over the original chunk. Only a
+    packet that straddles two reads is copied (188 bytes at most), and lost
+    sync is recovered by looking for two sync bytes one packet apart.
+    """
+
+    def __init__(self):
+        self._carry = b''
+        self.resyncs = 0
+
+    def feed(self, chunk: bytes) -> List[TSBatch]:
+        batches = []
+        view = memoryview(chunk)
+        offset = 0
+
+        if self._carry:
+            needed = TS_PACKET_SIZE - len(self._carry)
+            if len(chunk) < needed:
+                self._carry += chunk
+                return batches
+            packet = self._carry + chunk[:needed]
+            self._carry = b''
+            offset = needed
+            if packet[0] == TS_SYNC_BYTE:
+                batches.append(TSBatch(memoryview(packet)))
+
+        if offset < len(chunk) and chunk[offset] != TS_SYNC_BYTE:
+            offset = self._resync(chunk, offset)
+
+        end = offset + (len(chunk) - offset) // TS_PACKET_SIZE * TS_PACKET_SIZE
+        if end > offset:
+            batches.append(TSBatch(view[offset:end]))
+        self._carry = chunk[end:]
+        return batches
+
+    def _resync(self, chunk: bytes, offset: int) -> int:
+        self.resyncs += 1
+        position = chunk.find(TS_SYNC_BYTE, offset)
+        while position >= 0:
+            following = position + TS_PACKET_SIZE
+            if following >= len(chunk) or chunk[following] == TS_SYNC_BYTE:
+                return position
+            position = chunk.find(TS_SYNC_BYTE, position + 1)
+        return len(chunk)
+
 class FFmpegProcess:
-    def __init__(self, rtsp_url: str, quality: str = 'medium'):
+    def __init__(self, rtsp_url: str, quality: str = 'medium', read_size: int = DEFAULT_READ_SIZE,
+                 stderr_lines: int = STDERR_BUFFER_LINES, renditions: Optional[List[str]] = None,
+                 snapshot_interval: Optional[float] = None,
+                 on_snapshot: Optional[Callable[[bytes], Any]] = None,
+                 input_profile: Optional[Dict[str, Any]] = None,
+                 socket_timeout: Optional[float] = None, socket_timeout_option: str = '-timeout'):
         self.rtsp_url = rtsp_url
+        self.socket_timeout = socket_timeout  # seconds FFmpeg waits on a silent RTSP connection before exiting
+        self.socket_timeout_option = socket_timeout_option  # '-stimeout' before FFmpeg 5
+        self.input_profile = input_profile  # what we know about the camera's video, to skip input analysis
         self.quality = quality
-        self.process: Optional[subprocess.Popen] = None
+        self.read_size = read_size
+        # Every rendition is encoded by this one process from a single RTSP ingest
+        self.renditions = passthrough_renditions(supported_renditions(renditions or [quality]), input_profile)
+        self.process: Optional[asyncio.subprocess.Process] = None
         self.is_running = False
         self.error_message = None
+        self.stderr_buffer: Deque[str] = deque(maxlen=stderr_lines)
+        self._stderr_task: Optional[asyncio.Task] = None
+        self._output_urls: Dict[str, str] = {self.renditions[0]: 'pipe:1'}
+        self._readers: Dict[str, asyncio.StreamReader] = {}
+        self._pipe_transports = []
+        self.demuxers: Dict[str, TSDemuxer] = {name: TSDemuxer() for name in self.renditions}
+        # A JPEG every snapshot_interval seconds on its own pipe (not on Windows, which has no pass_fds)
+        self.snapshot_interval = snapshot_interval if sys.platform != 'win32' else None
+        self.on_snapshot = on_snapshot
+        self.latest_snapshot: Optional[bytes] = None
+        self.latest_snapshot_at: Optional[float] = None
+        self._snapshot_url: Optional[str] = None
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self._read_limit = max(self.read_size * 2, 64 * 1024)
+        # Resource usage of the child, updated by sample_resources()
+        self.cpu_seconds: Optional[float] = None
+        self.cpu_percent: Optional[float] = None
+        self.rss_bytes: Optional[int] = None
+        self._sampled_at: Optional[float] = None
         
     def _mask_credentials(self, url: str) -> str:
         """Mask credentials in URL for logging"""
@@ -27,84 +258,150 @@ class FFmpegProcess:
         return url
 
     def _get_ffmpeg_command(self) -> list:
-        TS_FPS = "25"        # tweak as needed
-        GOP    = "50"        # ~2x fps
-
-        return [
+        cmd = [
             "ffmpeg",
             "-nostdin",
             "-loglevel", "error",
             "-rtsp_transport", "tcp",
             "-fflags", "nobuffer",
             "-flags", "low_delay",
-            "-probesize", "32",
-            "-analyzeduration", "0",
-
+            *input_options(self.input_profile),
+        ]
+        if self.socket_timeout:
+            cmd += [self.socket_timeout_option, str(int(self.socket_timeout * 1000000))]  # microseconds
+        if self.renditions == [PASSTHROUGH]:
+            # Nothing is re-encoded; the snapshot output only needs the odd keyframe decoded
+            cmd += ["-skip_frame", "nokey"]
+        cmd += [
             "-i", self.rtsp_url,
-
-            # OUTPUT: MPEG-TS container with MPEG-1 video for JSMpeg
-            "-f", "mpegts",
-            "-codec:v", "mpeg1video",
-            "-q:v", "6",              # 2(best) … 31(worst). 6 is fine.
-            "-r", TS_FPS,             # fps
-            "-g", GOP,                # keyframe interval
-            "-bf", "0",               # no B-frames
-            "-an",                    # no audio
-            "-muxdelay", "0",
-            "-muxpreload", "0",
-
-            # Optional: fix size (uncomment if you want)
-            # "-s", "640x480",
-
-            "pipe:1",                 # stdout
         ]
 
-    def _start_process_sync(self) -> bool:
-        """Start the FFmpeg process synchronously"""
-        try:
-            cmd = self._get_ffmpeg_command()
-            
-            # Windows-specific subprocess creation
-            if sys.platform == 'win32':
-                self.process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    creationflags=subprocess.CREATE_NO_WINDOW
-                )
-            else:
-                self.process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
-                )
-            
-            self.is_running = True
-            logger.info(f"FFmpeg process started with PID: {self.process.pid}")
-            return True
-            
-        except Exception as e:
-            import traceback
-            self.error_message = f"Failed to start FFmpeg: {str(e)}"
-            logger.error(self.error_message)
-            logger.error(f"Exception type: {type(e).__name__}")
-            logger.error(f"Full traceback: {traceback.format_exc()}")
-            return False
+        names = list(self._output_urls)
+        # Passthrough is copied straight from the input; everything else goes through the decoder
+        encoded = [name for name in names if name != PASSTHROUGH]
+        outputs = len(encoded) + (1 if self._snapshot_url else 0)
+        use_filter_graph = outputs > 1 or (self._snapshot_url and not encoded)
+        if use_filter_graph:
+            # One decode, split into a scaled copy per rendition (and the snapshot output)
+            inputs = [f"[s{i}]" for i in range(outputs)] if outputs > 1 else ["[0:v]"]
+            chains = [f"[0:v]split={outputs}" + ''.join(inputs)] if outputs > 1 else []
+            for i, name in enumerate(encoded):
+                chains.append(f"{inputs[i]}{self._video_filter(name)}[v{i}]")
+            if self._snapshot_url:
+                width, height = SNAPSHOT_SIZE
+                chains.append(f"{inputs[len(encoded)]}fps=1/{self.snapshot_interval:g},scale={width}:{height}[vsnap]")
+            cmd += ["-filter_complex", ';'.join(chains)]
+
+        for name in names:
+            if name == PASSTHROUGH:
+                cmd += [
+                    "-map", "0:v:0",
+                    "-c:v", "copy",
+                    "-bsf:v", "dump_extra=freq=keyframe",  # SPS/PPS before every keyframe for late joiners
+                    "-f", "mpegts",
+                    "-an",
+                    "-muxdelay", "0",
+                    "-muxpreload", "0",
+                    self._output_urls[name],
+                ]
+                continue
+
+            i = encoded.index(name)
+            preset = QUALITY_PRESETS[name]
+            if use_filter_graph:
+                cmd += ["-map", f"[v{i}]"]
+            elif preset['width']:
+                cmd += ["-vf", self._video_filter(name)]
+
+            cmd += [
+                # OUTPUT: MPEG-TS container with MPEG-1 video for JSMpeg
+                "-f", "mpegts",
+                "-codec:v", "mpeg1video",
+                "-q:v", str(preset['q']),         # 2(best) … 31(worst)
+                "-r", str(preset['fps']),         # fps
+                "-g", str(preset['fps'] * 2),     # keyframe interval, ~2x fps
+                "-bf", "0",                       # no B-frames
+                "-an",                            # no audio
+                "-muxdelay", "0",
+                "-muxpreload", "0",
+
+                self._output_urls[name],          # stdout or an extra pipe
+            ]
+
+        if self._snapshot_url:
+            cmd += [
+                "-map", "[vsnap]",
+                "-f", "image2pipe",
+                "-c:v", "mjpeg",
+                "-q:v", "5",
+                self._snapshot_url,
+            ]
+        return cmd
+
+    def _video_filter(self, name: str) -> str:
+        width = QUALITY_PRESETS[name]['width']
+        return f"scale={width}:-2" if width else "null"
 
     async def start(self) -> bool:
         """Start the FFmpeg process"""
         if self.is_running:
             return True
             
+        extra_pipes = {}  # rendition -> (read fd, write fd)
         try:
+            # The first rendition goes to stdout, every other one to its own pipe
+            for name in self.renditions[1:]:
+                extra_pipes[name] = os.pipe()
+            self._output_urls = {self.renditions[0]: 'pipe:1'}
+            self._output_urls.update({name: f"pipe:{write_fd}" for name, (_, write_fd) in extra_pipes.items()})
+            if self.snapshot_interval:
+                extra_pipes[SNAPSHOT_OUTPUT] = os.pipe()
+                self._snapshot_url = f"pipe:{extra_pipes[SNAPSHOT_OUTPUT][1]}"
+            
             cmd = self._get_ffmpeg_command()
             masked_url = self._mask_credentials(self.rtsp_url)
-            logger.info(f"Starting FFmpeg for stream: {masked_url}")
+            logger.info(f"Starting FFmpeg for stream: {masked_url} (renditions: {', '.join(self.renditions)})")
             logger.info(f"FFmpeg command: {' '.join(cmd)}")
             
-            # Use asyncio.to_thread to run the synchronous subprocess creation
-            result = await asyncio.to_thread(self._start_process_sync)
-            return result
+            # Windows-specific subprocess creation
+            kwargs = {}
+            if sys.platform == 'win32':
+                kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
+            elif extra_pipes:
+                kwargs['pass_fds'] = [write_fd for _, write_fd in extra_pipes.values()]
+            
+            limit = self._read_limit
+            self.cpu_seconds = self.cpu_percent = self.rss_bytes = self._sampled_at = None
+            self.process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                limit=limit,
+                **kwargs
+            )
+            
+            self._readers = {self.renditions[0]: self.process.stdout}
+            loop = asyncio.get_running_loop()
+            for name, (read_fd, write_fd) in extra_pipes.items():
+                os.close(write_fd)
+                reader = asyncio.StreamReader(limit=limit)
+                transport, _ = await loop.connect_read_pipe(
+                    lambda reader=reader: asyncio.StreamReaderProtocol(reader),
+                    os.fdopen(read_fd, 'rb', buffering=0)
+                )
+                self._pipe_transports.append(transport)
+                self._readers[name] = reader
+            extra_pipes = {}
+            
+            self.is_running = True
+            self.stderr_buffer.clear()
+            self.demuxers = {name: TSDemuxer() for name in self.renditions}
+            self._stderr_task = asyncio.create_task(self._drain_stderr())
+            if SNAPSHOT_OUTPUT in self._readers:
+                self._snapshot_task = asyncio.create_task(self._read_snapshots(self._readers.pop(SNAPSHOT_OUTPUT)))
+            logger.info(f"FFmpeg process started with PID: {self.process.pid}")
+            return True
             
         except Exception as e:
             import traceback
@@ -112,65 +409,205 @@ class FFmpegProcess:
             logger.error(self.error_message)
             logger.error(f"Exception type: {type(e).__name__}")
             logger.error(f"Full traceback: {traceback.format_exc()}")
+            for read_fd, write_fd in extra_pipes.values():
+                for fd in (read_fd, write_fd):
+                    try:
+                        os.close(fd)
+                    except OSError:
+                        pass
             return False
 
-    def _stop_process_sync(self):
-        """Stop the FFmpeg process synchronously"""
-        if self.process and self.is_running:
+    async def stop(self):
+        """Stop the FFmpeg process"""
+        process = self.process
+        if process:
             try:
-                self.process.terminate()
-                # Wait a bit for graceful shutdown
-                try:
-                    self.process.wait(timeout=5)
-                except subprocess.TimeoutExpired:
-                    self.process.kill()
-                    self.process.wait()
+                if process.returncode is None:
+                    process.terminate()
+                    # Wait a bit for graceful shutdown
+                    try:
+                        await asyncio.wait_for(process.wait(), timeout=5)
+                    except asyncio.TimeoutError:
+                        process.kill()
+                        await process.wait()
                 
-                logger.info(f"FFmpeg process {self.process.pid} stopped")
+                logger.info(f"FFmpeg process {process.pid} stopped")
+            except ProcessLookupError:
+                pass
             except Exception as e:
                 logger.error(f"Error stopping FFmpeg process: {e}")
             finally:
                 self.process = None
                 self.is_running = False
+        
+        if self._stderr_task:
+            self._stderr_task.cancel()
+            self._stderr_task = None
+        
+        if self._snapshot_task:
+            self._snapshot_task.cancel()
+            self._snapshot_task = None
+        
+        for transport in self._pipe_transports:
+            transport.close()
+        self._pipe_transports = []
+        self._readers = {}
 
-    async def stop(self):
-        """Stop the FFmpeg process"""
-        await asyncio.to_thread(self._stop_process_sync)
+    def sample_resources(self):
+        """Read the child's CPU time and RSS from /proc (Linux only); CPU% is since the previous sample"""
+        if not self.process or self.process.returncode is not None:
+            return
+        try:
+            with open(f'/proc/{self.process.pid}/stat', 'rb') as f:
+                stat = f.read()
+            with open(f'/proc/{self.process.pid}/statm', 'rb') as f:
+                statm = f.read()
+        except OSError:
+            return  # no /proc, or the process just exited
+        # Fields after the command name, which is in parentheses and may contain spaces;
+        # utime and stime are fields 14 and 15 of the whole line
+        fields = stat[stat.rindex(b')') + 2:].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        now = time.monotonic()
+        if self._sampled_at is not None and now > self._sampled_at:
+            self.cpu_percent = round(100 * (cpu_seconds - self.cpu_seconds) / (now - self._sampled_at), 1)
+        self.cpu_seconds = cpu_seconds
+        self._sampled_at = now
+        self.rss_bytes = int(statm.split()[1]) * mmap.PAGESIZE
 
-    def _read_output_sync(self) -> Optional[bytes]:
-        """Read FFmpeg output synchronously"""
+    def get_backlog(self) -> Dict[str, int]:
+        """Bytes per output read from FFmpeg's pipes but not yet taken by the broadcast.
+
+        asyncio stops reading a pipe once this passes the reader's limit, after
+        which FFmpeg itself blocks. StreamReader has no public size, hence _buffer.
+        """
+        return {name: len(getattr(reader, '_buffer', b'')) for name, reader in list(self._readers.items())}
+
+    def get_resource_stats(self) -> Dict[str, Any]:
+        return {
+            'pid': self.process.pid if self.process else None,
+            'cpu_percent': self.cpu_percent,
+            'cpu_seconds': round(self.cpu_seconds, 2) if self.cpu_seconds is not None else None,
+            'rss_bytes': self.rss_bytes,
+            'backlog_bytes': self.get_backlog(),
+            'backlog_limit': self._read_limit,
+        }
+
+    def kill(self):
+        """Kill a hung process at once; its outputs then end as if it had exited"""
+        if self.process and self.process.returncode is None:
+            self.process.kill()
+
+    async def _drain_stderr(self):
+        """Continuously drain stderr so FFmpeg never blocks on a full pipe"""
+        stream = self.process.stderr
+        try:
+            while True:
+                line = await stream.readline()
+                if not line:
+                    break
+                self.stderr_buffer.append(line.decode('utf-8', errors='replace').rstrip())
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.debug(f"Stopped draining FFmpeg stderr: {e}")
+
+    async def _read_snapshots(self, reader: asyncio.StreamReader):
+        """Split the MJPEG snapshot output into JPEGs and keep the latest one"""
+        buffer = bytearray()
+        try:
+            while True:
+                chunk = await reader.read(64 * 1024)
+                if not chunk:
+                    break
+                buffer += chunk
+                while True:
+                    start = buffer.find(JPEG_SOI)
+                    if start < 0:
+                        buffer.clear()
+                        break
+                    end = buffer.find(JPEG_EOI, start + 2)
+                    if end < 0:
+                        del buffer[:start]
+                        if len(buffer) > MAX_SNAPSHOT_BYTES:
+                            buffer.clear()
+                        break
+                    self.latest_snapshot = bytes(buffer[start:end + 2])
+                    self.latest_snapshot_at = time.time()
+                    del buffer[:end + 2]
+                    if self.on_snapshot:
+                        self.on_snapshot(self.latest_snapshot)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.debug(f"Stopped reading FFmpeg snapshots: {e}")
+    
+    async def read_output(self, timeout: Optional[float] = None, rendition: Optional[str] = None) -> Optional[bytes]:
+        """Read the next chunk of a rendition's output, or None once the process has ended.
+
+        With a timeout, asyncio.TimeoutError is raised if no data arrives in time;
+        StreamReader.read is cancellation safe, so nothing is lost.
+        """
         if not self.process or not self.is_running:
             return None
             
         try:
-            # Read a chunk of data
-            chunk = self.process.stdout.read(4096)
+            reader = self._readers[rendition or self.renditions[0]]
+            if timeout is None:
+                chunk = await reader.read(self.read_size)
+            else:
+                chunk = await asyncio.wait_for(reader.read(self.read_size), timeout)
             if chunk:
                 return chunk
             else:
                 # Process has ended
                 self.is_running = False
                 return None
+        except asyncio.TimeoutError:
+            raise
         except Exception as e:
             logger.error(f"Error reading FFmpeg output: {e}")
             self.is_running = False
             return None
 
-    async def read_output(self):
-        """Read FFmpeg output asynchronously"""
-        return await asyncio.to_thread(self._read_output_sync)
+    async def iter_output(self) -> AsyncIterator[bytes]:
+        """Yield FFmpeg output chunks until the process ends"""
+        while True:
+            chunk = await self.read_output()
+            if chunk is None:
+                return
+            yield chunk
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        return self.iter_output()
+
+    async def read_batches(self, timeout: Optional[float] = None,
+                           rendition: Optional[str] = None) -> Optional[List[TSBatch]]:
+        """Read the next chunk as packet-aligned batches (possibly empty), or None once the process has ended"""
+        rendition = rendition or self.renditions[0]
+        chunk = await self.read_output(timeout, rendition)
+        if chunk is None:
+            return None
+        return self.demuxers[rendition].feed(chunk)
+
+    async def iter_batches(self, rendition: Optional[str] = None) -> AsyncIterator[TSBatch]:
+        """Yield packet-aligned batches of a rendition until the process ends"""
+        while True:
+            batches = await self.read_batches(rendition=rendition)
+            if batches is None:
+                return
+            for batch in batches:
+                yield batch
 
     async def get_error_info(self) -> Dict[str, Any]:
-        """Get error information from FFmpeg stderr"""
-        if not self.process:
+        """Get error information from the drained FFmpeg stderr"""
+        if self._stderr_task and not self._stderr_task.done():
+            # Give the drain a moment to catch up with what FFmpeg wrote before exiting
+            await asyncio.wait([self._stderr_task], timeout=1)
+        if not self.stderr_buffer:
             return {}
             
-        try:
-            stderr_output = await asyncio.to_thread(lambda: self.process.stderr.read())
-            stderr_text = stderr_output.decode('utf-8')
-            return self._parse_ffmpeg_errors(stderr_text)
-        except:
-            return {}
+        return self._parse_ffmpeg_errors('\n'.join(self.stderr_buffer))
 
     def _parse_ffmpeg_errors(self, stderr_output: str) -> Dict[str, Any]:
         """Parse FFmpeg error messages"""
@@ -190,7 +627,7 @@ class FFmpegProcess:
         elif 'Connection refused' in stderr_output:
             errors['code'] = 'CONNECTION_REFUSED'
             errors['message'] = 'Connection refused'
-        elif 'timeout' in stderr_output.lower():
+        elif 'timeout' in stderr_output.lower() or 'timed out' in stderr_output.lower():
             errors['code'] = 'TIMEOUT'
             errors['message'] = 'Connection timeout'
         elif 'Invalid data found' in stderr_output:
@@ -203,7 +640,38 @@ class FFmpegProcess:
         """Check if the process is still running"""
         if not self.process:
             return False
-        return self.process.poll() is None
+        return self.process.returncode is None
+
+# Ports assumed when an RTSP URL does not name one
+DEFAULT_RTSP_PORTS = {'rtsp': 554, 'rtsps': 322}
+
+def normalize_rtsp_url(url: str) -> str:
+    """Canonical form of an RTSP URL, so one physical camera maps to one ingest.
+
+    Scheme and host are lower-cased, the default port is made explicit,
+    credentials are percent-decoded and re-encoded the same way, an empty path
+    becomes '/' and any fragment is dropped. Credentials stay part of the key,
+    so a viewer never gets video it could not have opened with its own URL.
+    """
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or '').lower()
+    if ':' in host:
+        host = f"[{host}]"  # IPv6 literal
+    try:
+        port = parsed.port or DEFAULT_RTSP_PORTS.get(scheme)
+    except ValueError:
+        port = None
+
+    userinfo = ''
+    if parsed.username is not None:
+        userinfo = quote(unquote(parsed.username), safe='')
+        if parsed.password is not None:
+            userinfo += ':' + quote(unquote(parsed.password), safe='')
+        userinfo += '@'
+
+    netloc = f"{userinfo}{host}:{port}" if port else f"{userinfo}{host}"
+    return urlunparse((scheme, netloc, parsed.path or '/', parsed.params, parsed.query, ''))
 
 def _validate_rtsp_url_sync(url: str, timeout: int = 10) -> bool:
     """Validate RTSP URL using ffprobe synchronously"""
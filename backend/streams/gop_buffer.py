@@ -0,0 +1,118 @@
+import logging
+from collections import deque
+from typing import Optional, Deque
+
+from .ffmpeg_helper import TSBatch, TS_PACKET_SIZE, TS_FLAG_RANDOM_ACCESS, MPEG1_SEQUENCE_HEADER
+
+logger = logging.getLogger(__name__)
+
+PAT_PID = 0x0000
+
+# PMT stream types treated as video
+VIDEO_STREAM_TYPES = {0x01, 0x02, 0x1B, 0x24}
+
+class GopBuffer:
+    """Per-stream replay buffer holding the TS packets since the latest keyframe.
+
+    Every batch the broadcaster sends is pushed here in order. The batch
+    metadata from TSDemuxer is used to keep the latest PAT and PMT and to spot
+    the first packet of each new GOP, so only payload-start packets are ever
+    looked at. replay() returns PAT + PMT + everything from that packet up to
+    the current position, which is exactly what a late joiner needs to decode
+    immediately. Along the way it counts the PES packets on the video PID,
+    one per picture, for the input frame rate.
+    """
+
+    def __init__(self, max_bytes: int = 4 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.pat: Optional[bytes] = None
+        self.pmt: Optional[bytes] = None
+        self.pmt_pid: Optional[int] = None
+        self.video_pid: Optional[int] = None
+        self.segments: Deque[memoryview] = deque()
+        self.size = 0
+        self.has_keyframe = False
+        self.pictures = 0  # picture starts seen on the video PID
+
+    def push(self, batch: TSBatch) -> Optional[int]:
+        """Record a batch. Returns the byte offset of a new GOP's first packet in it, or None."""
+        keyframe_index = None
+        for index in batch.payload_starts:
+            if self._inspect(batch, index):
+                keyframe_index = index
+
+        if keyframe_index is None:
+            self._append(batch.data)
+            return None
+
+        offset = keyframe_index * TS_PACKET_SIZE
+        self.segments = deque([batch.data[offset:]])
+        self.size = len(batch.data) - offset
+        self.has_keyframe = True
+        return offset
+
+    def replay(self) -> Optional[bytes]:
+        """PAT + PMT + the current GOP, or None if no keyframe has been seen yet"""
+        if not self.has_keyframe or not self.pat or not self.pmt:
+            return None
+        return b''.join([self.pat, self.pmt, *self.segments])
+
+    def _append(self, data: memoryview):
+        if not self.has_keyframe:
+            return
+        self.segments.append(data)
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            # GOP too long to replay usefully; wait for the next keyframe
+            logger.debug(f"GOP buffer exceeded {self.max_bytes} bytes, waiting for next keyframe")
+            self.segments.clear()
+            self.size = 0
+            self.has_keyframe = False
+
+    def _inspect(self, batch: TSBatch, index: int) -> bool:
+        """Track PAT/PMT and report whether this payload-start packet begins a new GOP"""
+        pid = batch.pids[index]
+        if pid == PAT_PID:
+            payload = batch.payload(index)
+            if payload is not None:
+                self._parse_pat(payload)
+                self.pat = bytes(batch.packet(index))
+        elif pid == self.pmt_pid:
+            payload = batch.payload(index)
+            if payload is not None:
+                self._parse_pmt(payload)
+                self.pmt = bytes(batch.packet(index))
+        elif pid == self.video_pid:
+            self.pictures += 1
+            if batch.flags[index] & TS_FLAG_RANDOM_ACCESS:
+                return True
+            payload = batch.payload(index)
+            return payload is not None and MPEG1_SEQUENCE_HEADER in bytes(payload)
+        return False
+
+    def _parse_pat(self, payload: memoryview):
+        section = payload[1 + payload[0]:]
+        if len(section) < 12 or section[0] != 0x00:
+            return
+        section_length = ((section[1] & 0x0F) << 8) | section[2]
+        end = min(3 + section_length - 4, len(section))
+        for i in range(8, end - 3, 4):
+            program_number = (section[i] << 8) | section[i + 1]
+            if program_number != 0:
+                self.pmt_pid = ((section[i + 2] & 0x1F) << 8) | section[i + 3]
+                return
+
+    def _parse_pmt(self, payload: memoryview):
+        section = payload[1 + payload[0]:]
+        if len(section) < 16 or section[0] != 0x02:
+            return
+        section_length = ((section[1] & 0x0F) << 8) | section[2]
+        end = min(3 + section_length - 4, len(section))
+        i = 12 + (((section[10] & 0x0F) << 8) | section[11])
+        while i + 5 <= end:
+            stream_type = section[i]
+            pid = ((section[i + 1] & 0x1F) << 8) | section[i + 2]
+            if stream_type in VIDEO_STREAM_TYPES:
+                self.video_pid = pid
+                return
+            i += 5 + (((section[i + 3] & 0x0F) << 8) | section[i + 4])
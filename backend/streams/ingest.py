@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import signal
+import asyncio
+import logging
+from typing import Optional, Dict, Any
+
+from django.conf import settings
+
+from .admission import AdmissionController, AdmissionRejected
+from .consumers import StreamInfo
+from .relay import UnixSocketRelay, ingest_socket_path
+
+logger = logging.getLogger(__name__)
+
+class IngestStream(StreamInfo):
+    """A camera ingest with no viewers of its own, kept alive by relay followers.
+
+    When the last follower goes away the ingest keeps running for idle_grace
+    seconds, so restarting the web workers doesn't drop camera sessions.
+    """
+
+    def __init__(self, rtsp_url: str, admission: AdmissionController, relay: UnixSocketRelay, idle_grace: float):
+        super().__init__('ingest', rtsp_url, admission=admission, relay=relay)
+        self.stream_id = self._mask_url(self.key)
+        self.idle_grace = idle_grace
+        self._idle_task: Optional[asyncio.Task] = None
+
+    async def _on_relay_idle(self):
+        self.schedule_idle_stop()
+
+    def schedule_idle_stop(self):
+        if self._idle_task and not self._idle_task.done():
+            self._idle_task.cancel()
+        self._idle_task = asyncio.create_task(self._stop_when_idle())
+
+    async def _stop_when_idle(self):
+        await asyncio.sleep(self.idle_grace)
+        if (self.is_playing or self.is_restarting) and not (self.lease and self.lease.followers):
+            logger.info(f"Stopping ingest for {self.stream_id} - no relay followers for {self.idle_grace:g}s")
+            await self.stop()
+
+class IngestWorker:
+    """One ingest process: starts camera ingests on request and relays them to the web workers"""
+
+    def __init__(self, index: int, path: str, idle_grace: float, max_streams: int):
+        self.index = index
+        self.socket_path = ingest_socket_path(path, index)
+        self.idle_grace = idle_grace
+        options = dict(settings.STREAM_RELAY_OPTIONS, path=path)
+        options.pop('request_timeout', None)  # IngestRelay only
+        self.relay = UnixSocketRelay(**options)
+        self.admission = AdmissionController(
+            max_streams=max_streams,
+            max_streams_per_client=max_streams,
+            queue_timeout=settings.STREAM_ADMISSION_QUEUE_TIMEOUT,
+            max_queue=settings.STREAM_ADMISSION_QUEUE_SIZE,
+        )
+        self.streams: Dict[str, IngestStream] = {}
+        self.lock = asyncio.Lock()
+        self.sample_interval = settings.STREAM_RESOURCE_SAMPLE_INTERVAL  # None turns sampling off
+
+    async def serve(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        # Stop our FFmpeg processes with us instead of orphaning them
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, asyncio.current_task().cancel)
+        logger.info(f"Ingest worker {self.index} listening on {self.socket_path}")
+        sampler = asyncio.create_task(self._sample_resources()) if self.sample_interval else None
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if sampler:
+                sampler.cancel()
+            for stream in list(self.streams.values()):
+                if stream.is_playing:
+                    await stream.stop()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = json.loads(await reader.readline() or b'{}')
+            if request.get('action') == 'start' and request.get('url'):
+                reply = await self.start_stream(request['url'])
+            elif request.get('action') == 'stats':
+                reply = {'ok': True, 'stats': self.get_stats()}
+            elif request.get('action') == 'slots':
+                reply = {'ok': True, 'slots': self.admission.get_stats()}
+            else:
+                reply = {'ok': False, 'message': 'Unknown request'}
+            writer.write(json.dumps(reply).encode('utf-8') + b'\n')
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"Error handling ingest request: {e}")
+        finally:
+            writer.close()
+
+    async def start_stream(self, url: str) -> Dict[str, Any]:
+        async with self.lock:
+            stream = self.streams.get(url)
+            if stream is None:
+                stream = self.streams[url] = IngestStream(url, self.admission, self.relay, self.idle_grace)
+
+        if stream.is_restarting:
+            # FFmpeg is waiting out its restart backoff under the lease; the requester follows that
+            return {'ok': True}
+        if stream.failure and time.monotonic() - stream.failed_at < settings.STREAM_RESTART_MAX_BACKOFF:
+            # Just gave up on this camera (e.g. AUTH); asking again right away won't fix it
+            return {'ok': False, 'error': stream.failure, 'message': stream.failure['message']}
+
+        try:
+            started = await stream.start()
+        except AdmissionRejected as e:
+            return {'ok': False, 'close_code': e.close_code, 'error_code': e.error_code, 'message': e.message}
+
+        if stream.lease and not stream.lease.owner:
+            # Another ingest worker already serves this camera; the requester can follow it directly
+            await stream.stop()
+            return {'ok': True}
+        if not started:
+            return {'ok': False, 'message': 'FFmpeg failed to start'}
+        # Stop again if the requester never shows up
+        stream.schedule_idle_stop()
+        return {'ok': True}
+
+    async def _sample_resources(self):
+        """Read each running FFmpeg's CPU time and RSS from /proc, like StreamManager does in web workers"""
+        while True:
+            for stream in list(self.streams.values()):
+                if stream.ffmpeg_process and stream.is_playing:
+                    stream.ffmpeg_process.sample_resources()
+            await asyncio.sleep(self.sample_interval)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """What the web workers merge into /metrics and the stream stats views (see IngestRelay.get_ingest_stats)"""
+        streams = [stream for stream in list(self.streams.values()) if stream.is_playing or stream.is_restarting]
+        return {
+            'worker': self.index,
+            'pid': os.getpid(),
+            'streams': [stream.get_stats() for stream in streams],
+            'resources': [stream.get_resource_stats() for stream in streams],
+            'slots': self.admission.get_stats(),
+        }
+
+def run_worker(index: int, path: str, idle_grace: float, max_streams: int):
+    """Entry point of an ingest worker process"""
+    worker = IngestWorker(index, path, idle_grace, max_streams)
+    try:
+        asyncio.run(worker.serve())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
@@ -0,0 +1,41 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class BackgroundServicesMiddleware:
+    """Runs background services next to the ASGI application.
+
+    Each service has a start() that is safe to call repeatedly and an async
+    stop(). Servers that speak the ASGI lifespan protocol start and stop them
+    with the application; with servers that don't, they start on the first
+    request.
+    """
+
+    def __init__(self, app, services):
+        self.app = app
+        self.services = list(services)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        self._start()
+        return await self.app(scope, receive, send)
+
+    def _start(self):
+        for service in self.services:
+            try:
+                service.start()
+            except Exception as e:
+                logger.error(f"Could not start {type(service).__name__}: {e}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for service in self.services:
+                    await service.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
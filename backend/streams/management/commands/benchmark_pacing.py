@@ -0,0 +1,131 @@
+import asyncio
+import statistics
+import struct
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from streams.ffmpeg_helper import FFmpegProcess, TS_PACKET_SIZE, DEFAULT_READ_SIZE
+from streams.pacing import ChunkPacer
+
+# Every record written by the synthetic source is a run of TS packets; the first
+# packet's payload starts with the record's wall-clock send time
+RECORD_HEADER = struct.Struct('!d')
+RECORD_HEADER_OFFSET = 4
+
+SOURCE_SCRIPT = '''
+import struct, sys, time
+record_size, bitrate, duration = int(sys.argv[1]), float(sys.argv[2]), float(sys.argv[3])
+interval = record_size / bitrate
+out = sys.stdout.buffer
+header = bytes([0x47, 0x01, 0x00, 0x10])
+packet_padding = b'\\xff' * 184
+first_padding = b'\\xff' * 176
+rest = (header + packet_padding) * (record_size // 188 - 1)
+start = time.time()
+next_write = start
+while time.time() - start < duration:
+    out.write(header + struct.pack('!d', time.time()) + first_padding + rest)
+    out.flush()
+    next_write += interval
+    delay = next_write - time.time()
+    if delay > 0:
+        time.sleep(delay)
+'''
+
+class SyntheticSource(FFmpegProcess):
+    """FFmpegProcess that runs a constant-bitrate generator instead of FFmpeg"""
+
+    def __init__(self, record_size, bitrate, duration, read_size):
+        super().__init__('rtsp://benchmark', read_size=read_size)
+        self.record_size = record_size
+        self.bitrate = bitrate
+        self.duration = duration
+
+    def _get_ffmpeg_command(self) -> list:
+        return [sys.executable, '-c', SOURCE_SCRIPT,
+                str(self.record_size), str(self.bitrate), str(self.duration)]
+
+class LatencySink:
+    """Measures throughput and the send-to-receive latency of each record"""
+
+    def __init__(self, record_size):
+        self.record_size = record_size
+        self.pending = bytearray()
+        self.latencies = []
+        self.frames = 0
+        self.bytes = 0
+        self.started = None
+        self.finished = None
+
+    def receive(self, frame):
+        now = time.time()
+        if self.started is None:
+            self.started = now
+        self.finished = now
+        self.frames += 1
+        self.bytes += len(frame)
+        self.pending += frame
+        while len(self.pending) >= self.record_size:
+            sent_at, = RECORD_HEADER.unpack_from(self.pending, RECORD_HEADER_OFFSET)
+            self.latencies.append(now - sent_at)
+            del self.pending[:self.record_size]
+
+    def report(self, name):
+        elapsed = max((self.finished or 0) - (self.started or 0), 1e-9)
+        latencies = sorted(self.latencies) or [0.0]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return (
+            f"{name:<8} throughput {self.bytes / elapsed / 1024:9.1f} KB/s  "
+            f"frames {self.frames:6d}  avg frame {self.bytes / max(self.frames, 1):8.0f} B  "
+            f"latency p50 {statistics.median(latencies) * 1000:8.1f} ms  "
+            f"p95 {p95 * 1000:8.1f} ms  max {latencies[-1] * 1000:8.1f} ms"
+        )
+
+class Command(BaseCommand):
+    help = 'Compare the legacy fixed-sleep broadcast loop with the adaptive ChunkPacer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bitrate', type=float, default=8_000_000, help='Source bitrate in bits per second')
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds of source data per run')
+        parser.add_argument('--record-size', type=int, default=1316, help='Bytes per source write, a multiple of 188 (7 TS packets)')
+        parser.add_argument('--max-frame-bytes', type=int, default=64 * 1024)
+        parser.add_argument('--max-delay', type=float, default=0.005)
+
+    def handle(self, *args, **options):
+        asyncio.run(self._run(options))
+
+    async def _run(self, options):
+        if options['record_size'] % TS_PACKET_SIZE:
+            raise CommandError('--record-size must be a multiple of 188')
+        byterate = options['bitrate'] / 8
+        self.stdout.write(
+            f"Source: {byterate / 1024:.1f} KB/s for {options['duration']:.1f}s "
+            f"in {options['record_size']}-byte writes"
+        )
+        before = await self._run_legacy(options, byterate)
+        self.stdout.write(before.report('before'))
+        after = await self._run_pacer(options, byterate)
+        self.stdout.write(after.report('after'))
+
+    async def _run_legacy(self, options, byterate):
+        """The original loop: 4096-byte reads with a 10 ms sleep after each one"""
+        source = SyntheticSource(options['record_size'], byterate, options['duration'], 4096)
+        sink = LatencySink(options['record_size'])
+        await source.start()
+        async for chunk in source:
+            sink.receive(chunk)
+            await asyncio.sleep(0.01)
+        await source.stop()
+        return sink
+
+    async def _run_pacer(self, options, byterate):
+        source = SyntheticSource(options['record_size'], byterate, options['duration'], DEFAULT_READ_SIZE)
+        sink = LatencySink(options['record_size'])
+        pacer = ChunkPacer(max_frame_bytes=options['max_frame_bytes'], max_delay=options['max_delay'])
+        await source.start()
+        async for frame in pacer.frames_from(source):
+            sink.receive(b''.join(batch.data for batch in frame))
+        await source.stop()
+        return sink
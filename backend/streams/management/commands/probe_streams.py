@@ -0,0 +1,48 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from streams.models import Stream
+from streams.probe_service import probe_service
+
+class Command(BaseCommand):
+    help = (
+        'Probe stored streams that have no input profile yet, e.g. ones added before profiles '
+        'were stored, so their ingests can skip FFmpeg\'s input analysis. Probing opens an RTSP '
+        'session of its own, so run it while the cameras are not being watched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Probe every active stream again, not only those without a profile')
+        parser.add_argument('--concurrency', type=int, default=settings.STREAM_BULK_PROBE_CONCURRENCY,
+                            help='ffprobe runs at a time (default: STREAM_BULK_PROBE_CONCURRENCY)')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+        asyncio.run(self._probe_streams(options['all'], options['concurrency']))
+
+    async def _probe_streams(self, probe_all, concurrency):
+        streams = Stream.objects.filter(is_active=True)
+        if not probe_all:
+            streams = streams.filter(input_profile__isnull=True)
+        rows = [(stream_id, url) async for stream_id, url in streams.values_list('id', 'url')]
+        if not rows:
+            self.stdout.write('No streams to probe')
+            return
+
+        # Rows of the same camera share one ffprobe run
+        probes = await probe_service.probe_many([url for _, url in rows], max_concurrent=concurrency)
+        profiled = 0
+        for stream_id, url in rows:
+            probe = probes[url]
+            if not probe['ok']:
+                self.stderr.write(f"{stream_id}: {probe.get('error', 'not reachable')}")
+                continue
+            fields = probe_service.stream_fields(probe)
+            await Stream.objects.filter(id=stream_id).aupdate(**fields)
+            if fields['input_profile']:
+                profiled += 1
+        self.stdout.write(f"Stored input profiles for {profiled} of {len(rows)} streams")
@@ -0,0 +1,79 @@
+import os
+import time
+import signal
+import multiprocessing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from streams.ingest import run_worker
+
+class Command(BaseCommand):
+    help = (
+        'Run the camera ingest workers. Web workers configured with '
+        "STREAM_RELAY_BACKEND = 'streams.relay.IngestRelay' hand every camera to "
+        'these processes instead of running FFmpeg themselves.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Ingest worker processes (default: one per core)')
+        parser.add_argument('--idle-grace', type=float, default=settings.STREAM_INGEST_IDLE_GRACE,
+                            help='Seconds an ingest keeps running after its last web worker left')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        if os.name == 'nt':
+            raise CommandError('run_ingest relays over Unix sockets and is not supported on Windows')
+
+        path = settings.STREAM_RELAY_OPTIONS.get('path')
+        if not path:
+            raise CommandError("Set STREAM_RELAY_OPTIONS['path'] to a directory shared with the web workers")
+        os.makedirs(path, exist_ok=True)
+
+        # Split MAX_CONCURRENT_STREAMS exactly, so the workers together never run more;
+        # web workers send each camera to the worker with the most free slots
+        max_streams = max(1, settings.MAX_CONCURRENT_STREAMS)
+        workers = min(options['workers'], max_streams)
+        limits = [max_streams // workers + (1 if index < max_streams % workers else 0) for index in range(workers)]
+        processes = {}
+
+        # Workers inherit the configured Django process; streams.ingest can't be imported
+        # before django.setup(), which a spawned child would have to do
+        context = multiprocessing.get_context('fork')
+
+        def spawn(index):
+            process = context.Process(target=run_worker, args=(index, path, options['idle_grace'], limits[index]),
+                                      name=f'ingest-{index}', daemon=True)
+            process.start()
+            processes[index] = process
+
+        stopping = False
+
+        def shutdown(signum, frame):
+            nonlocal stopping
+            stopping = True
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        for index in range(workers):
+            spawn(index)
+        self.stdout.write(f"Started {workers} ingest workers in {path} ({max_streams} streams between them)")
+
+        while not stopping:
+            time.sleep(1)
+            for index, process in list(processes.items()):
+                if not process.is_alive() and not stopping:
+                    # Web workers following this worker's cameras see EOF and ask again
+                    self.stderr.write(f'Ingest worker {index} exited with code {process.exitcode}, restarting')
+                    spawn(index)
+
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join(5)
+            if process.is_alive():
+                process.kill()
+        self.stdout.write('Ingest workers stopped')
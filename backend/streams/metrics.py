@@ -0,0 +1,82 @@
+import bisect
+from typing import Dict, Any, Sequence, Iterable, Tuple, List
+
+# Upper bounds in seconds for latency histograms
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# ...and for sending one chunk to a WebSocket
+SEND_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+class Histogram:
+    """Counts observations into fixed buckets, like a Prometheus histogram.
+
+    observe() is a bisect and two additions, cheap enough for hot paths.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """(upper bound, observations <= bound) pairs, ending with +Inf"""
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 3),
+            'avg': round(self.sum / self.count, 3) if self.count else None,
+            'buckets': {('+Inf' if bound == float('inf') else f'{bound:g}'): total for bound, total in self.cumulative()},
+        }
+
+class MetricsWriter:
+    """Renders metrics in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def add(self, name: str, kind: str, help_text: str, samples: Iterable[Tuple[Dict[str, Any], float]]):
+        """A counter or gauge with one sample per (labels, value) pair"""
+        self._header(name, kind, help_text)
+        for labels, value in samples:
+            self.lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    def histogram(self, name: str, help_text: str, histograms: Iterable[Tuple[Dict[str, Any], Histogram]]):
+        self._header(name, 'histogram', help_text)
+        for labels, histogram in histograms:
+            for bound, total in histogram.cumulative():
+                self.lines.append(f"{name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {total}")
+            self.lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+            self.lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+    def render(self) -> str:
+        return '\n'.join(self.lines) + '\n'
+
+    def _header(self, name: str, kind: str, help_text: str):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(int(value))
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
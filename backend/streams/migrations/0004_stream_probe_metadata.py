@@ -0,0 +1,39 @@
+# Generated manually: the model and 0003 disagree on the thumbnail fields, so makemigrations
+# would also drop those columns
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0003_stream_thumbnail_stream_thumbnail_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='codec',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='fps',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='probed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
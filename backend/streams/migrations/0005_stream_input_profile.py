@@ -0,0 +1,18 @@
+# Generated manually, see 0004
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0004_stream_probe_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='input_profile',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
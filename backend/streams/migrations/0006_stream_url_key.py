@@ -0,0 +1,27 @@
+# Generated manually, see 0004
+
+from django.db import migrations, models
+
+from streams.ffmpeg_helper import normalize_rtsp_url
+
+
+def fill_url_key(apps, schema_editor):
+    Stream = apps.get_model('streams', 'Stream')
+    for stream in Stream.objects.only('id', 'url').iterator():
+        Stream.objects.filter(id=stream.id).update(url_key=normalize_rtsp_url(stream.url))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0005_stream_input_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='url_key',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=500),
+        ),
+        migrations.RunPython(fill_url_key, migrations.RunPython.noop),
+    ]
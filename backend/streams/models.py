@@ -4,6 +4,8 @@ from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
 from urllib.parse import urlparse
 
+from .ffmpeg_helper import normalize_rtsp_url
+
 def validate_rtsp_url(value):
     """Validate that the URL is a valid RTSP URL"""
     if not value.startswith('rtsp://'):
@@ -20,14 +22,31 @@ def validate_rtsp_url(value):
 class Stream(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     url = models.CharField(max_length=500, validators=[validate_rtsp_url])
+    # Canonical form of url (normalize_rtsp_url), so every row of one camera is found by an index lookup
+    url_key = models.CharField(max_length=500, db_index=True, editable=False, blank=True, default='')
     label = models.CharField(max_length=100, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+    # Video stream as last probed, so ingests don't have to find out again
+    codec = models.CharField(max_length=32, blank=True, null=True)
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    fps = models.FloatField(blank=True, null=True)
+    probed_at = models.DateTimeField(blank=True, null=True)
+    # Codec, resolution, timebase and SPS/PPS presence, used to pick FFmpeg's input options
+    input_profile = models.JSONField(blank=True, null=True)
 
     class Meta:
         ordering = ['-created_at']
 
+    def save(self, *args, **kwargs):
+        self.url_key = normalize_rtsp_url(self.url)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'url' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'url_key'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.label or 'Unnamed Stream'} ({self.url})"
 
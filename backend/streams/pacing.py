@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from typing import Optional, AsyncIterator, List
+
+from .ffmpeg_helper import TSBatch, TS_PACKET_SIZE
+
+logger = logging.getLogger(__name__)
+
+class ChunkPacer:
+    """Turn FFmpeg reads into WebSocket frames without a fixed throttle.
+
+    Packet-aligned batches are coalesced into one frame until either
+    max_frame_bytes is reached or max_delay seconds have passed since the first
+    read of the frame. The pacing adapts to the pipe: a read that fills the
+    whole read size means FFmpeg is ahead of us, so the frame goes out
+    immediately instead of waiting for the time budget. max_rate (bytes per
+    second) is an optional ceiling and is off by default.
+    """
+
+    def __init__(self, max_frame_bytes: int = 64 * 1024, max_delay: float = 0.005,
+                 max_rate: Optional[float] = None):
+        self.max_frame_bytes = max_frame_bytes
+        self.max_delay = max_delay
+        self.max_rate = max_rate
+        self.frames = 0
+        self.bytes = 0
+        self._next_send = 0.0
+
+    async def frames_from(self, source, rendition: Optional[str] = None) -> AsyncIterator[List[TSBatch]]:
+        """Yield frames, each a list of TSBatch, from one rendition of an FFmpegProcess until it ends"""
+        loop = asyncio.get_running_loop()
+        # A read this large means the pipe had more data than we asked for
+        full_read = source.read_size - source.read_size % TS_PACKET_SIZE - TS_PACKET_SIZE
+        while True:
+            batches = await source.read_batches(rendition=rendition)
+            if batches is None:
+                return
+            if not batches:
+                continue
+
+            frame = list(batches)
+            size = sum(batch.nbytes for batch in batches)
+            ended = False
+            if self.max_delay > 0 and size < full_read:
+                deadline = loop.time() + self.max_delay
+                while size < self.max_frame_bytes:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        more = await source.read_batches(timeout=remaining, rendition=rendition)
+                    except asyncio.TimeoutError:
+                        break
+                    if more is None:
+                        ended = True
+                        break
+                    read = sum(batch.nbytes for batch in more)
+                    frame.extend(more)
+                    size += read
+                    if read >= full_read:
+                        break
+
+            if self.max_rate:
+                await self._throttle(loop, size)
+            self.frames += 1
+            self.bytes += size
+            yield frame
+
+            if ended:
+                return
+
+    async def _throttle(self, loop, size: int):
+        """Hold the frame back just long enough to stay under max_rate"""
+        now = loop.time()
+        if self._next_send > now:
+            await asyncio.sleep(self._next_send - now)
+            now = self._next_send
+        self._next_send = now + size / self.max_rate
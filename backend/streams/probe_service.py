@@ -0,0 +1,171 @@
+import json
+import time
+import asyncio
+import logging
+import weakref
+from typing import Optional, Dict, Any, Iterable, Tuple
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.utils import timezone
+
+from .ffmpeg_helper import normalize_rtsp_url
+
+logger = logging.getLogger(__name__)
+
+INPUT_PROFILE_FIELDS = ('codec', 'profile', 'width', 'height', 'fps', 'pix_fmt', 'time_base',
+                        'extradata_size', 'extradata_hash')
+
+class ProbeService:
+    """Checks RTSP URLs with ffprobe and reports the video stream they carry.
+
+    Results are cached per camera (by normalized URL) and concurrent probes of
+    the same camera share one ffprobe run. A probe result is a dict with 'ok',
+    plus 'codec', 'width', 'height', 'fps' and the rest of the input profile
+    when ffprobe found a video stream, or 'error' when it didn't.
+    """
+
+    def __init__(self):
+        self.timeout = settings.STREAM_PROBE_TIMEOUT
+        self.cache_ttl = settings.STREAM_PROBE_CACHE_TTL
+        self.failure_ttl = min(15, self.cache_ttl)  # a camera that was down may be back soon
+        self.cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}  # normalized URL -> (expires at, result)
+        self._inflight = weakref.WeakKeyDictionary()  # event loop -> {normalized URL: probe task}
+        self.probed = 0
+        self.cache_hits = 0
+        self.deduplicated = 0
+
+    async def probe(self, rtsp_url: str, use_cache: bool = True) -> Dict[str, Any]:
+        key = normalize_rtsp_url(rtsp_url)
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached and cached[0] > time.time():
+                self.cache_hits += 1
+                return cached[1]
+
+        inflight = self._inflight.setdefault(asyncio.get_running_loop(), {})
+        task = inflight.get(key)
+        if task is not None:
+            self.deduplicated += 1
+        else:
+            task = inflight[key] = asyncio.create_task(self._probe_and_cache(key, rtsp_url))
+            task.add_done_callback(lambda _: inflight.pop(key, None))
+        # Shielded so a request that goes away doesn't cancel the probe for everyone else
+        return await asyncio.shield(task)
+
+    async def probe_many(self, rtsp_urls: Iterable[str], max_concurrent: int) -> Dict[str, Dict[str, Any]]:
+        """Probe several URLs, at most max_concurrent at a time; returns URL -> result"""
+        semaphore = asyncio.Semaphore(max_concurrent)
+        
+        async def probe_one(rtsp_url: str):
+            async with semaphore:
+                return rtsp_url, await self.probe(rtsp_url)
+        
+        return dict(await asyncio.gather(*(probe_one(rtsp_url) for rtsp_url in set(rtsp_urls))))
+    
+    async def _probe_and_cache(self, key: str, rtsp_url: str) -> Dict[str, Any]:
+        result = await self._run_ffprobe(rtsp_url)
+        self.probed += 1
+        now = time.time()
+        self.cache = {k: v for k, v in self.cache.items() if v[0] > now}
+        self.cache[key] = (now + (self.cache_ttl if result['ok'] else self.failure_ttl), result)
+        return result
+
+    async def _run_ffprobe(self, rtsp_url: str) -> Dict[str, Any]:
+        cmd = [
+            'ffprobe',
+            '-v', 'error',
+            '-print_format', 'json',
+            '-show_streams',
+            '-show_data_hash', 'sha256',  # extradata_hash: tells us when SPS/PPS change
+            '-select_streams', 'v:0',
+            '-rtsp_transport', 'tcp',
+            settings.FFMPEG_RTSP_TIMEOUT_OPTION, str(int(self.timeout * 1000000)),  # socket timeout in microseconds
+            rtsp_url
+        ]
+        process = None
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=self.timeout)
+        except FileNotFoundError:
+            # Without ffprobe we can only check the URL format
+            logger.warning("ffprobe not found, accepting RTSP URL without probing")
+            return {'ok': rtsp_url.startswith('rtsp://')}
+        except asyncio.TimeoutError:
+            logger.error(f"ffprobe timed out after {self.timeout}s for {self._mask_url(rtsp_url)}")
+            return {'ok': False, 'error': 'Timed out connecting to the stream'}
+        finally:
+            if process and process.returncode is None:
+                process.kill()
+                await process.wait()
+
+        if process.returncode != 0:
+            message = stderr.decode('utf-8', errors='replace').strip().splitlines()
+            logger.error(f"ffprobe failed for {self._mask_url(rtsp_url)}: {message[-1] if message else process.returncode}")
+            return {'ok': False, 'error': 'Stream not accessible'}
+
+        try:
+            streams = json.loads(stdout or b'{}').get('streams') or []
+        except ValueError:
+            streams = []
+        if not streams:
+            return {'ok': False, 'error': 'No video stream found'}
+        video = streams[0]
+        return {
+            'ok': True,
+            'codec': video.get('codec_name'),
+            'width': video.get('width'),
+            'height': video.get('height'),
+            'fps': self._parse_rate(video.get('avg_frame_rate')) or self._parse_rate(video.get('r_frame_rate')),
+            'profile': video.get('profile'),
+            'pix_fmt': video.get('pix_fmt'),
+            'time_base': video.get('time_base'),
+            # Parameter sets (H.264 SPS/PPS) the camera announces in its SDP, if any
+            'extradata_size': int(video.get('extradata_size') or 0),
+            'extradata_hash': video.get('extradata_hash'),
+        }
+
+    def _parse_rate(self, rate: Optional[str]) -> Optional[float]:
+        """ffprobe frame rates are fractions like '30000/1001'"""
+        try:
+            num, _, den = (rate or '').partition('/')
+            value = float(num) / float(den or 1)
+        except (ValueError, ZeroDivisionError):
+            return None
+        return round(value, 3) if value > 0 else None
+
+    def _mask_url(self, url: str) -> str:
+        parsed = urlparse(url)
+        if parsed.password:
+            return url.replace(f":{parsed.password}@", ":***@")
+        return url
+
+    def stream_fields(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Stream model fields for a successful probe result; all empty if ffprobe couldn't run"""
+        fields = {field: result.get(field) for field in ('codec', 'width', 'height', 'fps')}
+        fields['probed_at'] = timezone.now() if 'codec' in result else None
+        fields['input_profile'] = self.input_profile(result)
+        return fields
+    
+    def input_profile(self, result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """What ingests need to know about a camera to skip FFmpeg's input analysis"""
+        if not result.get('ok') or not result.get('codec'):
+            return None
+        return {field: result.get(field) for field in INPUT_PROFILE_FIELDS}
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'cached': len(self.cache),
+            'cache_ttl': self.cache_ttl,
+            'timeout': self.timeout,
+            'probed': self.probed,
+            'cache_hits': self.cache_hits,
+            'deduplicated': self.deduplicated,
+        }
+
+# Global probe service instance
+probe_service = ProbeService()
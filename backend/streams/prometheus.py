@@ -0,0 +1,128 @@
+from collections import Counter
+
+from .consumers import stream_manager
+from .metrics import MetricsWriter
+from .probe_service import probe_service
+from .thumbnail_service import thumbnail_service
+
+def collect_metrics(ingest_workers=()) -> str:
+    """Every stream, FFmpeg, thumbnail and probe metric of this process in Prometheus text format.
+
+    Only reads counters the hot paths already keep, so scraping costs the
+    broadcast nothing. ingest_workers are the stats of the run_ingest workers
+    (StreamManager.get_ingest_stats); their FFmpeg metrics stand in for the
+    streams we only follow.
+    """
+    writer = MetricsWriter()
+    streams = [stream_info.get_stats() for stream_info in list(stream_manager.streams.values())]
+    for stats in streams:
+        # Streams opened by ?url= have no id; their masked URL tells them apart
+        stats['label'] = {'stream': stats['stream_id'] if stats['stream_id'] != 'direct' else stats['url']}
+    ingests = _ingest_streams(streams, ingest_workers)
+    _stream_metrics(writer, streams, ingests)
+    _ffmpeg_metrics(writer, ingests)
+    _thumbnail_metrics(writer)
+    _probe_metrics(writer)
+    return writer.render()
+
+def _ingest_streams(streams, ingest_workers):
+    """Streams run by the ingest workers, labelled like the stream we follow them as"""
+    labels = {stats['url']: stats['label'] for stats in streams}
+    return [
+        dict(stats, label=labels.get(stats['url'], {'stream': stats['url']}))
+        for worker in ingest_workers for stats in worker['streams']
+    ]
+
+def _stream_metrics(writer: MetricsWriter, streams, ingests):
+    following = [stats['is_playing'] and (stats['relay'] or {}).get('role') == 'follower' for stats in streams]
+    writer.add('rtsp_ingests_active', 'gauge', 'Running ingests: our own FFmpeg, relayed from another process, or run by an ingest worker', [
+        ({'role': 'ffmpeg'}, sum(1 for stats, follower in zip(streams, following) if stats['is_playing'] and not follower)),
+        ({'role': 'relay'}, sum(following)),
+        ({'role': 'ingest_worker'}, sum(1 for stats in ingests if stats['is_playing'])),
+    ])
+    slots = stream_manager.get_slot_stats()
+    writer.add('rtsp_ingest_slots', 'gauge', 'Ingest slots in use and available (MAX_CONCURRENT_STREAMS)', [
+        ({'state': 'used'}, slots['active_streams']),
+        ({'state': 'available'}, slots['available_slots']),
+    ])
+    writer.add('rtsp_ingest_queue_length', 'gauge', 'Ingests waiting for a slot', [({}, len(slots['queued']))])
+    writer.add('rtsp_admission_rejected_total', 'counter', 'Connections and ingests not admitted', [({}, slots['rejected'])])
+
+    writer.add('rtsp_stream_viewers', 'gauge', 'Connections per stream', [
+        sample for stats in streams for sample in (
+            ({**stats['label'], 'kind': 'video'}, len(stats['subscribers'])),
+            ({**stats['label'], 'kind': 'control'}, stats['connections'] - len(stats['subscribers'])),
+        )
+    ])
+    for name, field, help_text in (
+        ('rtsp_stream_in_bytes_total', 'bytes_in', 'Bytes read from the ingest, all renditions'),
+        ('rtsp_stream_in_chunks_total', 'chunks_in', 'Chunks read from the ingest, all renditions'),
+        ('rtsp_stream_out_bytes_total', 'sent_bytes', 'Bytes sent to video viewers'),
+        ('rtsp_stream_out_chunks_total', 'sent_chunks', 'Chunks sent to video viewers'),
+        ('rtsp_stream_dropped_bytes_total', 'dropped_bytes', 'Bytes dropped for lagging viewers'),
+        ('rtsp_stream_dropped_chunks_total', 'dropped_chunks', 'Chunks dropped for lagging viewers'),
+    ):
+        writer.add(name, 'counter', help_text, [(stats['label'], stats['traffic'][field]) for stats in streams])
+    # FFmpeg-side metrics come from whichever process runs the stream's FFmpeg
+    ingest_urls = {stats['url'] for stats in ingests}
+    ffmpeg_streams = [stats for stats in streams if stats['url'] not in ingest_urls] + ingests
+    writer.add('rtsp_stream_stalls_total', 'counter', 'Ingests killed by the stall watchdog',
+               [(stats['label'], stats['stalls']) for stats in ffmpeg_streams])
+    _resource_metrics(writer, ffmpeg_streams)
+
+    writer.histogram('rtsp_send_seconds', 'Time to send one video chunk to a WebSocket',
+                     [({}, stream_manager.send_latency)])
+    writer.histogram('rtsp_viewer_first_chunk_seconds', 'Time from a viewer attaching to its first video chunk',
+                     [({'attach': kind}, histogram) for kind, histogram in stream_manager.attach_latency.items()])
+
+def _resource_metrics(writer: MetricsWriter, streams):
+    sampled = [(stats['label'], stats['resources']) for stats in streams
+               if stats['resources'] and stats['resources']['cpu_seconds'] is not None]
+    writer.add('rtsp_ffmpeg_cpu_seconds_total', 'counter', 'CPU time used by the stream\'s FFmpeg, from /proc',
+               [(label, resources['cpu_seconds']) for label, resources in sampled])
+    writer.add('rtsp_ffmpeg_rss_bytes', 'gauge', 'Resident memory of the stream\'s FFmpeg, from /proc',
+               [(label, resources['rss_bytes']) for label, resources in sampled])
+    writer.add('rtsp_ffmpeg_backlog_bytes', 'gauge', 'FFmpeg output read but not yet broadcast',
+               [(stats['label'], sum(stats['resources']['backlog_bytes'].values())) for stats in streams if stats['resources']])
+
+def _ffmpeg_metrics(writer: MetricsWriter, ingests):
+    exit_errors = Counter(stream_manager.exit_errors)
+    for stats in ingests:
+        exit_errors.update(stats['exit_errors'])
+    writer.add('rtsp_ffmpeg_exits_total', 'counter', 'FFmpeg exits by classified error code',
+               [({'code': code}, count) for code, count in sorted(exit_errors.items())])
+    writer.add('rtsp_ffmpeg_restarts_total', 'counter', 'FFmpeg restarts by the supervisor',
+               [({}, stream_manager.restarts + sum(stats['restarts'] for stats in ingests))])
+    writer.histogram('rtsp_ffmpeg_first_frame_seconds', 'Time from starting FFmpeg to its first video chunk',
+                     [({}, stream_manager.first_frame_latency)])
+
+def _thumbnail_metrics(writer: MetricsWriter):
+    cache = thumbnail_service.thumbnail_cache.get_stats()
+    writer.add('rtsp_thumbnail_cache_hits_total', 'counter', 'Thumbnail cache hits by tier', [
+        ({'tier': 'memory'}, cache['hits']),
+        ({'tier': 'disk'}, cache['disk_hits']),
+    ])
+    writer.add('rtsp_thumbnail_cache_misses_total', 'counter', 'Thumbnail cache misses', [({}, cache['misses'])])
+    writer.add('rtsp_thumbnail_cache_evictions_total', 'counter', 'Thumbnails evicted from memory',
+               [({}, cache['evictions'])])
+    writer.add('rtsp_thumbnail_cache_bytes', 'gauge', 'Thumbnail cache size by tier', [
+        ({'tier': 'memory'}, cache['memory_bytes']),
+        ({'tier': 'disk'}, cache['disk_bytes']),
+    ])
+    writer.add('rtsp_thumbnail_cache_entries', 'gauge', 'Cached thumbnails by tier', [
+        ({'tier': 'memory'}, cache['memory_entries']),
+        ({'tier': 'disk'}, cache['disk_entries']),
+    ])
+    for name, value, help_text in (
+        ('rtsp_thumbnails_generated_total', thumbnail_service.generated, 'Thumbnails generated'),
+        ('rtsp_thumbnails_failed_total', thumbnail_service.failed, 'Thumbnail generations that failed'),
+        ('rtsp_thumbnails_deduplicated_total', thumbnail_service.deduplicated, 'Requests that joined a running generation'),
+        ('rtsp_thumbnails_served_stale_total', thumbnail_service.served_stale, 'Expired thumbnails served while refreshing'),
+    ):
+        writer.add(name, 'counter', help_text, [({}, value)])
+    writer.histogram('rtsp_thumbnail_generation_seconds', 'Time to generate a thumbnail, by source',
+                     [({'source': source}, histogram) for source, histogram in thumbnail_service.generation_latency.items()])
+
+def _probe_metrics(writer: MetricsWriter):
+    writer.add('rtsp_probes_total', 'counter', 'ffprobe runs', [({}, probe_service.probed)])
+    writer.add('rtsp_probe_cache_hits_total', 'counter', 'Probes answered from the cache', [({}, probe_service.cache_hits)])
@@ -0,0 +1,366 @@
+import os
+import json
+import glob
+import zlib
+import asyncio
+import hashlib
+import logging
+import struct
+import tempfile
+import time
+from typing import Optional, Dict, Any, Callable, List
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .admission import AdmissionRejected
+from .ffmpeg_helper import TSBatch, TSDemuxer, TS_PACKET_SIZE, SNAPSHOT_OUTPUT
+
+logger = logging.getLogger(__name__)
+
+# Relay frame header: rendition name length, payload length
+FRAME_HEADER = struct.Struct('>BI')
+# Seconds an ingest worker gets to answer a stats request
+INGEST_STATS_TIMEOUT = 2.0
+# Last frame an owner sends when it gives up on the camera: its classified FFmpeg error as JSON
+END_FRAME = '.end'
+
+class IngestFailed(ConnectionRefusedError):
+    """The ingest worker gave up on the camera recently; error is its classified FFmpeg error"""
+
+    def __init__(self, error: Dict[str, str]):
+        super().__init__(error['message'])
+        self.error = error
+
+class RelayLease:
+    """A process's claim on one camera.
+
+    The owner runs the FFmpeg ingest and publish()es every frame it broadcasts.
+    Followers don't ingest at all; their frames come from `source`, which reads
+    like an FFmpegProcess so the broadcast loop doesn't care where they came from.
+    """
+
+    owner = True
+    source = None
+
+    def publish(self, rendition: str, data: bytes):
+        """Hand a broadcast frame to the other processes without blocking"""
+
+    @property
+    def followers(self) -> int:
+        return 0
+
+    async def close(self, error: Optional[Dict[str, str]] = None):
+        """Give up the claim. error ({code, message}) tells followers the ingest gave up on the camera."""
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'role': 'owner' if self.owner else 'follower', 'followers': self.followers}
+
+class LocalRelay:
+    """Default backend: no sharing, every process ingests the cameras its own viewers watch"""
+
+    async def join(self, key: str, renditions: List[str],
+                   replay: Callable[[str], Optional[bytes]],
+                   on_idle: Optional[Callable[[], Any]] = None) -> RelayLease:
+        return RelayLease()
+
+class UnixSocketRelay:
+    """Share each camera's ingest between the worker processes of one host.
+
+    The first worker to take an flock on the camera's lock file becomes its
+    owner and listens on a Unix socket next to it; every other worker connects
+    as a follower and receives the owner's frames, starting with the current
+    GOP of each rendition. The lock dies with the owner, so when an owner goes
+    away its followers see EOF and the first to re-take the lock starts FFmpeg.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_buffer: int = 4 * 1024 * 1024,
+                 connect_timeout: float = 5.0):
+        import fcntl  # Unix only
+        self._fcntl = fcntl
+        self.path = path or os.path.join(tempfile.gettempdir(), 'rtsp-stream-relay')
+        self.max_buffer = max_buffer
+        self.connect_timeout = connect_timeout
+        os.makedirs(self.path, exist_ok=True)
+
+    def _paths(self, key: str):
+        # Keys hold credentials; only a digest ever touches the filesystem
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.path, f'{name}.lock'), os.path.join(self.path, f'{name}.sock')
+
+    def _try_lock(self, lock_path: str) -> Optional[int]:
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            self._fcntl.flock(fd, self._fcntl.LOCK_EX | self._fcntl.LOCK_NB)
+            return fd
+        except OSError:
+            os.close(fd)
+            return None
+
+    async def join(self, key: str, renditions: List[str],
+                   replay: Callable[[str], Optional[bytes]],
+                   on_idle: Optional[Callable[[], Any]] = None) -> RelayLease:
+        """Become the camera's owner, or follow the process that already is"""
+        lock_path, socket_path = self._paths(key)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.connect_timeout
+        while True:
+            fd = self._try_lock(lock_path)
+            if fd is not None:
+                lease = _OwnerLease(fd, socket_path, renditions, replay, on_idle, self.max_buffer)
+                await lease.listen()
+                return lease
+            try:
+                reader, writer = await asyncio.open_unix_connection(socket_path)
+                return _FollowerLease(reader, writer, renditions)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Locked but not listening yet, or the owner just died
+                if loop.time() >= deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+class IngestRelay(UnixSocketRelay):
+    """Web-worker side of `manage.py run_ingest`.
+
+    Web workers never run FFmpeg themselves. They follow the camera's relay
+    socket if an ingest worker already serves it, and otherwise ask one of the
+    ingest workers (streams/ingest.py) to start it first: the one with the most
+    free slots, so MAX_CONCURRENT_STREAMS holds across the pool instead of per
+    worker. Ties go to the worker the camera key hashes to.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_buffer: int = 4 * 1024 * 1024,
+                 connect_timeout: float = 5.0, request_timeout: Optional[float] = None):
+        super().__init__(path, max_buffer, connect_timeout)
+        # Starting a camera may wait for an admission slot and then for FFmpeg
+        self.request_timeout = request_timeout or settings.STREAM_ADMISSION_QUEUE_TIMEOUT + settings.FFMPEG_TIMEOUT
+
+    async def join(self, key: str, renditions: List[str],
+                   replay: Callable[[str], Optional[bytes]],
+                   on_idle: Optional[Callable[[], Any]] = None) -> RelayLease:
+        _, socket_path = self._paths(key)
+        try:
+            return await self._follow(socket_path, renditions)
+        except (ConnectionRefusedError, FileNotFoundError):
+            pass
+        await self._request_ingest(key)
+        return await self._follow(socket_path, renditions)
+
+    async def _follow(self, socket_path: str, renditions: List[str]) -> RelayLease:
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+        return _FollowerLease(reader, writer, renditions)
+
+    async def _request_ingest(self, key: str):
+        workers = sorted(glob.glob(ingest_socket_path(self.path, '*')))
+        if not workers:
+            raise ConnectionRefusedError('No ingest workers are running (start them with manage.py run_ingest)')
+        worker = await self._pick_worker(key, workers)
+
+        reply = await self._request(worker, {'action': 'start', 'url': key}, self.request_timeout)
+        if reply.get('ok'):
+            return
+        if 'close_code' in reply:
+            raise AdmissionRejected(reply['close_code'], reply['error_code'], reply['message'])
+        if 'error' in reply:
+            raise IngestFailed(reply['error'])
+        raise ConnectionRefusedError(reply.get('message', 'Ingest worker failed to start the stream'))
+
+    async def _pick_worker(self, key: str, workers: List[str]) -> str:
+        """The ingest worker with the most free slots; ties (and workers that don't answer) go by the key's hash"""
+        preferred = zlib.crc32(key.encode('utf-8')) % len(workers)
+        workers = workers[preferred:] + workers[:preferred]
+
+        async def free_slots(worker: str) -> Optional[int]:
+            try:
+                slots = (await self._request(worker, {'action': 'slots'}, INGEST_STATS_TIMEOUT))['slots']
+                return slots['available_slots'] - len(slots['queued'])
+            except (OSError, ValueError, KeyError, asyncio.TimeoutError):
+                return None
+
+        free = await asyncio.gather(*(free_slots(worker) for worker in workers))
+        answered = [(slots, -index) for index, slots in enumerate(free) if slots is not None]
+        return workers[-max(answered)[1]] if answered else workers[0]
+
+    async def get_ingest_stats(self) -> List[Dict[str, Any]]:
+        """Stream, FFmpeg and slot stats of every ingest worker; workers that don't answer are left out"""
+        async def ask(worker: str) -> Optional[Dict[str, Any]]:
+            try:
+                return (await self._request(worker, {'action': 'stats'}, INGEST_STATS_TIMEOUT)).get('stats')
+            except (OSError, ValueError, asyncio.TimeoutError) as e:
+                logger.warning(f"No stats from ingest worker {os.path.basename(worker)}: {e}")
+                return None
+
+        workers = sorted(glob.glob(ingest_socket_path(self.path, '*')))
+        return [stats for stats in await asyncio.gather(*(ask(worker) for worker in workers)) if stats]
+
+    async def _request(self, worker: str, request: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """One JSON request/reply on an ingest worker's control socket"""
+        reader, writer = await asyncio.open_unix_connection(worker)
+        try:
+            writer.write(json.dumps(request).encode('utf-8') + b'\n')
+            await writer.drain()
+            return json.loads(await asyncio.wait_for(reader.readline(), timeout) or b'{}')
+        finally:
+            writer.close()
+
+class _OwnerLease(RelayLease):
+    def __init__(self, fd: int, socket_path: str, renditions: List[str],
+                 replay: Callable[[str], Optional[bytes]],
+                 on_idle: Optional[Callable[[], Any]], max_buffer: int):
+        self.fd = fd
+        self.socket_path = socket_path
+        self.renditions = renditions
+        self.replay = replay
+        self.on_idle = on_idle
+        self.max_buffer = max_buffer
+        self.server = None
+        self.writers = set()
+        self.dropped_followers = 0
+
+    async def listen(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # left behind by a dead owner; we hold the lock now
+        self.server = await asyncio.start_unix_server(self._on_follower, path=self.socket_path)
+
+    async def _on_follower(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Start the follower on a keyframe, then it gets every frame from here on
+        for rendition in self.renditions + [SNAPSHOT_OUTPUT]:
+            data = self.replay(rendition)
+            if data:
+                writer.write(_frame(rendition, data))
+        self.writers.add(writer)
+        logger.info(f"Relay follower connected ({len(self.writers)} total)")
+        try:
+            await reader.read()  # followers never send; EOF means they left
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+            logger.info(f"Relay follower disconnected ({len(self.writers)} left)")
+            if not self.writers and self.server and self.on_idle:
+                await self.on_idle()
+
+    def publish(self, rendition: str, data: bytes):
+        if not self.writers:
+            return
+        frame = _frame(rendition, data)
+        for writer in list(self.writers):
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                # Never let one follower hold the owner back; it reconnects and replays from a keyframe
+                logger.warning(f"Relay follower fell {self.max_buffer} bytes behind, dropping it")
+                self.dropped_followers += 1
+                self.writers.discard(writer)
+                writer.transport.abort()
+                continue
+            writer.write(frame)
+
+    @property
+    def followers(self) -> int:
+        return len(self.writers)
+
+    async def close(self, error: Optional[Dict[str, str]] = None):
+        if self.server:
+            self.server.close()
+            self.server = None
+        for writer in list(self.writers):
+            if error:
+                writer.write(_frame(END_FRAME, json.dumps(error).encode('utf-8')))
+            writer.close()  # flushes what is buffered first
+        self.writers.clear()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        if self.fd is not None:
+            os.close(self.fd)  # releases the flock
+            self.fd = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = super().get_stats()
+        stats['dropped_followers'] = self.dropped_followers
+        return stats
+
+class _FollowerLease(RelayLease):
+    owner = False
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, renditions: List[str]):
+        self.writer = writer
+        self.source = RelaySource(reader, renditions)
+
+    async def close(self, error: Optional[Dict[str, str]] = None):
+        await self.source.stop()
+        self.writer.close()
+
+class RelaySource:
+    """Frames relayed from the owning process, read like an FFmpegProcess"""
+
+    # Frames arrive already paced by the owner, so any read counts as a full one
+    read_size = TS_PACKET_SIZE
+
+    def __init__(self, reader: asyncio.StreamReader, renditions: List[str]):
+        self.reader = reader
+        self.renditions = list(renditions)
+        self.queues = {name: asyncio.Queue() for name in self.renditions}
+        self.demuxers = {name: TSDemuxer() for name in self.renditions}
+        self.ended = False
+        self.error: Optional[Dict[str, str]] = None  # why the owner gave up on the camera, if it said
+        # Latest JPEG still published by the owner, like FFmpegProcess.latest_snapshot
+        self.latest_snapshot: Optional[bytes] = None
+        self.latest_snapshot_at: Optional[float] = None
+        self._task = asyncio.create_task(self._read())
+
+    async def _read(self):
+        try:
+            while True:
+                name_length, data_length = FRAME_HEADER.unpack(await self.reader.readexactly(FRAME_HEADER.size))
+                rendition = (await self.reader.readexactly(name_length)).decode('ascii')
+                data = await self.reader.readexactly(data_length)
+                if rendition in self.queues:
+                    self.queues[rendition].put_nowait(data)
+                elif rendition == SNAPSHOT_OUTPUT:
+                    self.latest_snapshot = data
+                    self.latest_snapshot_at = time.time()
+                elif rendition == END_FRAME:
+                    self.error = json.loads(data)
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.ended = True
+            for queue in self.queues.values():
+                queue.put_nowait(None)
+
+    async def read_batches(self, timeout: Optional[float] = None,
+                           rendition: Optional[str] = None) -> Optional[List[TSBatch]]:
+        """Next relayed frame as packet-aligned batches, or None once the owner has gone"""
+        queue = self.queues[rendition or self.renditions[0]]
+        data = await asyncio.wait_for(queue.get(), timeout) if timeout else await queue.get()
+        if data is None:
+            queue.put_nowait(None)
+            return None
+        return self.demuxers[rendition or self.renditions[0]].feed(data)
+
+    async def stop(self):
+        if not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def is_alive(self) -> bool:
+        return not self.ended
+
+def ingest_socket_path(path: str, index) -> str:
+    """Control socket of a run_ingest worker"""
+    return os.path.join(path, f'ingest-{index}.sock')
+
+def _frame(rendition: str, data: bytes) -> bytes:
+    name = rendition.encode('ascii')
+    return FRAME_HEADER.pack(len(name), len(data)) + name + data
+
+def load_relay():
+    """Instantiate the STREAM_RELAY_BACKEND with STREAM_RELAY_OPTIONS"""
+    backend = import_string(settings.STREAM_RELAY_BACKEND)
+    return backend(**settings.STREAM_RELAY_OPTIONS)
@@ -6,8 +6,10 @@ class StreamSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Stream
-        fields = ['id', 'url', 'label', 'created_at', 'ws_url']
-        read_only_fields = ['id', 'created_at', 'ws_url']
+        fields = ['id', 'url', 'label', 'created_at', 'ws_url', 'codec', 'width', 'height', 'fps', 'probed_at',
+                  'input_profile']
+        read_only_fields = ['id', 'created_at', 'ws_url', 'codec', 'width', 'height', 'fps', 'probed_at',
+                            'input_profile']
 
 class StreamCreateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,94 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from streams.admission import AdmissionController, AdmissionRejected, CLOSE_CODE_CLIENT_LIMIT, CLOSE_CODE_SERVER_BUSY
+
+class AdmissionControllerTests(IsolatedAsyncioTestCase):
+    async def test_slots_are_granted_until_the_limit(self):
+        admission = AdmissionController(max_streams=2, max_streams_per_client=4)
+        await admission.acquire('a')
+        await admission.acquire('b')
+        await admission.acquire('a')  # attaching to a running ingest is free
+
+        self.assertEqual(admission.active, {'a', 'b'})
+
+    async def test_queued_ingest_times_out(self):
+        admission = AdmissionController(max_streams=1, max_streams_per_client=4, queue_timeout=0.01)
+        await admission.acquire('a')
+
+        with self.assertRaises(AdmissionRejected) as raised:
+            await admission.acquire('b')
+
+        self.assertEqual(raised.exception.close_code, CLOSE_CODE_SERVER_BUSY)
+        self.assertEqual(admission.waiting, [])
+        self.assertEqual(admission.rejected, 1)
+
+    async def test_full_queue_is_rejected_at_once(self):
+        admission = AdmissionController(max_streams=1, max_streams_per_client=4, max_queue=1)
+        await admission.acquire('a')
+        queued = asyncio.create_task(admission.acquire('b'))
+        await asyncio.sleep(0)
+
+        with self.assertRaises(AdmissionRejected):
+            await admission.acquire('c')
+
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+
+    async def test_freed_slot_goes_to_the_ingest_with_most_viewers(self):
+        admission = AdmissionController(max_streams=1, max_streams_per_client=4)
+        await admission.acquire('a')
+        viewers = {'b': 1, 'c': 3, 'd': 3}
+        waiting = {key: asyncio.create_task(admission.acquire(key, priority=lambda key=key: viewers[key]))
+                   for key in ('b', 'c', 'd')}
+        await asyncio.sleep(0)
+
+        admission.release('a')
+        await asyncio.wait_for(waiting['c'], 1)
+
+        # Most viewers first, then first come first served
+        self.assertEqual(admission.active, {'c'})
+        self.assertFalse(waiting['b'].done() or waiting['d'].done())
+
+        admission.release('c')
+        await asyncio.wait_for(waiting['d'], 1)
+        self.assertEqual(admission.active, {'d'})
+
+        waiting['b'].cancel()
+        await asyncio.gather(*waiting.values(), return_exceptions=True)
+
+    async def test_queueing_asks_for_an_idle_slot_to_be_reclaimed(self):
+        admission = AdmissionController(max_streams=1, max_streams_per_client=4)
+        await admission.acquire('idle')
+        admission.reclaim = lambda: admission.release('idle')
+
+        await asyncio.wait_for(admission.acquire('b'), 1)
+
+        self.assertEqual(admission.active, {'b'})
+
+    async def test_cancelled_waiter_leaves_the_queue(self):
+        admission = AdmissionController(max_streams=1, max_streams_per_client=4)
+        await admission.acquire('a')
+        queued = asyncio.create_task(admission.acquire('b'))
+        await asyncio.sleep(0)
+
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        admission.release('a')
+
+        self.assertEqual(admission.waiting, [])
+        self.assertEqual(admission.active, set())
+
+    async def test_per_client_limit(self):
+        admission = AdmissionController(max_streams=10, max_streams_per_client=2)
+        admission.register_client('10.0.0.1', 'a')
+        admission.register_client('10.0.0.1', 'b')
+        admission.register_client('10.0.0.1', 'a')  # another connection to a stream it already watches
+
+        with self.assertRaises(AdmissionRejected) as raised:
+            admission.register_client('10.0.0.1', 'c')
+        self.assertEqual(raised.exception.close_code, CLOSE_CODE_CLIENT_LIMIT)
+
+        admission.unregister_client('10.0.0.1', 'b')
+        admission.register_client('10.0.0.1', 'c')
+        self.assertEqual(dict(admission.clients['10.0.0.1']), {'a': 2, 'c': 1})
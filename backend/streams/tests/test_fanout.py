@@ -0,0 +1,102 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from streams.fanout import Subscriber, CLOSE_CODE_TOO_SLOW, POLICY_DISCONNECT, POLICY_DOWNGRADE
+
+class VideoConnection:
+    client_id = 'viewer'
+
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+        self.unblocked = asyncio.Event()
+        self.unblocked.set()
+
+    async def send(self, bytes_data):
+        await self.unblocked.wait()
+        self.sent.append(bytes_data)
+
+    async def close(self, code=None):
+        self.closed_with = code
+
+class SubscriberTests(IsolatedAsyncioTestCase):
+    def subscriber(self, connection, **options):
+        subscriber = Subscriber(connection, max_queue=2, **options)
+        self.addAsyncCleanup(subscriber.close)
+        return subscriber
+
+    async def drain(self, subscriber):
+        while not subscriber.queue.empty():
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+    async def test_replay_is_sent_before_live_chunks(self):
+        connection = VideoConnection()
+        subscriber = self.subscriber(connection)
+        subscriber.start(b'gop')
+        subscriber.offer(b'live')
+
+        await self.drain(subscriber)
+
+        self.assertEqual(connection.sent, [b'gop', b'live'])
+        self.assertEqual(subscriber.replayed_bytes, 3)
+
+    async def test_offer_never_waits_for_a_slow_viewer(self):
+        connection = VideoConnection()
+        connection.unblocked.clear()
+        subscriber = self.subscriber(connection)
+        subscriber.start()
+
+        accepted = [subscriber.offer(b'x') for _ in range(5)]
+
+        # The third chunk finds the queue full; the rest wait for a keyframe
+        self.assertEqual(accepted, [True, True, False, False, False])
+        self.assertEqual(subscriber.lag_events, 1)
+
+    async def test_lagging_viewer_resumes_at_the_next_keyframe(self):
+        connection = VideoConnection()
+        connection.unblocked.clear()
+        subscriber = self.subscriber(connection)
+        for chunk in (b'a', b'b', b'c'):
+            subscriber.offer(chunk)
+
+        self.assertTrue(subscriber.waiting_for_keyframe)
+        self.assertFalse(subscriber.offer(b'delta'))
+        self.assertTrue(subscriber.offer(b'..KEY', keyframe_offset=2))
+
+        subscriber.start()
+        connection.unblocked.set()
+        await self.drain(subscriber)
+        self.assertEqual(connection.sent, [b'KEY'])
+
+    async def test_downgrade_policy_asks_for_a_cheaper_rendition(self):
+        downgraded = []
+
+        def on_downgrade(subscriber):
+            downgraded.append(subscriber)
+            subscriber.switch_to('low', b'low-gop')
+            return True
+
+        subscriber = self.subscriber(VideoConnection(), policy=POLICY_DOWNGRADE, on_downgrade=on_downgrade,
+                                     rendition='medium')
+        for chunk in (b'a', b'b', b'c'):
+            subscriber.offer(chunk)
+
+        self.assertEqual(downgraded, [subscriber])
+        self.assertEqual(subscriber.rendition, 'low')
+        self.assertFalse(subscriber.waiting_for_keyframe)
+
+    async def test_disconnect_policy_closes_the_viewer(self):
+        connection = VideoConnection()
+        removed = asyncio.Event()
+
+        async def on_error(subscriber):
+            removed.set()
+
+        subscriber = self.subscriber(connection, policy=POLICY_DISCONNECT, on_error=on_error)
+        for chunk in (b'a', b'b', b'c'):
+            subscriber.offer(chunk)
+        await asyncio.wait_for(removed.wait(), 1)
+
+        self.assertEqual(connection.closed_with, CLOSE_CODE_TOO_SLOW)
+        self.assertFalse(subscriber.offer(b'd'))
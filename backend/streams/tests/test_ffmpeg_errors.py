@@ -0,0 +1,33 @@
+from django.test import SimpleTestCase
+
+from streams.ffmpeg_helper import FFmpegProcess
+
+class ParseFFmpegErrorsTests(SimpleTestCase):
+    def setUp(self):
+        self.process = FFmpegProcess('rtsp://10.0.0.5/cam')
+
+    def classify(self, stderr: str) -> str:
+        return self.process._parse_ffmpeg_errors(stderr)['code']
+
+    def test_known_errors(self):
+        cases = {
+            '[rtsp @ 0x55] method DESCRIBE failed: 401 Unauthorized': 'AUTH',
+            '[rtsp @ 0x55] method DESCRIBE failed: 404 Not Found': 'NOT_FOUND',
+            'rtsp://10.0.0.5/cam: Connection refused': 'CONNECTION_REFUSED',
+            'rtsp://10.0.0.5/cam: Connection timed out': 'TIMEOUT',
+            '[tcp @ 0x55] Timeout waiting for data': 'TIMEOUT',
+            'rtsp://10.0.0.5/cam: Invalid data found when processing input': 'INVALID_STREAM',
+        }
+        for stderr, code in cases.items():
+            with self.subTest(stderr=stderr):
+                self.assertEqual(self.classify(stderr), code)
+
+    def test_unrecognised_output_is_unknown(self):
+        errors = self.process._parse_ffmpeg_errors('Conversion failed!')
+
+        self.assertEqual(errors['code'], 'UNKNOWN')
+        self.assertEqual(errors['details'], 'Conversion failed!')
+
+    def test_first_matching_pattern_wins(self):
+        # An auth failure reported alongside a timeout is still an auth failure
+        self.assertEqual(self.classify('401 Unauthorized\nConnection timed out'), 'AUTH')
@@ -0,0 +1,91 @@
+from django.test import SimpleTestCase
+
+from streams.ffmpeg_helper import TSBatch, TS_PACKET_SIZE, TS_SYNC_BYTE, MPEG1_SEQUENCE_HEADER
+from streams.gop_buffer import GopBuffer
+
+PMT_PID = 0x1000
+VIDEO_PID = 0x0100
+
+def ts_packet(pid: int, payload: bytes = b'', start: bool = False, random_access: bool = False) -> bytes:
+    header = bytes([TS_SYNC_BYTE, (0x40 if start else 0) | (pid >> 8), pid & 0xFF])
+    if random_access:
+        # One-byte adaptation field carrying only the random access indicator
+        packet = header + bytes([0x30, 1, 0x40]) + payload
+    else:
+        packet = header + bytes([0x10]) + payload
+    return packet + b'\xff' * (TS_PACKET_SIZE - len(packet))
+
+def pat() -> bytes:
+    # pointer field, table id 0, section length 13, TS id, version, section numbers,
+    # program 1 -> PMT_PID, CRC (not checked)
+    section = bytes([0x00, 0xB0, 13, 0x00, 0x01, 0xC1, 0x00, 0x00,
+                     0x00, 0x01, 0xE0 | (PMT_PID >> 8), PMT_PID & 0xFF]) + bytes(4)
+    return ts_packet(0, b'\x00' + section, start=True)
+
+def pmt(stream_type: int = 0x02) -> bytes:
+    # program 1, PCR on the video PID, no program info, one elementary stream
+    section = bytes([0x02, 0xB0, 18, 0x00, 0x01, 0xC1, 0x00, 0x00,
+                     0xE0 | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0xF0, 0x00,
+                     stream_type, 0xE0 | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0xF0, 0x00]) + bytes(4)
+    return ts_packet(PMT_PID, b'\x00' + section, start=True)
+
+def picture(keyframe: bool = False, random_access: bool = False) -> bytes:
+    pes = b'\x00\x00\x01\xe0\x00\x00\x80\x00\x00'
+    return ts_packet(VIDEO_PID, pes + (MPEG1_SEQUENCE_HEADER if keyframe else b'\x00\x00\x01\x00'),
+                     start=True, random_access=random_access)
+
+def continuation() -> bytes:
+    return ts_packet(VIDEO_PID, b'\x00' * 16)
+
+def batch(*packets: bytes) -> TSBatch:
+    return TSBatch(memoryview(b''.join(packets)))
+
+class GopBufferTests(SimpleTestCase):
+    def test_no_replay_before_a_keyframe(self):
+        buffer = GopBuffer()
+        buffer.push(batch(pat(), pmt(), picture(), continuation()))
+
+        self.assertIsNone(buffer.replay())
+        self.assertEqual(buffer.pmt_pid, PMT_PID)
+        self.assertEqual(buffer.video_pid, VIDEO_PID)
+
+    def test_replay_is_pat_pmt_and_the_current_gop(self):
+        buffer = GopBuffer()
+        offset = buffer.push(batch(pat(), pmt(), picture(), picture(keyframe=True), continuation()))
+        buffer.push(batch(picture(), continuation()))
+
+        self.assertEqual(offset, 3 * TS_PACKET_SIZE)
+        self.assertEqual(buffer.replay(), pat() + pmt() + picture(keyframe=True) + continuation()
+                         + picture() + continuation())
+
+    def test_new_keyframe_starts_a_new_gop(self):
+        buffer = GopBuffer()
+        buffer.push(batch(pat(), pmt(), picture(keyframe=True), picture()))
+        buffer.push(batch(continuation(), picture(keyframe=True), continuation()))
+
+        self.assertEqual(buffer.replay(), pat() + pmt() + picture(keyframe=True) + continuation())
+        self.assertEqual(buffer.size, 2 * TS_PACKET_SIZE)
+
+    def test_random_access_indicator_marks_a_keyframe(self):
+        buffer = GopBuffer()
+        offset = buffer.push(batch(pat(), pmt(stream_type=0x1B), picture(random_access=True)))
+
+        self.assertEqual(offset, 2 * TS_PACKET_SIZE)
+        self.assertIsNotNone(buffer.replay())
+
+    def test_pictures_counts_picture_starts_only(self):
+        buffer = GopBuffer()
+        buffer.push(batch(pat(), pmt(), picture(keyframe=True), continuation(), picture(), continuation()))
+
+        self.assertEqual(buffer.pictures, 2)
+
+    def test_oversized_gop_is_dropped_until_the_next_keyframe(self):
+        buffer = GopBuffer(max_bytes=3 * TS_PACKET_SIZE)
+        buffer.push(batch(pat(), pmt(), picture(keyframe=True)))
+        buffer.push(batch(continuation(), continuation(), continuation()))
+
+        self.assertIsNone(buffer.replay())
+        self.assertEqual(buffer.size, 0)
+
+        buffer.push(batch(picture(keyframe=True)))
+        self.assertEqual(buffer.replay(), pat() + pmt() + picture(keyframe=True))
@@ -0,0 +1,61 @@
+import asyncio
+import tempfile
+import time
+from unittest import IsolatedAsyncioTestCase, mock
+
+from django.test import override_settings
+
+from streams.ingest import IngestWorker
+
+class StartStreamTests(IsolatedAsyncioTestCase):
+    url = 'rtsp://10.0.0.5/cam'
+    error = {'code': 'AUTH', 'message': 'Authentication failed'}
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.enterContext(override_settings(STREAM_RESTART_MAX_BACKOFF=60))
+        self.worker = IngestWorker(0, self.tmp.name, idle_grace=1, max_streams=2)
+
+    async def stream(self, failed_for=None):
+        """The worker's stream for the camera, as if it gave up failed_for seconds ago"""
+        with mock.patch('streams.ingest.IngestStream.start', mock.AsyncMock(return_value=False)):
+            await self.worker.start_stream(self.url)
+        stream = self.worker.streams[self.url]
+        if failed_for is not None:
+            stream.failure = self.error
+            stream.failed_at = time.monotonic() - failed_for
+        return stream
+
+    async def test_camera_that_just_failed_is_not_started_again(self):
+        stream = await self.stream(failed_for=5)
+
+        with mock.patch.object(stream, 'start', mock.AsyncMock()) as start:
+            reply = await self.worker.start_stream(self.url)
+
+        start.assert_not_called()
+        self.assertEqual(reply, {'ok': False, 'error': self.error, 'message': 'Authentication failed'})
+
+    async def test_camera_is_tried_again_after_the_backoff(self):
+        stream = await self.stream(failed_for=61)
+
+        with mock.patch.object(stream, 'start', mock.AsyncMock(return_value=False)) as start:
+            reply = await self.worker.start_stream(self.url)
+
+        start.assert_called_once()
+        self.assertEqual(reply, {'ok': False, 'message': 'FFmpeg failed to start'})
+
+    async def test_restarting_camera_is_followed_not_started(self):
+        stream = await self.stream()
+        stream._restart_task = asyncio.create_task(asyncio.sleep(60))
+        self.addAsyncCleanup(self.cancel, stream._restart_task)
+
+        with mock.patch.object(stream, 'start', mock.AsyncMock()) as start:
+            reply = await self.worker.start_stream(self.url)
+
+        start.assert_not_called()
+        self.assertEqual(reply, {'ok': True})
+
+    async def cancel(self, task):
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
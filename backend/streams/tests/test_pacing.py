@@ -0,0 +1,76 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from streams.ffmpeg_helper import TSBatch, TS_PACKET_SIZE, TS_SYNC_BYTE
+from streams.pacing import ChunkPacer
+
+def ts_batch(packets: int) -> TSBatch:
+    packet = bytes([TS_SYNC_BYTE, 0x01, 0x00, 0x10]) + bytes(TS_PACKET_SIZE - 4)
+    return TSBatch(memoryview(packet * packets))
+
+class FakeSource:
+    """Stands in for FFmpegProcess: hands out queued reads, None once ended"""
+
+    def __init__(self, read_size: int = TS_PACKET_SIZE * 10):
+        self.read_size = read_size
+        self.reads = asyncio.Queue()
+
+    def put(self, *reads):
+        for read in reads:
+            self.reads.put_nowait(read)
+
+    async def read_batches(self, timeout=None, rendition=None):
+        return await asyncio.wait_for(self.reads.get(), timeout)
+
+async def collect(pacer: ChunkPacer, source: FakeSource):
+    return [frame async for frame in pacer.frames_from(source)]
+
+class ChunkPacerTests(IsolatedAsyncioTestCase):
+    async def test_small_reads_are_coalesced_until_max_frame_bytes(self):
+        source = FakeSource()
+        source.put(*([[ts_batch(1)]] * 5), None)
+        pacer = ChunkPacer(max_frame_bytes=3 * TS_PACKET_SIZE, max_delay=1)
+
+        frames = await collect(pacer, source)
+
+        self.assertEqual([len(frame) for frame in frames], [3, 2])
+        self.assertEqual(pacer.frames, 2)
+        self.assertEqual(pacer.bytes, 5 * TS_PACKET_SIZE)
+
+    async def test_full_read_goes_out_without_waiting(self):
+        source = FakeSource(read_size=TS_PACKET_SIZE * 10)
+        source.put([ts_batch(9)])
+        pacer = ChunkPacer(max_delay=60)
+
+        frames = pacer.frames_from(source)
+        frame = await asyncio.wait_for(frames.__anext__(), 1)
+
+        self.assertEqual(sum(batch.nbytes for batch in frame), 9 * TS_PACKET_SIZE)
+        await frames.aclose()
+
+    async def test_frame_is_sent_when_max_delay_expires(self):
+        source = FakeSource()
+        source.put([ts_batch(1)])
+        pacer = ChunkPacer(max_delay=0.01)
+
+        frames = pacer.frames_from(source)
+        frame = await asyncio.wait_for(frames.__anext__(), 1)
+
+        self.assertEqual(len(frame), 1)
+        await frames.aclose()
+
+    async def test_pending_frame_is_flushed_when_source_ends(self):
+        source = FakeSource()
+        source.put([ts_batch(1)], [ts_batch(1)], None)
+
+        frames = await collect(ChunkPacer(max_delay=1), source)
+
+        self.assertEqual([len(frame) for frame in frames], [2])
+
+    async def test_empty_reads_are_skipped(self):
+        source = FakeSource()
+        source.put([], [ts_batch(2)], None)
+
+        frames = await collect(ChunkPacer(max_delay=0), source)
+
+        self.assertEqual([len(frame) for frame in frames], [1])
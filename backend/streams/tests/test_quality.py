@@ -0,0 +1,29 @@
+from django.test import SimpleTestCase
+
+from streams.ffmpeg_helper import resolve_quality, PASSTHROUGH
+
+class ResolveQualityTests(SimpleTestCase):
+    def test_requested_rendition_when_available(self):
+        self.assertEqual(resolve_quality('low', ['low', 'medium']), 'low')
+        self.assertEqual(resolve_quality('high', ['low', 'medium', 'high']), 'high')
+
+    def test_closest_rung_when_missing(self):
+        self.assertEqual(resolve_quality('high', ['low', 'medium']), 'medium')
+        self.assertEqual(resolve_quality('low', ['medium', 'high']), 'medium')
+        self.assertEqual(resolve_quality('high', ['low']), 'low')
+
+    def test_ties_go_to_the_cheaper_rendition(self):
+        self.assertEqual(resolve_quality('medium', ['low', 'high']), 'low')
+
+    def test_unknown_or_missing_request_means_medium(self):
+        self.assertEqual(resolve_quality(None, ['low', 'medium', 'high']), 'medium')
+        self.assertEqual(resolve_quality('ultra', ['low', 'medium', 'high']), 'medium')
+        self.assertEqual(resolve_quality(None, ['high']), 'high')
+
+    def test_passthrough_is_never_mixed_with_the_ladder(self):
+        self.assertEqual(resolve_quality(PASSTHROUGH, ['medium', PASSTHROUGH]), PASSTHROUGH)
+        self.assertIsNone(resolve_quality(PASSTHROUGH, ['low', 'medium']))
+        self.assertIsNone(resolve_quality('medium', [PASSTHROUGH]))
+
+    def test_nothing_available(self):
+        self.assertIsNone(resolve_quality('medium', []))
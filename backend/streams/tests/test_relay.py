@@ -0,0 +1,121 @@
+import asyncio
+import os
+import tempfile
+import zlib
+from unittest import IsolatedAsyncioTestCase, mock
+
+from streams.ffmpeg_helper import TS_PACKET_SIZE, TS_SYNC_BYTE
+from streams.relay import IngestFailed, IngestRelay, UnixSocketRelay, ingest_socket_path
+
+GOP = bytes([TS_SYNC_BYTE]) + bytes(TS_PACKET_SIZE - 1)
+
+def joined(batches) -> bytes:
+    return b''.join(bytes(batch.data) for batch in batches)
+
+class UnixSocketRelayTests(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.relay = UnixSocketRelay(path=self.tmp.name, connect_timeout=1)
+
+    async def join(self):
+        lease = await self.relay.join('rtsp://10.0.0.5/cam', ['low'], lambda rendition: GOP if rendition == 'low' else None)
+        self.addAsyncCleanup(lease.close)
+        return lease
+
+    async def test_second_process_follows_from_the_current_gop(self):
+        owner = await self.join()
+        follower = await self.join()
+
+        self.assertTrue(owner.owner)
+        self.assertFalse(follower.owner)
+        batches = await asyncio.wait_for(follower.source.read_batches(rendition='low'), 1)
+        self.assertEqual(joined(batches), GOP)
+
+    async def test_owner_giving_up_tells_followers_why(self):
+        owner = await self.join()
+        follower = await self.join()
+        await asyncio.wait_for(follower.source.read_batches(rendition='low'), 1)  # the GOP replay
+
+        await owner.close({'code': 'AUTH', 'message': 'Authentication failed'})
+
+        self.assertIsNone(await asyncio.wait_for(follower.source.read_batches(rendition='low'), 1))
+        self.assertEqual(follower.source.error, {'code': 'AUTH', 'message': 'Authentication failed'})
+
+    async def test_owner_going_away_is_not_an_error(self):
+        owner = await self.join()
+        follower = await self.join()
+        await asyncio.wait_for(follower.source.read_batches(rendition='low'), 1)
+
+        await owner.close()
+
+        self.assertIsNone(await asyncio.wait_for(follower.source.read_batches(rendition='low'), 1))
+        self.assertIsNone(follower.source.error)
+
+class IngestRelayTests(IsolatedAsyncioTestCase):
+    key = 'rtsp://10.0.0.5/cam'
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.relay = IngestRelay(path=self.tmp.name, request_timeout=1)
+        self.workers = [ingest_socket_path(self.tmp.name, index) for index in range(3)]
+        for worker in self.workers:
+            open(worker, 'w').close()  # only globbed; requests are answered by reply()
+
+    def answer(self, replies):
+        async def reply(worker, request, timeout):
+            answer = replies[request['action']](worker)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+        return mock.patch.object(self.relay, '_request', reply)
+
+    def slots(self, free):
+        return lambda worker: {'slots': {'available_slots': free[worker], 'queued': []}}
+
+    async def test_camera_goes_to_the_worker_with_most_free_slots(self):
+        free = dict(zip(self.workers, (1, 3, 2)))
+
+        with self.answer({'slots': self.slots(free)}):
+            worker = await self.relay._pick_worker(self.key, self.workers)
+
+        self.assertEqual(worker, self.workers[1])
+
+    async def test_ties_go_to_the_worker_the_key_hashes_to(self):
+        free = dict.fromkeys(self.workers, 2)
+
+        with self.answer({'slots': self.slots(free)}):
+            worker = await self.relay._pick_worker(self.key, self.workers)
+
+        self.assertEqual(worker, self.workers[zlib.crc32(self.key.encode('utf-8')) % len(self.workers)])
+
+    async def test_workers_that_do_not_answer_are_skipped(self):
+        free = dict(zip(self.workers, (1, 3, 2)))
+
+        def slots(worker):
+            return ConnectionRefusedError() if worker == self.workers[1] else self.slots(free)(worker)
+
+        with self.answer({'slots': slots}):
+            worker = await self.relay._pick_worker(self.key, self.workers)
+
+        self.assertEqual(worker, self.workers[2])
+
+    async def test_ingest_worker_failure_is_raised_with_its_error(self):
+        error = {'code': 'AUTH', 'message': 'Authentication failed'}
+        replies = {
+            'slots': self.slots(dict.fromkeys(self.workers, 1)),
+            'start': lambda worker: {'ok': False, 'error': error, 'message': error['message']},
+        }
+
+        with self.answer(replies), self.assertRaises(IngestFailed) as raised:
+            await self.relay._request_ingest(self.key)
+
+        self.assertEqual(raised.exception.error, error)
+
+    async def test_no_workers_is_refused(self):
+        for worker in self.workers:
+            os.unlink(worker)
+
+        with self.assertRaises(ConnectionRefusedError):
+            await self.relay._request_ingest(self.key)
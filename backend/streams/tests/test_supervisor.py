@@ -0,0 +1,171 @@
+import asyncio
+import json
+from unittest import IsolatedAsyncioTestCase, mock
+
+from django.test import override_settings
+
+from streams.consumers import StreamInfo, StreamManager
+
+class FakeProcess:
+    """Stands in for an FFmpegProcess that has exited with an error"""
+
+    def __init__(self, code, message='FFmpeg exited'):
+        self.error = {'code': code, 'message': message, 'details': ''}
+        self.stopped = False
+
+    async def get_error_info(self):
+        return self.error
+
+    async def stop(self):
+        self.stopped = True
+
+class ControlConnection:
+    video_only = False
+    client_id = 'viewer'
+
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, text_data):
+        self.messages.append(json.loads(text_data))
+
+class RestartSupervisorTests(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.enterContext(override_settings(STREAM_RESTART_BACKOFF=30, STREAM_RESTART_MAX_BACKOFF=60,
+                                            STREAM_RESTART_MAX_ATTEMPTS=None))
+
+    def watched_stream(self, code):
+        stream = StreamInfo('cam', 'rtsp://10.0.0.5/cam')
+        stream.ffmpeg_process = FakeProcess(code)
+        stream.viewer = ControlConnection()
+        stream.connections.add(stream.viewer)
+        return stream
+
+    async def cancel_restart(self, stream):
+        task = stream._restart_task
+        stream._cancel_restart()
+        if task:
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def test_permanent_error_is_not_restarted(self):
+        stream = self.watched_stream('AUTH')
+
+        await stream._supervise_exit(watched=True)
+
+        self.assertFalse(stream.is_restarting)
+        self.assertEqual(stream.failure['code'], 'AUTH')
+        self.assertEqual(stream.viewer.messages, [{'type': 'error', 'code': 'AUTH', 'message': 'FFmpeg exited'}])
+
+    async def test_transient_error_restarts_after_backoff(self):
+        stream = self.watched_stream('CONNECTION_REFUSED')
+
+        await stream._supervise_exit(watched=True)
+        self.addAsyncCleanup(self.cancel_restart, stream)
+
+        self.assertTrue(stream.is_restarting)
+        self.assertEqual(stream.restart_attempts, 1)
+        self.assertIsNone(stream.failure)
+        [status] = stream.viewer.messages
+        self.assertEqual(status['phase'], 'reconnecting')
+        self.assertEqual(status['code'], 'CONNECTION_REFUSED')
+        self.assertTrue(24 <= status['retry_in'] <= 36)  # STREAM_RESTART_BACKOFF with jitter
+
+    async def test_backoff_doubles_up_to_the_limit(self):
+        stream = StreamInfo('cam', 'rtsp://10.0.0.5/cam')
+
+        with mock.patch('streams.consumers.random.uniform', return_value=1):
+            delays = []
+            for attempts in range(4):
+                stream.restart_attempts = attempts
+                delays.append(stream._restart_delay())
+
+        self.assertEqual(delays, [30, 60, 60, 60])
+
+    async def test_unwatched_stream_is_not_restarted(self):
+        stream = self.watched_stream('CONNECTION_REFUSED')
+
+        await stream._supervise_exit(watched=False)
+
+        self.assertFalse(stream.is_restarting)
+        self.assertEqual(stream.failure['code'], 'CONNECTION_REFUSED')
+
+    @override_settings(STREAM_RESTART_MAX_ATTEMPTS=2)
+    async def test_gives_up_after_max_attempts(self):
+        stream = self.watched_stream('TIMEOUT')
+        stream.restart_attempts = 2
+
+        await stream._supervise_exit(watched=True)
+
+        self.assertFalse(stream.is_restarting)
+        self.assertEqual(stream.viewer.messages[-1]['code'], 'TIMEOUT')
+
+    @override_settings(STREAM_RESTART_BACKOFF=0)
+    async def test_successful_restart_tells_viewers_it_is_playing(self):
+        stream = self.watched_stream('TIMEOUT')
+
+        with mock.patch.object(stream, 'start', mock.AsyncMock(return_value=True)):
+            await stream._supervise_exit(watched=True)
+            await stream._restart_task
+
+        self.assertEqual(stream.restarts, 1)
+        self.assertEqual(stream.viewer.messages[-1], {'type': 'status', 'phase': 'playing'})
+
+    @override_settings(STREAM_RESTART_BACKOFF=0)
+    async def test_failed_restart_is_retried(self):
+        stream = self.watched_stream('TIMEOUT')
+
+        with mock.patch.object(stream, 'start', mock.AsyncMock(return_value=False)):
+            await stream._supervise_exit(watched=True)
+            first = stream._restart_task
+            await first
+            retried = stream.is_restarting and stream._restart_task is not first
+            await self.cancel_restart(stream)
+
+        self.assertTrue(retried)
+        self.assertEqual(stream.restart_attempts, 2)
+
+class ReleaseStreamTests(IsolatedAsyncioTestCase):
+    async def managed_stream(self, manager):
+        return await manager.get_or_create_stream('cam', 'rtsp://10.0.0.5/cam')
+
+    async def test_idle_stream_is_released(self):
+        manager = StreamManager()
+        stream = await self.managed_stream(manager)
+
+        await manager.release_stream(stream)
+
+        self.assertEqual(manager.streams, {})
+
+    async def test_pinned_stream_is_kept(self):
+        manager = StreamManager()
+        stream = await self.managed_stream(manager)
+        stream.pinned = True
+
+        await manager.release_stream(stream)
+
+        self.assertIs(manager.streams[stream.key], stream)
+
+    async def test_restarting_stream_is_kept(self):
+        manager = StreamManager()
+        stream = await self.managed_stream(manager)
+        stream._restart_task = asyncio.create_task(asyncio.sleep(60))
+        self.addAsyncCleanup(self.cancel, stream._restart_task)
+
+        await manager.release_stream(stream)
+
+        self.assertIs(manager.streams[stream.key], stream)
+        # The next viewer finds the same stream and waits for its restart instead of starting another
+        self.assertIs(await self.managed_stream(manager), stream)
+
+    async def test_giving_up_without_viewers_releases_the_stream(self):
+        manager = StreamManager()
+        stream = await self.managed_stream(manager)
+        stream.ffmpeg_process = FakeProcess('AUTH')
+
+        await stream._supervise_exit(watched=False)
+
+        self.assertEqual(manager.streams, {})
+
+    async def cancel(self, task):
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,96 @@
+import os
+import tempfile
+import time
+from unittest import IsolatedAsyncioTestCase
+
+from streams.thumbnail_cache import ThumbnailCache, ENTRY_OVERHEAD
+
+def thumbnail(size: int, **fields):
+    return {'image': b'x' * size, 'generated_at': time.time(), **fields}
+
+class ThumbnailCacheTests(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    async def test_memory_bytes_include_entry_overhead(self):
+        cache = ThumbnailCache(max_bytes=10_000)
+        await cache.set('a', thumbnail(100))
+        await cache.set('a', thumbnail(300))  # replacing an entry doesn't double count it
+
+        self.assertEqual(cache.bytes, 300 + ENTRY_OVERHEAD)
+        self.assertEqual(len(cache), 1)
+
+    async def test_least_recently_used_is_evicted_first(self):
+        cache = ThumbnailCache(max_bytes=2 * (100 + ENTRY_OVERHEAD))
+        await cache.set('a', thumbnail(100))
+        await cache.set('b', thumbnail(100))
+        await cache.get('a')
+        await cache.set('c', thumbnail(100))
+
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+        self.assertEqual(cache.bytes, 2 * (100 + ENTRY_OVERHEAD))
+        self.assertEqual(cache.evictions, 1)
+
+    async def test_entry_larger_than_the_cache_is_still_kept(self):
+        cache = ThumbnailCache(max_bytes=100)
+        await cache.set('a', thumbnail(50))
+        await cache.set('b', thumbnail(500))
+
+        self.assertEqual(list(cache.entries), ['b'])
+
+    async def test_hits_and_misses(self):
+        cache = ThumbnailCache(max_bytes=10_000)
+        await cache.set('a', thumbnail(10))
+
+        self.assertIsNotNone(await cache.get('a'))
+        self.assertIsNone(await cache.get('b'))
+        stats = cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    async def test_evicted_entries_are_served_from_disk(self):
+        cache = ThumbnailCache(max_bytes=100 + ENTRY_OVERHEAD, disk_dir=self.tmp.name)
+        await cache.set('a', thumbnail(100, stream_id='1'))
+        await cache.set('b', thumbnail(100, stream_id='2'))
+
+        entry = await cache.get('a')
+
+        self.assertEqual(entry['image'], b'x' * 100)
+        self.assertEqual(entry['stream_id'], '1')
+        self.assertEqual(cache.disk_hits, 1)
+        self.assertEqual(cache.disk_bytes, 200)
+
+    async def test_disk_tier_drops_the_oldest_entries(self):
+        cache = ThumbnailCache(max_bytes=10_000, disk_dir=self.tmp.name, disk_max_bytes=250)
+        for key in 'abc':
+            await cache.set(key, thumbnail(100))
+
+        self.assertEqual(list(cache.disk_index), ['b', 'c'])
+        self.assertEqual(cache.disk_bytes, 200)
+        self.assertEqual(len(os.listdir(self.tmp.name)), 4)  # a .jpg and a .json each
+
+    async def test_warm_loads_the_disk_tier_and_drops_expired_entries(self):
+        cache = ThumbnailCache(max_bytes=10_000, disk_dir=self.tmp.name)
+        await cache.set('fresh', thumbnail(100))
+        await cache.set('expired', thumbnail(100, generated_at=time.time() - 3600))
+
+        warmed = ThumbnailCache(max_bytes=10_000, disk_dir=self.tmp.name)
+        await warmed.warm(max_age=60, age=lambda entry: time.time() - entry['generated_at'])
+
+        self.assertEqual(list(warmed.entries), ['fresh'])
+        self.assertEqual(warmed.bytes, 100 + ENTRY_OVERHEAD)
+        self.assertEqual(warmed.disk_bytes, 100)
+        self.assertEqual(len(os.listdir(self.tmp.name)), 2)
+
+    async def test_delete_and_clear_remove_files(self):
+        cache = ThumbnailCache(max_bytes=10_000, disk_dir=self.tmp.name)
+        await cache.set('a', thumbnail(100))
+        await cache.set('b', thumbnail(100))
+
+        await cache.delete('a')
+        self.assertNotIn('a', cache)
+        self.assertEqual((cache.bytes, cache.disk_bytes), (100 + ENTRY_OVERHEAD, 100))
+
+        await cache.clear()
+        self.assertEqual((cache.bytes, cache.disk_bytes, len(cache)), (0, 0, 0))
+        self.assertEqual(os.listdir(self.tmp.name), [])
@@ -0,0 +1,71 @@
+from django.test import SimpleTestCase
+
+from streams.ffmpeg_helper import TSDemuxer, TSBatch, TS_PACKET_SIZE, TS_SYNC_BYTE, TS_FLAG_PAYLOAD_START, TS_FLAG_RANDOM_ACCESS
+
+def ts_packet(pid: int, fill: int = 0, start: bool = False) -> bytes:
+    header = bytes([TS_SYNC_BYTE, (0x40 if start else 0) | (pid >> 8), pid & 0xFF, 0x10])
+    return header + bytes([fill]) * (TS_PACKET_SIZE - 4)
+
+def joined(batches) -> bytes:
+    return b''.join(bytes(batch.data) for batch in batches)
+
+class TSDemuxerTests(SimpleTestCase):
+    def test_aligned_chunk_is_one_batch_without_copying(self):
+        chunk = ts_packet(0x100) * 3
+        batches = TSDemuxer().feed(chunk)
+
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(len(batches[0]), 3)
+        self.assertIs(batches[0].data.obj, chunk)
+
+    def test_packet_straddling_two_reads_is_reassembled(self):
+        stream = ts_packet(0x100, 1) + ts_packet(0x101, 2) + ts_packet(0x102, 3)
+        demuxer = TSDemuxer()
+
+        first = demuxer.feed(stream[:250])
+        second = demuxer.feed(stream[250:])
+
+        self.assertEqual(joined(first), stream[:TS_PACKET_SIZE])
+        self.assertEqual([list(batch.pids) for batch in second], [[0x101], [0x102]])
+        self.assertEqual(joined(first + second), stream)
+        self.assertEqual(demuxer.resyncs, 0)
+
+    def test_reads_shorter_than_the_carry_accumulate(self):
+        packet = ts_packet(0x100)
+        demuxer = TSDemuxer()
+
+        batches = [batch for offset in range(0, TS_PACKET_SIZE, 50)
+                   for batch in demuxer.feed(packet[offset:offset + 50])]
+
+        self.assertEqual(joined(batches), packet)
+
+    def test_garbage_is_skipped_by_resyncing(self):
+        # The junk holds a lone sync byte that isn't followed by another one a packet later
+        garbage = b'\x00\x47\x00\x00\x00'
+        stream = ts_packet(0x100) + ts_packet(0x101)
+        demuxer = TSDemuxer()
+
+        batches = demuxer.feed(garbage + stream)
+
+        self.assertEqual(joined(batches), stream)
+        self.assertEqual(demuxer.resyncs, 1)
+
+    def test_corrupt_straddling_packet_is_dropped(self):
+        demuxer = TSDemuxer()
+        demuxer.feed(ts_packet(0x100) + b'\x00' * 100)  # carries a tail that doesn't start with a sync byte
+        batches = demuxer.feed(b'\x00' * 88 + ts_packet(0x101))
+
+        self.assertEqual(joined(batches), ts_packet(0x101))
+        self.assertEqual(demuxer.resyncs, 0)
+
+    def test_batch_metadata(self):
+        keyframe = bytearray(ts_packet(0x100, start=True))
+        keyframe[3] = 0x30  # adaptation field and payload
+        keyframe[4:6] = bytes([1, 0x40])  # random access indicator
+        batch = TSBatch(memoryview(bytes(keyframe) + ts_packet(0x100) + ts_packet(0, start=True)))
+
+        self.assertEqual(list(batch.pids), [0x100, 0x100, 0])
+        self.assertEqual(batch.payload_starts, [0, 2])
+        self.assertEqual(batch.flags[0], TS_FLAG_PAYLOAD_START | TS_FLAG_RANDOM_ACCESS)
+        self.assertEqual(batch.flags[1], 0)
+        self.assertEqual(bytes(batch.payload(0)), bytes(keyframe[6:]))
@@ -0,0 +1,68 @@
+import time
+from unittest import mock
+
+from django.test import TestCase
+
+from streams.models import Stream
+from streams.thumbnail_service import thumbnail_service
+
+def thumbnail(stream_id, etag='abc123'):
+    return {'image': b'\xff\xd8jpeg', 'etag': etag, 'generated_at': time.time(), 'stream_id': stream_id}
+
+class ThumbnailViewTests(TestCase):
+    def setUp(self):
+        self.stream = Stream.objects.create(label='Door', url='rtsp://camera.local/door')
+        self.stream_id = str(self.stream.id)
+
+    async def test_batch_returns_image_urls_versioned_by_etag(self):
+        async def iter_thumbnails(streams, **kwargs):
+            for stream_id, _ in streams:
+                yield stream_id, thumbnail(stream_id)
+
+        with mock.patch.object(thumbnail_service, 'iter_thumbnails', iter_thumbnails):
+            response = await self.async_client.get('/api/thumbnails/', {'image': 'url'})
+
+        item = response.json()['results'][0]
+        self.assertEqual(item['image_url'], f'/api/streams/{self.stream_id}/thumbnail/image/?v=abc123')
+        self.assertEqual(item['etag'], 'abc123')
+        self.assertNotIn('thumbnail', item)
+
+    async def test_batch_rejects_unknown_image_mode(self):
+        response = await self.async_client.get('/api/thumbnails/', {'image': 'inline'})
+
+        self.assertEqual(response.status_code, 400)
+
+    async def test_image_endpoint_matches_weak_etags(self):
+        get_thumbnail = mock.AsyncMock(return_value=thumbnail(self.stream_id))
+
+        with mock.patch.object(thumbnail_service, 'get_thumbnail', get_thumbnail):
+            response = await self.async_client.get(
+                f'/api/streams/{self.stream_id}/thumbnail/image/', headers={'If-None-Match': 'W/"abc123"'})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], '"abc123"')
+
+class StreamStatsViewTests(TestCase):
+    async def test_slots_are_read_on_the_event_loop(self):
+        response = await self.async_client.get('/api/streams/slots/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('available_slots', response.json())
+
+    async def test_slots_reject_other_methods(self):
+        response = await self.async_client.post('/api/streams/slots/')
+
+        self.assertEqual(response.status_code, 405)
+
+    async def test_ranking_rejects_limits_below_one(self):
+        for limit in ('0', '-3', 'ten'):
+            with self.subTest(limit=limit):
+                response = await self.async_client.get('/api/streams/stats/', {'limit': limit})
+
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'limit must be a positive integer'})
+
+    async def test_ranking_accepts_a_positive_limit(self):
+        response = await self.async_client.get('/api/streams/stats/', {'limit': '1'})
+
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,250 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import tempfile
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Rough per-entry cost of the metadata dict, on top of the JPEG itself
+ENTRY_OVERHEAD = 512
+
+class ThumbnailCache:
+    """LRU thumbnail cache bounded by bytes, with an optional on-disk tier.
+
+    Entries are the thumbnail dicts built by ThumbnailService, holding the JPEG
+    in 'image'. The memory tier evicts least recently used entries once
+    max_bytes is exceeded. With a disk_dir every entry is also written there as
+    a .jpg plus a .json with its metadata, so thumbnails survive restarts:
+    warm() loads the newest ones back into memory at startup, and memory misses
+    fall through to disk. The disk tier is bounded by disk_max_bytes, oldest
+    entries first. Every file operation runs in a worker thread, which is why
+    the methods that may touch the disk are coroutines.
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: Optional[str] = None, disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.disk_dir = str(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self.entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self.bytes = 0
+        self.disk_index: Dict[str, int] = {}  # key -> bytes on disk, oldest first
+        self.disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        entry = await self._read(key) if key in self.disk_index else None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        self._insert(key, entry)
+        return entry
+
+    async def set(self, key: str, entry: Dict[str, Any]):
+        self._insert(key, entry)
+        if self.disk_dir:
+            await self._write(key, entry)
+
+    async def delete(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= self._size(entry)
+        if key in self.disk_index:
+            await self._remove_files([key])
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries or key in self.disk_index
+
+    def __len__(self) -> int:
+        return len(self.entries.keys() | self.disk_index.keys())
+
+    def keys(self) -> Iterator[str]:
+        return iter(list(self.entries.keys() | self.disk_index.keys()))
+
+    def values(self) -> Iterator[Dict[str, Any]]:
+        """Entries held in memory"""
+        return iter(list(self.entries.values()))
+
+    async def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+        await self._remove_files(list(self.disk_index))
+
+    async def warm(self, max_age: Optional[float] = None, age=None):
+        """Index the disk tier and load its newest entries into memory.
+
+        Entries for which age(entry) exceeds max_age are deleted instead. The
+        directory is read in a worker thread, so a large disk tier doesn't hold
+        up the event loop, and entries cached meanwhile are kept.
+        """
+        if not self.disk_dir:
+            return
+        found = await asyncio.to_thread(self._scan)  # (mtime, key, metadata, JPEG size), newest first
+        expired = [key for _, key, meta, _ in found
+                   if max_age is not None and age and (age(meta) is None or age(meta) > max_age)]
+        kept = [(key, size) for _, key, _, size in found if key not in expired]
+        for key, size in reversed(kept):
+            if key not in self.disk_index:
+                self.disk_index[key] = size
+                self.disk_bytes += size
+        # Newest first, as many as fit next to what is already in memory
+        budget = self.max_bytes - self.bytes
+        wanted = []
+        for key, size in kept:
+            if key not in self.entries and size + ENTRY_OVERHEAD <= budget:
+                wanted.append(key)
+                budget -= size + ENTRY_OVERHEAD
+        loaded = await asyncio.to_thread(lambda: [(key, self._read_files(key)) for key in wanted])
+        for key, entry in reversed(loaded):
+            if entry is not None and key not in self.entries and key in self.disk_index:
+                self.entries[key] = entry
+                self.entries.move_to_end(key, last=False)  # older ones are less recently used
+                self.bytes += self._size(entry)
+        if expired:
+            await asyncio.to_thread(self._unlink_files, expired)
+        await self._trim_disk()
+        logger.info(f"Warmed thumbnail cache from {self.disk_dir}: "
+                    f"{sum(1 for _, entry in loaded if entry)} in memory, {len(self.disk_index)} on disk")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'memory_entries': len(self.entries),
+            'memory_bytes': self.bytes,
+            'memory_max_bytes': self.max_bytes,
+            'disk_entries': len(self.disk_index),
+            'disk_bytes': self.disk_bytes,
+            'disk_max_bytes': self.disk_max_bytes if self.disk_dir else 0,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _size(self, entry: Dict[str, Any]) -> int:
+        return len(entry.get('image') or b'') + ENTRY_OVERHEAD
+
+    def _insert(self, key: str, entry: Dict[str, Any]):
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= self._size(previous)
+        self.entries[key] = entry
+        self.bytes += self._size(entry)
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= self._size(evicted)
+            self.evictions += 1
+
+    def _path(self, key: str) -> str:
+        # Keys carry stream ids and URL hashes; keep file names uniform
+        return os.path.join(self.disk_dir, hashlib.sha256(key.encode('utf-8')).hexdigest()[:32])
+
+    # Index bookkeeping happens on the event loop; file I/O goes to worker threads
+
+    async def _write(self, key: str, entry: Dict[str, Any]):
+        meta = {name: value for name, value in entry.items() if name != 'image'}
+        meta['key'] = key
+        try:
+            await asyncio.to_thread(self._write_files, key, entry['image'], json.dumps(meta).encode('utf-8'))
+        except OSError as e:
+            logger.warning(f"Could not write thumbnail to disk cache: {e}")
+            return
+        self.disk_bytes -= self.disk_index.pop(key, 0)
+        self.disk_index[key] = len(entry['image'])
+        self.disk_bytes += len(entry['image'])
+        await self._trim_disk()
+
+    async def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = await asyncio.to_thread(self._read_files, key)
+        if entry is None:
+            await self._remove_files([key])
+            return None
+        if not self.disk_index.get(key):
+            self.disk_bytes -= self.disk_index.pop(key, 0)
+            self.disk_bytes += len(entry['image'])
+            self.disk_index[key] = len(entry['image'])
+        return entry
+
+    async def _trim_disk(self):
+        removed = []
+        while self.disk_max_bytes and self.disk_bytes > self.disk_max_bytes and self.disk_index:
+            key = next(iter(self.disk_index))
+            self.disk_bytes -= self.disk_index.pop(key)
+            removed.append(key)
+        if removed:
+            await asyncio.to_thread(self._unlink_files, removed)
+
+    async def _remove_files(self, keys: List[str]):
+        for key in keys:
+            self.disk_bytes -= self.disk_index.pop(key, 0)
+        if keys:
+            await asyncio.to_thread(self._unlink_files, keys)
+
+    # Worker-thread side: plain file operations, no shared state
+
+    def _scan(self) -> List[Tuple[float, str, Dict[str, Any], int]]:
+        found = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                found.append((os.path.getmtime(path), meta['key'], meta, os.path.getsize(path[:-len('.json')] + '.jpg')))
+            except (OSError, ValueError, KeyError):
+                self._unlink(path)
+                self._unlink(path[:-len('.json')] + '.jpg')
+        return sorted(found, key=lambda item: item[0], reverse=True)
+
+    def _write_files(self, key: str, image: bytes, meta: bytes):
+        path = self._path(key)
+        self._atomic_write(path + '.jpg', image)
+        self._atomic_write(path + '.json', meta)
+
+    def _atomic_write(self, path: str, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            self._unlink(tmp_path)
+            raise
+
+    def _read_files(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with open(path + '.json', 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            with open(path + '.jpg', 'rb') as f:
+                entry['image'] = f.read()
+        except (OSError, ValueError):
+            return None
+        entry.pop('key', None)
+        return entry
+
+    def _unlink_files(self, keys: List[str]):
+        for key in keys:
+            path = self._path(key)
+            self._unlink(path + '.json')
+            self._unlink(path + '.jpg')
+
+    def _unlink(self, path: str):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
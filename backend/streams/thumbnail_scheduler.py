@@ -0,0 +1,143 @@
+import time
+import random
+import asyncio
+import logging
+from typing import Optional, Dict, Any
+
+from django.conf import settings
+
+from .models import Stream
+from .thumbnail_service import thumbnail_service
+
+logger = logging.getLogger(__name__)
+
+class ThumbnailScheduler:
+    """Refreshes the thumbnails of all active streams in the background.
+
+    Every stream is refreshed once per interval, so visitors find a fresh
+    thumbnail instead of waiting for a capture. New streams get a random slot
+    in the interval and every run is jittered, which spreads the captures out
+    instead of firing them all at once. Streams whose capture fails are retried
+    with exponential backoff, up to max_backoff seconds apart.
+    """
+
+    def __init__(self):
+        self.interval = settings.THUMBNAIL_REFRESH_INTERVAL  # None turns the scheduler off
+        self.max_concurrent = settings.THUMBNAIL_REFRESH_MAX_CONCURRENT
+        self.jitter = settings.THUMBNAIL_REFRESH_JITTER  # fraction of the interval
+        self.max_backoff = settings.THUMBNAIL_REFRESH_MAX_BACKOFF
+        self.reload_interval = 30  # seconds between reloads of the stream list
+        self.streams: Dict[str, str] = {}  # stream id -> RTSP URL
+        self.next_run: Dict[str, float] = {}
+        self.failures: Dict[str, int] = {}
+        self.refreshed = 0
+        self.skipped = 0
+        self.failed = 0
+        self._task: Optional[asyncio.Task] = None
+        self._jobs = set()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.interval)
+
+    def start(self):
+        """Start on the running event loop, unless disabled or already running"""
+        if not self.enabled or (self._task and not self._task.done()):
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Thumbnail scheduler started: every stream each {self.interval}s, "
+                    f"at most {self.max_concurrent} at a time")
+
+    async def stop(self):
+        tasks = list(self._jobs)
+        if self._task:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self):
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+        loaded_at = 0
+        while True:
+            now = time.time()
+            if now - loaded_at >= self.reload_interval:
+                await self._load_streams()
+                loaded_at = now
+
+            running = {job.stream_id for job in self._jobs}
+            for stream_id, rtsp_url in self.streams.items():
+                if self.next_run[stream_id] <= now and stream_id not in running:
+                    # Schedule the next run now so a slow capture doesn't get queued twice
+                    self.next_run[stream_id] = now + self._delay(stream_id)
+                    job = asyncio.create_task(self._refresh(semaphore, stream_id, rtsp_url))
+                    job.stream_id = stream_id
+                    self._jobs.add(job)
+                    job.add_done_callback(self._jobs.discard)
+            await asyncio.sleep(1)
+
+    async def _load_streams(self):
+        try:
+            streams = {str(stream.id): stream.url
+                       async for stream in Stream.objects.filter(is_active=True).only('id', 'url')}
+        except Exception as e:
+            logger.error(f"Thumbnail scheduler could not load streams: {e}")
+            return
+        now = time.time()
+        for stream_id in streams.keys() - self.streams.keys():
+            # Spread new streams over the interval rather than refreshing them together
+            self.next_run[stream_id] = now + random.uniform(0, self.interval)
+        for stream_id in self.streams.keys() - streams.keys():
+            self.next_run.pop(stream_id, None)
+            self.failures.pop(stream_id, None)
+        self.streams = streams
+
+    def _delay(self, stream_id: str) -> float:
+        """Seconds until the next refresh, backed off exponentially after failures"""
+        delay = min(self.interval * 2 ** self.failures.get(stream_id, 0), max(self.interval, self.max_backoff))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def _refresh(self, semaphore: asyncio.Semaphore, stream_id: str, rtsp_url: str):
+        async with semaphore:
+            cached = await thumbnail_service.get_cached_thumbnail(stream_id, rtsp_url)
+            if cached and thumbnail_service.max_age(cached) > self.interval:
+                # Captured on request since the last run and still fresh at the next one
+                self.skipped += 1
+                return
+            try:
+                thumbnail_data = await thumbnail_service.get_thumbnail(stream_id, rtsp_url, force_refresh=True)
+            except Exception as e:
+                logger.error(f"Error refreshing thumbnail for stream {stream_id}: {e}")
+                thumbnail_data = None
+
+        if thumbnail_data:
+            self.refreshed += 1
+            self.failures.pop(stream_id, None)
+            return
+        self.failed += 1
+        self.failures[stream_id] = self.failures.get(stream_id, 0) + 1
+        delay = self._delay(stream_id)
+        if stream_id in self.next_run:
+            self.next_run[stream_id] = time.time() + delay
+        logger.warning(f"Thumbnail refresh failed for stream {stream_id} "
+                       f"({self.failures[stream_id]} in a row), next try in {delay:.0f}s")
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            'enabled': self.enabled,
+            'running': bool(self._task and not self._task.done()),
+            'interval': self.interval,
+            'max_concurrent': self.max_concurrent,
+            'streams': len(self.streams),
+            'in_flight': len(self._jobs),
+            'refreshed': self.refreshed,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'backing_off': {stream_id: {'failures': count, 'next_try_in': max(0, round(self.next_run.get(stream_id, now) - now))}
+                            for stream_id, count in self.failures.items()},
+        }
+
+# Global thumbnail scheduler instance
+thumbnail_scheduler = ThumbnailScheduler()
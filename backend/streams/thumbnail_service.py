@@ -1,148 +1,325 @@
 import asyncio
 import base64
+import hashlib
 import logging
-import os
-import tempfile
 import time
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
-import subprocess
+import weakref
+from datetime import datetime
+from typing import Optional, Dict, Any, AsyncIterator, Iterable, Tuple
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+from .consumers import stream_manager
+from .ffmpeg_helper import normalize_rtsp_url
+from .metrics import Histogram
+from .thumbnail_cache import ThumbnailCache
 
 logger = logging.getLogger(__name__)
 
+class _LoopState:
+    """asyncio primitives are bound to one event loop, so each loop gets its own"""
+
+    def __init__(self, max_concurrent: int):
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.inflight: Dict[str, asyncio.Task] = {}  # cache key -> generation task
+        self.background = set()  # stale-while-revalidate refreshes nobody awaits
+
 class ThumbnailService:
     def __init__(self):
-        self.thumbnail_cache: Dict[str, Dict[str, Any]] = {}
-        self.cache_ttl = 300  # 5 minutes
+        self.cache_ttl = settings.THUMBNAIL_CACHE_TTL
+        self.max_stale = settings.THUMBNAIL_MAX_STALE  # stale thumbnails older than this are regenerated inline
+        self.thumbnail_cache = ThumbnailCache(
+            max_bytes=settings.THUMBNAIL_CACHE_MAX_BYTES,
+            disk_dir=settings.THUMBNAIL_DISK_CACHE_DIR,
+            disk_max_bytes=settings.THUMBNAIL_DISK_CACHE_MAX_BYTES,
+        )
+        self.stale_while_revalidate = settings.THUMBNAIL_STALE_WHILE_REVALIDATE
+        self.max_concurrent = settings.THUMBNAIL_MAX_CONCURRENT  # FFmpeg processes per event loop
         self.thumbnail_quality = 85
         self.thumbnail_width = 320
         self.thumbnail_height = 240
         self.ffmpeg_timeout = 10  # seconds
+        self.live_interval = settings.THUMBNAIL_LIVE_INTERVAL  # seconds between stills from running ingests
+        self._loop_states = weakref.WeakKeyDictionary()  # event loop -> _LoopState
+        self.generated = 0
+        self.failed = 0
+        # Seconds to produce a thumbnail, by where it came from
+        self.generation_latency = {'live': Histogram(), 'rtsp': Histogram()}
+        self.deduplicated = 0
+        self.served_stale = 0
+        self.from_live = 0
+        self._warm_task = None
+    
+    def start(self):
+        """Load the disk cache tier in the background, once"""
+        if self._warm_task is None and self.thumbnail_cache.disk_dir:
+            # Thumbnails from before a restart are served (stale) instead of capturing every camera again
+            self._warm_task = asyncio.create_task(self.thumbnail_cache.warm(max_age=self.max_stale, age=self._age))
+    
+    async def stop(self):
+        if self._warm_task and not self._warm_task.done():
+            self._warm_task.cancel()
+            await asyncio.gather(self._warm_task, return_exceptions=True)
         
-    def get_thumbnail(self, stream_id: str, rtsp_url: str, force_refresh: bool = False) -> Optional[Dict[str, Any]]:
-        """Get thumbnail for a stream, either from cache or generate new one"""
+    async def get_thumbnail(self, stream_id: str, rtsp_url: str, force_refresh: bool = False,
+                            stale_while_revalidate: Optional[bool] = None) -> Optional[Dict[str, Any]]:
+        """Get thumbnail for a stream, either from cache or generate new one.
+
+        Concurrent requests for the same stream share one FFmpeg run. With
+        stale_while_revalidate an expired thumbnail is returned immediately while
+        a fresh one is generated in the background.
+        """
         cache_key = f"{stream_id}_{self._hash_url(rtsp_url)}"
+        if stale_while_revalidate is None:
+            stale_while_revalidate = self.stale_while_revalidate
         
         # Check cache first
-        if not force_refresh and cache_key in self.thumbnail_cache:
-            cached = self.thumbnail_cache[cache_key]
-            if self._is_cache_valid(cached):
+        cached = None if force_refresh else await self.thumbnail_cache.get(cache_key)
+        if cached:
+            age = self._age(cached)
+            if age is not None and age < self.cache_ttl:
                 logger.info(f"Returning cached thumbnail for stream {stream_id}")
                 return cached
+            if stale_while_revalidate and age is not None and age < self.max_stale:
+                logger.info(f"Returning stale thumbnail for stream {stream_id} ({age:.0f}s old), refreshing in background")
+                self.served_stale += 1
+                task = self._generation_task(cache_key, stream_id, rtsp_url)
+                self._loop_state().background.add(task)
+                task.add_done_callback(self._loop_state().background.discard)
+                return {**cached, 'stale': True}
+            if age is None or age >= self.max_stale:
+                # Too old to ever be served again; don't keep it around if the capture fails
+                await self.thumbnail_cache.delete(cache_key)
+        
+        # Generate new thumbnail, or wait for the generation already running
+        return await asyncio.shield(self._generation_task(cache_key, stream_id, rtsp_url))
+    
+    async def get_cached_thumbnail(self, stream_id: str, rtsp_url: str) -> Optional[Dict[str, Any]]:
+        """The cached thumbnail for a stream, without capturing one; None if there is none"""
+        cached = await self.thumbnail_cache.get(f"{stream_id}_{self._hash_url(rtsp_url)}")
+        if not cached:
+            return None
+        age = self._age(cached)
+        if age is not None and age < self.cache_ttl:
+            return cached
+        if age is not None and age < self.max_stale:
+            return {**cached, 'stale': True}
+        return None
+    
+    async def iter_thumbnails(self, streams: Iterable[Tuple[str, str]], fill: bool = True,
+                              stale_while_revalidate: Optional[bool] = None
+                              ) -> AsyncIterator[Tuple[str, Optional[Dict[str, Any]]]]:
+        """Yield (stream_id, thumbnail or None) for (stream_id, rtsp_url) pairs as each is ready.
+        
+        Cached thumbnails come first; misses are captured in parallel, bounded by
+        max_concurrent like any other capture. With fill=False misses are not
+        captured at all.
+        """
+        if not fill:
+            for stream_id, rtsp_url in streams:
+                yield stream_id, await self.get_cached_thumbnail(stream_id, rtsp_url)
+            return
         
-        # Generate new thumbnail
-        logger.info(f"Generating thumbnail for stream {stream_id}")
-        thumbnail_data = self._generate_thumbnail(rtsp_url)
+        async def fetch(stream_id: str, rtsp_url: str):
+            try:
+                return stream_id, await self.get_thumbnail(stream_id, rtsp_url,
+                                                           stale_while_revalidate=stale_while_revalidate)
+            except Exception as e:
+                logger.error(f"Error getting thumbnail for stream {stream_id}: {e}")
+                return stream_id, None
         
-        if thumbnail_data:
+        tasks = [asyncio.create_task(fetch(stream_id, rtsp_url)) for stream_id, rtsp_url in streams]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # The client went away; captures already running still finish and get cached
+            for task in tasks:
+                task.cancel()
+    
+    def _loop_state(self) -> _LoopState:
+        loop = asyncio.get_running_loop()
+        state = self._loop_states.get(loop)
+        if state is None:
+            state = self._loop_states[loop] = _LoopState(self.max_concurrent)
+        return state
+    
+    def _generation_task(self, cache_key: str, stream_id: str, rtsp_url: str) -> asyncio.Task:
+        """Single-flight: one generation task per cache key"""
+        state = self._loop_state()
+        task = state.inflight.get(cache_key)
+        if task is not None:
+            self.deduplicated += 1
+            logger.debug(f"Joining in-flight thumbnail generation for stream {stream_id}")
+            return task
+        task = asyncio.create_task(self._generate_and_cache(cache_key, stream_id, rtsp_url))
+        state.inflight[cache_key] = task
+        task.add_done_callback(lambda _: state.inflight.pop(cache_key, None))
+        return task
+    
+    async def _generate_and_cache(self, cache_key: str, stream_id: str, rtsp_url: str) -> Optional[Dict[str, Any]]:
+        started = time.monotonic()
+        image_data = await self._live_snapshot(rtsp_url)
+        if image_data:
+            logger.info(f"Using live ingest still as thumbnail for stream {stream_id}")
+            self.from_live += 1
+            source = 'live'
+        else:
+            # Nobody is watching; open an RTSP session just for the thumbnail
+            async with self._loop_state().semaphore:
+                logger.info(f"Generating thumbnail for stream {stream_id}")
+                started = time.monotonic()  # not counting the wait for a capture slot
+                image_data = await self._generate_thumbnail(rtsp_url)
+            source = 'rtsp'
+        self.generation_latency[source].observe(time.monotonic() - started)
+        
+        if image_data:
+            # Raw JPEG bytes; the JSON endpoint builds its data URL on demand
             thumbnail_info = {
-                'thumbnail': thumbnail_data,
+                'image': image_data,
+                'etag': hashlib.blake2b(image_data, digest_size=16).hexdigest(),
                 'timestamp': datetime.utcnow().isoformat(),
                 'size': {'width': self.thumbnail_width, 'height': self.thumbnail_height},
                 'format': 'jpeg',
                 'quality': self.thumbnail_quality,
-                'stream_id': stream_id
+                'stream_id': stream_id,
+                'source': source
             }
             
             # Cache the thumbnail
-            self.thumbnail_cache[cache_key] = thumbnail_info
+            await self.thumbnail_cache.set(cache_key, thumbnail_info)
+            self.generated += 1
             logger.info(f"Thumbnail generated and cached for stream {stream_id}")
             return thumbnail_info
         else:
+            self.failed += 1
             logger.error(f"Failed to generate thumbnail for stream {stream_id}")
             return None
     
-    def _generate_thumbnail(self, rtsp_url: str) -> Optional[str]:
-        """Generate thumbnail from RTSP stream using FFmpeg"""
+    async def _generate_thumbnail(self, rtsp_url: str) -> Optional[bytes]:
+        """Generate thumbnail from RTSP stream using FFmpeg, without blocking the event loop"""
+        process = None
         try:
-            # Create temporary file for thumbnail
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-                temp_path = temp_file.name
-            
-            # FFmpeg command to capture single frame
+            # FFmpeg command to capture single frame, written to stdout
             cmd = [
                 'ffmpeg',
+                '-nostdin',
+                '-loglevel', 'error',
                 '-rtsp_transport', 'tcp',
+                settings.FFMPEG_RTSP_TIMEOUT_OPTION, str(int(self.ffmpeg_timeout * 1000000)),  # socket timeout in microseconds
                 '-i', rtsp_url,
                 '-vframes', '1',
                 '-vf', f'scale={self.thumbnail_width}:{self.thumbnail_height}',
                 '-q:v', '2',  # High quality
-                '-f', 'image2',
-                '-y',  # Overwrite output file
-                temp_path
+                '-f', 'image2pipe',
+                '-c:v', 'mjpeg',
+                'pipe:1'
             ]
             
-            logger.debug(f"Running FFmpeg command: {' '.join(cmd)}")
+            logger.debug(f"Running FFmpeg thumbnail capture for {self._mask_url(rtsp_url)}")
             
-            # Run FFmpeg with timeout using subprocess
-            process = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=self.ffmpeg_timeout
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
             )
+            image_data, stderr = await asyncio.wait_for(process.communicate(), timeout=self.ffmpeg_timeout)
             
-            if process.returncode == 0 and os.path.exists(temp_path):
-                # Read the generated thumbnail
-                with open(temp_path, 'rb') as f:
-                    image_data = f.read()
-                
-                # Convert to base64
-                base64_data = base64.b64encode(image_data).decode('utf-8')
-                data_url = f"data:image/jpeg;base64,{base64_data}"
-                
+            if process.returncode == 0 and image_data:
                 logger.debug(f"Thumbnail generated successfully, size: {len(image_data)} bytes")
-                return data_url
+                return image_data
             else:
                 logger.error(f"FFmpeg failed with return code {process.returncode}")
-                if process.stderr:
-                    logger.error(f"FFmpeg stderr: {process.stderr}")
+                if stderr:
+                    logger.error(f"FFmpeg stderr: {stderr.decode('utf-8', errors='replace')}")
                 return None
                 
-        except subprocess.TimeoutExpired:
+        except asyncio.TimeoutError:
             logger.error(f"FFmpeg thumbnail generation timed out after {self.ffmpeg_timeout} seconds")
             return None
         except Exception as e:
             logger.error(f"Error generating thumbnail: {e}")
             return None
         finally:
-            # Clean up temporary file
-            try:
-                if os.path.exists(temp_path):
-                    os.unlink(temp_path)
-            except Exception as e:
-                logger.warning(f"Failed to clean up temporary file {temp_path}: {e}")
+            # Never leave a capture running, including when the task was cancelled
+            if process and process.returncode is None:
+                process.kill()
+                await process.wait()
+    
+    async def _live_snapshot(self, rtsp_url: str) -> Optional[bytes]:
+        """Latest still from the camera's running ingest, if it has one"""
+        if not self.live_interval:
+            return None
+        stream_info = stream_manager.streams.get(normalize_rtsp_url(rtsp_url))
+        if not stream_info or not stream_info.is_playing:
+            return None
+        # An ingest that just started emits its first still within one interval
+        deadline = time.time() + self.live_interval * 2
+        while stream_info.is_playing:
+            snapshot = stream_info.get_snapshot()
+            if snapshot and time.time() - snapshot[1] <= self.live_interval * 3:
+                return snapshot[0]
+            if time.time() >= deadline:
+                break
+            await asyncio.sleep(0.2)
+        return None
+    
+    def to_json(self, thumbnail_info: Dict[str, Any]) -> Dict[str, Any]:
+        """The legacy JSON form of a thumbnail, with the JPEG as a base64 data URL"""
+        data = {key: value for key, value in thumbnail_info.items() if key != 'image'}
+        base64_data = base64.b64encode(thumbnail_info['image']).decode('utf-8')
+        data['thumbnail'] = f"data:image/jpeg;base64,{base64_data}"
+        return data
+    
+    def max_age(self, thumbnail_info: Dict[str, Any]) -> int:
+        """Seconds a client may reuse this thumbnail before revalidating"""
+        age = self._age(thumbnail_info)
+        if age is None or thumbnail_info.get('stale'):
+            return 0
+        return max(0, int(self.cache_ttl - age))
+    
+    def _mask_url(self, url: str) -> str:
+        parsed = urlparse(url)
+        if parsed.password:
+            return url.replace(f":{parsed.password}@", ":***@")
+        return url
     
     def _hash_url(self, url: str) -> str:
-        """Create a simple hash of the URL for cache key"""
-        return str(hash(url))
+        """Stable hash of the URL for the cache key, the same in every process and across restarts"""
+        return hashlib.sha256(normalize_rtsp_url(url).encode('utf-8')).hexdigest()[:16]
     
     def _is_cache_valid(self, cached_data: Dict[str, Any]) -> bool:
         """Check if cached thumbnail is still valid"""
+        age = self._age(cached_data)
+        return age is not None and age < self.cache_ttl
+    
+    def _age(self, cached_data: Dict[str, Any]) -> Optional[float]:
+        """Seconds since a cached thumbnail was generated"""
         try:
             timestamp_str = cached_data.get('timestamp')
             if not timestamp_str:
-                return False
+                return None
             
             timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
             age = datetime.utcnow() - timestamp.replace(tzinfo=None)
             
-            return age.total_seconds() < self.cache_ttl
+            return age.total_seconds()
         except Exception as e:
             logger.warning(f"Error checking cache validity: {e}")
-            return False
+            return None
     
-    def clear_cache(self, stream_id: Optional[str] = None):
+    async def clear_cache(self, stream_id: Optional[str] = None):
         """Clear thumbnail cache"""
         if stream_id:
             # Clear specific stream cache
             keys_to_remove = [k for k in self.thumbnail_cache.keys() if k.startswith(f"{stream_id}_")]
             for key in keys_to_remove:
-                del self.thumbnail_cache[key]
+                await self.thumbnail_cache.delete(key)
             logger.info(f"Cleared cache for stream {stream_id}")
         else:
             # Clear all cache
-            self.thumbnail_cache.clear()
+            await self.thumbnail_cache.clear()
             logger.info("Cleared all thumbnail cache")
     
     def get_cache_stats(self) -> Dict[str, Any]:
@@ -150,6 +327,17 @@ class ThumbnailService:
         return {
             'total_cached': len(self.thumbnail_cache),
             'cache_ttl': self.cache_ttl,
+            'max_stale': self.max_stale,
+            'stale_while_revalidate': self.stale_while_revalidate,
+            'max_concurrent': self.max_concurrent,
+            'in_flight': sum(len(state.inflight) for state in list(self._loop_states.values())),
+            'generated': self.generated,
+            'failed': self.failed,
+            'generation_latency': {source: histogram.get_stats() for source, histogram in self.generation_latency.items()},
+            'deduplicated': self.deduplicated,
+            'served_stale': self.served_stale,
+            'from_live': self.from_live,
+            'cache': self.thumbnail_cache.get_stats(),
             'cached_streams': list(set(item.get('stream_id') for item in self.thumbnail_cache.values()))
         }
 
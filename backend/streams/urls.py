@@ -1,9 +1,16 @@
 from django.urls import path
 from .views import (
-    StreamListCreateView, 
-    StreamDetailView, 
+    stream_list_create,
+    stream_detail,
+    bulk_create_streams,
     health_check,
+    live_stream_stats,
+    stream_resource_stats,
+    stream_resource_ranking,
+    stream_slots,
     stream_thumbnail,
+    stream_thumbnail_image,
+    stream_thumbnails,
     refresh_thumbnail,
     thumbnail_cache_stats,
     clear_thumbnail_cache
@@ -11,10 +18,17 @@ from .views import (
 
 urlpatterns = [
     path('health/', health_check, name='health_check'),
-    path('streams/', StreamListCreateView.as_view(), name='stream-list-create'),
-    path('streams/<uuid:id>/', StreamDetailView.as_view(), name='stream-detail'),
+    path('streams/', stream_list_create, name='stream-list-create'),
+    path('streams/bulk/', bulk_create_streams, name='stream-bulk-create'),
+    path('streams/live/', live_stream_stats, name='live-stream-stats'),
+    path('streams/slots/', stream_slots, name='stream-slots'),
+    path('streams/stats/', stream_resource_ranking, name='stream-resource-ranking'),
+    path('streams/<uuid:id>/', stream_detail, name='stream-detail'),
+    path('streams/<uuid:id>/stats/', stream_resource_stats, name='stream-resource-stats'),
     path('streams/<uuid:stream_id>/thumbnail/', stream_thumbnail, name='stream-thumbnail'),
+    path('streams/<uuid:stream_id>/thumbnail/image/', stream_thumbnail_image, name='stream-thumbnail-image'),
     path('streams/<uuid:stream_id>/thumbnail/refresh/', refresh_thumbnail, name='refresh-thumbnail'),
+    path('thumbnails/', stream_thumbnails, name='stream-thumbnails'),
     path('thumbnails/cache/stats/', thumbnail_cache_stats, name='thumbnail-cache-stats'),
     path('thumbnails/cache/clear/', clear_thumbnail_cache, name='clear-thumbnail-cache'),
 ]
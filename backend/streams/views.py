@@ -2,193 +2,508 @@ from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.generics import ListCreateAPIView, RetrieveDestroyAPIView
-from django.shortcuts import get_object_or_404
+from rest_framework.generics import ListAPIView, RetrieveDestroyAPIView
+from django.conf import settings
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.urls import reverse
+from django.utils.http import parse_etags, quote_etag, urlencode
+from asgiref.sync import sync_to_async
 from .models import Stream
 from .serializers import StreamSerializer, StreamCreateSerializer
 from .thumbnail_service import thumbnail_service
-import subprocess
+from .probe_service import probe_service
+from .ffmpeg_helper import normalize_rtsp_url
+from .thumbnail_scheduler import thumbnail_scheduler
+from .consumers import stream_manager
+from .prometheus import collect_metrics
+import json
+import uuid
 import re
 
-class BaseStreamView:
-    def _validate_rtsp_url(self, url):
-        """Basic validation of RTSP URL using ffprobe"""
-        try:
-            # Use ffprobe to check if the stream is accessible
-            cmd = [
-                'ffprobe', 
-                '-v', 'quiet',
-                '-print_format', 'json',
-                '-show_streams',
-                '-rtsp_transport', 'tcp',
-                url
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-            return result.returncode == 0
-        except (subprocess.TimeoutExpired, subprocess.SubprocessError, FileNotFoundError):
-            # If ffprobe is not available, just validate URL format
-            return url.startswith('rtsp://')
-
-class StreamListCreateView(BaseStreamView, ListCreateAPIView):
+class StreamListView(ListAPIView):
     queryset = Stream.objects.filter(is_active=True)
     serializer_class = StreamSerializer
 
-    def get_serializer_class(self):
-        if self.request.method == 'POST':
-            return StreamCreateSerializer
-        return StreamSerializer
-
-    def create(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data)
-        if serializer.is_valid():
-            # Validate RTSP URL with ffprobe
-            url = serializer.validated_data['url']
-            if not self._validate_rtsp_url(url):
-                return Response(
-                    {'error': 'Invalid RTSP URL or stream not accessible'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            stream = serializer.save()
-            response_serializer = StreamSerializer(stream)
-            return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-class StreamDetailView(BaseStreamView, RetrieveDestroyAPIView):
+class StreamDetailView(RetrieveDestroyAPIView):
     queryset = Stream.objects.filter(is_active=True)
     serializer_class = StreamSerializer
     lookup_field = 'id'
 
-    def get_serializer_class(self):
-        if self.request.method in ['PUT', 'PATCH']:
-            return StreamCreateSerializer
-        return StreamSerializer
-
-    def put(self, request, *args, **kwargs):
-        """Handle PUT requests for updating streams"""
-        serializer = self.get_serializer(self.get_object(), data=request.data, partial=False)
-        if serializer.is_valid():
-            # Validate RTSP URL with ffprobe
-            url = serializer.validated_data.get('url')
-            if url and not self._validate_rtsp_url(url):
-                return Response(
-                    {'error': 'Invalid RTSP URL or stream not accessible'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            stream = serializer.save()
-            response_serializer = StreamSerializer(stream)
-            return Response(response_serializer.data, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-    def patch(self, request, *args, **kwargs):
-        """Handle PATCH requests for partial updates"""
-        serializer = self.get_serializer(self.get_object(), data=request.data, partial=True)
-        if serializer.is_valid():
-            # Validate RTSP URL with ffprobe
-            url = serializer.validated_data.get('url')
-            if url and not self._validate_rtsp_url(url):
-                return Response(
-                    {'error': 'Invalid RTSP URL or stream not accessible'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            stream = serializer.save()
-            response_serializer = StreamSerializer(stream)
-            return Response(response_serializer.data, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
     def destroy(self, request, *args, **kwargs):
         stream = self.get_object()
         stream.is_active = False
         stream.save()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+_stream_list_view = StreamListView.as_view()
+_stream_detail_view = StreamDetailView.as_view()
+
+def _request_data(request):
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+
+async def stream_list_create(request):
+    """List streams, or create one.
+
+    Creating is a plain async view, so the ffprobe check of the URL is awaited
+    on the event loop instead of holding a request thread; the rest is DRF.
+    """
+    if request.method != 'POST':
+        return await sync_to_async(_stream_list_view)(request)
+    data = _request_data(request)
+    if not isinstance(data, dict):
+        return JsonResponse({'error': 'Request body must be a JSON object'}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = StreamCreateSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Validate RTSP URL with ffprobe
+    probe = await probe_service.probe(serializer.validated_data['url'])
+    if not probe['ok']:
+        return JsonResponse(
+            {'error': 'Invalid RTSP URL or stream not accessible'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    stream = await sync_to_async(serializer.save)(**probe_service.stream_fields(probe))
+    return JsonResponse(StreamSerializer(stream).data, status=status.HTTP_201_CREATED)
+
+async def stream_detail(request, id):
+    """Get, update or delete a stream; updates re-probe the URL only when it changed"""
+    if request.method not in ('PUT', 'PATCH'):
+        return await sync_to_async(_stream_detail_view)(request, id=id)
+    try:
+        stream = await Stream.objects.aget(id=id, is_active=True)
+    except Stream.DoesNotExist:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    data = _request_data(request)
+    if not isinstance(data, dict):
+        return JsonResponse({'error': 'Request body must be a JSON object'}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = StreamCreateSerializer(stream, data=data, partial=request.method == 'PATCH')
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    fields = {}
+    url = serializer.validated_data.get('url')
+    if url and url != stream.url:
+        # Validate RTSP URL with ffprobe
+        probe = await probe_service.probe(url)
+        if not probe['ok']:
+            return JsonResponse(
+                {'error': 'Invalid RTSP URL or stream not accessible'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        fields = probe_service.stream_fields(probe)
+    
+    stream = await sync_to_async(serializer.save)(**fields)
+    return JsonResponse(StreamSerializer(stream).data, status=status.HTTP_200_OK)
+
+def _bulk_items(request):
+    """Streams to import: a JSON list of URLs or {"url", "label"} objects, optionally
+    under "streams", or plain text with one URL per line (# starts a comment)"""
+    if request.content_type == 'text/plain':
+        lines = request.body.decode('utf-8', errors='replace').splitlines()
+        return [{'url': line.strip()} for line in lines if line.strip() and not line.strip().startswith('#')]
+    data = _request_data(request)
+    if isinstance(data, dict):
+        data = data.get('streams', data.get('urls'))
+    if not isinstance(data, list):
+        return None
+    return [item if isinstance(item, dict) else {'url': item} for item in data]
+
+async def bulk_create_streams(request):
+    """Import many streams at once.
+    
+    Every URL is validated and probed concurrently (at most
+    STREAM_BULK_PROBE_CONCURRENCY at a time), the ones that pass are inserted
+    with a single bulk_create, and the response reports the outcome per URL.
+    URLs already in the list of active streams, or repeated in the request,
+    are skipped.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    items = _bulk_items(request)
+    if items is None:
+        return JsonResponse(
+            {'error': 'Send a JSON list of streams or URLs, or text/plain with one URL per line'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(items) > settings.STREAM_BULK_MAX:
+        return JsonResponse(
+            {'error': f'At most {settings.STREAM_BULK_MAX} streams per request'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    existing = {key async for key in Stream.objects.filter(is_active=True).values_list('url_key', flat=True)}
+    results = []
+    pending = []  # (result, validated data) of the streams that still need probing
+    seen = set()
+    for index, item in enumerate(items):
+        result = {'index': index, 'url': item.get('url')}
+        results.append(result)
+        serializer = StreamCreateSerializer(data=item)
+        if not serializer.is_valid():
+            result.update(status='invalid', errors=serializer.errors)
+            continue
+        key = normalize_rtsp_url(serializer.validated_data['url'])
+        if key in existing:
+            result['status'] = 'exists'
+        elif key in seen:
+            result['status'] = 'duplicate'
+        else:
+            seen.add(key)
+            pending.append((result, serializer.validated_data))
+    
+    probes = await probe_service.probe_many(
+        [data['url'] for _, data in pending],
+        max_concurrent=settings.STREAM_BULK_PROBE_CONCURRENCY
+    )
+    streams = []
+    for result, data in pending:
+        probe = probes[data['url']]
+        if not probe['ok']:
+            result.update(status='unreachable', error=probe.get('error', 'Invalid RTSP URL or stream not accessible'))
+            continue
+        stream = Stream(**data, url_key=normalize_rtsp_url(data['url']), **probe_service.stream_fields(probe))
+        streams.append(stream)
+        result.update(status='created', id=str(stream.id))
+    
+    if streams:
+        await Stream.objects.abulk_create(streams)
+    
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    return JsonResponse(
+        {'counts': counts, 'results': results},
+        status=status.HTTP_201_CREATED if streams else status.HTTP_200_OK
+    )
+
+# CSRF-exempt like the DRF views they front; Django 4.2's csrf_exempt doesn't wrap async views
+stream_list_create.csrf_exempt = True
+stream_detail.csrf_exempt = True
+bulk_create_streams.csrf_exempt = True
+
+async def metrics(request):
+    """Stream, FFmpeg and thumbnail metrics in the Prometheus text exposition format.
+
+    Async like the other stats views, so the stream registries are read on the
+    event loop that changes them rather than from a request thread.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    ingest_workers = await stream_manager.get_ingest_stats()
+    return HttpResponse(collect_metrics(ingest_workers), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @api_view(['GET'])
 def health_check(request):
     """Health check endpoint"""
     return Response({'status': 'healthy'}, status=status.HTTP_200_OK)
 
-@api_view(['GET'])
-def stream_thumbnail(request, stream_id):
-    """Get thumbnail for a specific stream"""
+async def live_stream_stats(request):
+    """Get viewer counts and per-subscriber lag/drop counters for running streams, and attach latencies"""
+    if request.method != 'GET':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    try:
+        ingest_workers = await stream_manager.get_ingest_stats()
+        return JsonResponse({
+            'streams': stream_manager.get_stats(),
+            'attach': stream_manager.get_attach_stats(),
+            # FFmpeg of the streams we follow, when run_ingest workers run it (IngestRelay)
+            'ingest_workers': ingest_workers,
+        }, status=status.HTTP_200_OK)
+    except Exception as e:
+        return JsonResponse(
+            {'error': f'Internal server error: {str(e)}'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+async def stream_resource_stats(request, id):
+    """FFmpeg CPU, memory and pipe backlog of one stream, with its throughput and viewers"""
+    if request.method != 'GET':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    try:
+        stream = await Stream.objects.aget(id=id, is_active=True)
+    except Stream.DoesNotExist:
+        return JsonResponse({'error': 'Stream not found'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        ingest_workers = await stream_manager.get_ingest_stats()
+        stats = stream_manager.get_stream_resource_stats(normalize_rtsp_url(stream.url), ingest_workers)
+        if stats is None:
+            # Not running in this process or its ingest workers
+            stats = {'is_playing': False, 'ingest': None, 'ffmpeg': None, 'input': None, 'traffic': None, 'viewers': None}
+        stats['stream_id'] = str(stream.id)
+        return JsonResponse(stats, status=status.HTTP_200_OK)
+    except Exception as e:
+        return JsonResponse(
+            {'error': f'Internal server error: {str(e)}'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+async def stream_resource_ranking(request):
+    """Running streams ranked by FFmpeg CPU (or ?sort=rss|backlog|bitrate|viewers), most expensive first"""
+    if request.method != 'GET':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    limit = request.GET.get('limit') or None
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return JsonResponse({'error': 'limit must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        ingest_workers = await stream_manager.get_ingest_stats()
+        stats = stream_manager.get_resource_stats(sort=request.GET.get('sort', 'cpu'), limit=limit,
+                                                  ingest_workers=ingest_workers)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return JsonResponse(stats, status=status.HTTP_200_OK)
+
+async def stream_slots(request):
+    """Get ingest slot usage against MAX_CONCURRENT_STREAMS and MAX_STREAMS_PER_CLIENT.
+
+    Async so the stream manager's state is read on the event loop that owns it.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    try:
+        return JsonResponse(stream_manager.get_slot_stats(), status=status.HTTP_200_OK)
+    except Exception as e:
+        return JsonResponse(
+            {'error': f'Internal server error: {str(e)}'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+async def stream_thumbnail(request, stream_id):
+    """Get thumbnail for a specific stream.
+
+    A plain async Django view rather than a DRF one, so the FFmpeg capture is
+    awaited on the event loop instead of holding a request thread.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
     try:
-        stream = get_object_or_404(Stream, id=stream_id, is_active=True)
+        stream = await Stream.objects.aget(id=stream_id, is_active=True)
         force_refresh = request.GET.get('refresh', 'false').lower() == 'true'
+        stale = request.GET.get('stale')
         
-        thumbnail_data = thumbnail_service.get_thumbnail(
+        thumbnail_data = await thumbnail_service.get_thumbnail(
             str(stream.id), 
             stream.url, 
-            force_refresh=force_refresh
+            force_refresh=force_refresh,
+            stale_while_revalidate=None if stale is None else stale.lower() == 'true'
         )
         
         if thumbnail_data:
-            return Response(thumbnail_data, status=status.HTTP_200_OK)
+            return JsonResponse(thumbnail_service.to_json(thumbnail_data), status=status.HTTP_200_OK)
         else:
-            return Response(
+            return JsonResponse(
                 {'error': 'Failed to generate thumbnail'}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
             
     except Stream.DoesNotExist:
-        return Response(
+        return JsonResponse(
             {'error': 'Stream not found'}, 
             status=status.HTTP_404_NOT_FOUND
         )
     except Exception as e:
-        return Response(
+        return JsonResponse(
             {'error': f'Internal server error: {str(e)}'}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
-@api_view(['POST'])
-def refresh_thumbnail(request, stream_id):
+def _etag_matches(etag, if_none_match):
+    """Whether an If-None-Match header matches etag, comparing weakly as RFC 9110 requires"""
+    candidates = parse_etags(if_none_match)
+    if '*' in candidates:
+        return True
+    return etag.removeprefix('W/') in {candidate.removeprefix('W/') for candidate in candidates}
+
+async def stream_thumbnail_image(request, stream_id):
+    """Thumbnail as a binary JPEG, with an ETag so polling clients mostly get 304s"""
+    if request.method not in ('GET', 'HEAD'):
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    try:
+        stream = await Stream.objects.aget(id=stream_id, is_active=True)
+        force_refresh = request.GET.get('refresh', 'false').lower() == 'true'
+        stale = request.GET.get('stale')
+        
+        thumbnail_data = await thumbnail_service.get_thumbnail(
+            str(stream.id), 
+            stream.url, 
+            force_refresh=force_refresh,
+            stale_while_revalidate=None if stale is None else stale.lower() == 'true'
+        )
+        if not thumbnail_data:
+            return JsonResponse(
+                {'error': 'Failed to generate thumbnail'}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        
+        etag = quote_etag(thumbnail_data['etag'])
+        cache_control = f"private, max-age={thumbnail_service.max_age(thumbnail_data)}"
+        if thumbnail_service.stale_while_revalidate:
+            cache_control += f", stale-while-revalidate={max(0, thumbnail_service.max_stale - thumbnail_service.cache_ttl)}"
+        
+        if _etag_matches(etag, request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(thumbnail_data['image'], content_type='image/jpeg')
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        return response
+            
+    except Stream.DoesNotExist:
+        return JsonResponse(
+            {'error': 'Stream not found'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    except Exception as e:
+        return JsonResponse(
+            {'error': f'Internal server error: {str(e)}'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+def _thumbnail_item(stream_id, thumbnail_data, fill=True, embed=True):
+    if thumbnail_data and embed:
+        return thumbnail_service.to_json(thumbnail_data)
+    if thumbnail_data:
+        # Versioned by ETag, so an unchanged thumbnail comes from the browser cache (or a 304)
+        item = {key: value for key, value in thumbnail_data.items() if key != 'image'}
+        item['image_url'] = f"{reverse('stream-thumbnail-image', args=[stream_id])}?{urlencode({'v': thumbnail_data['etag']})}"
+        return item
+    return {'stream_id': stream_id, 'error': 'Failed to generate thumbnail' if fill else 'Thumbnail not cached'}
+
+async def stream_thumbnails(request):
+    """Thumbnails of several streams in one request, for the grid.
+    
+    ?ids=<uuid>,<uuid>,... selects streams, otherwise every active stream is
+    returned. Cached thumbnails are returned as they are and misses captured in
+    parallel; ?fill=false skips the captures. ?format=ndjson (or an Accept of
+    application/x-ndjson) streams one JSON object per line as each thumbnail
+    is ready, ?format=sse does the same as server-sent events. Each thumbnail
+    carries its JPEG as a base64 data URL, or with ?image=url its ETag and the
+    image_url of the binary endpoint instead, which browsers cache and revalidate.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    ids = [value.strip() for value in request.GET.get('ids', '').split(',') if value.strip()]
+    try:
+        ids = [str(uuid.UUID(value)) for value in ids]
+    except ValueError:
+        return JsonResponse({'error': 'ids must be a comma-separated list of stream ids'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    fill = request.GET.get('fill', 'true').lower() == 'true'
+    stale = request.GET.get('stale')
+    output = request.GET.get('format')
+    if not output:
+        accept = request.headers.get('Accept', '')
+        output = 'sse' if 'text/event-stream' in accept else 'ndjson' if 'application/x-ndjson' in accept else 'json'
+    if output not in ('json', 'ndjson', 'sse'):
+        return JsonResponse({'error': 'format must be json, ndjson or sse'}, status=status.HTTP_400_BAD_REQUEST)
+    image = request.GET.get('image', 'data')
+    if image not in ('data', 'url'):
+        return JsonResponse({'error': 'image must be data or url'}, status=status.HTTP_400_BAD_REQUEST)
+    embed = image == 'data'
+    
+    # One query for the whole grid
+    queryset = Stream.objects.filter(is_active=True).only('id', 'url')
+    if ids:
+        queryset = queryset.filter(id__in=ids)
+    streams = [(str(stream.id), stream.url) async for stream in queryset]
+    found = {stream_id for stream_id, _ in streams}
+    not_found = [stream_id for stream_id in ids if stream_id not in found]
+    
+    results = thumbnail_service.iter_thumbnails(
+        streams,
+        fill=fill,
+        stale_while_revalidate=None if stale is None else stale.lower() == 'true'
+    )
+    
+    if output == 'json':
+        thumbnails = {stream_id: _thumbnail_item(stream_id, data, fill, embed) async for stream_id, data in results}
+        return JsonResponse({
+            'count': len(streams),
+            'results': [thumbnails[stream_id] for stream_id, _ in streams],
+            'not_found': not_found,
+        }, status=status.HTTP_200_OK)
+    
+    async def events():
+        async for stream_id, data in results:
+            payload = json.dumps(_thumbnail_item(stream_id, data, fill, embed), cls=DjangoJSONEncoder)
+            yield f"event: thumbnail\ndata: {payload}\n\n" if output == 'sse' else payload + '\n'
+        if output == 'sse':
+            yield f"event: done\ndata: {json.dumps({'count': len(streams), 'not_found': not_found})}\n\n"
+    
+    response = StreamingHttpResponse(
+        events(),
+        content_type='text/event-stream' if output == 'sse' else 'application/x-ndjson'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # let nginx pass each thumbnail through as it's ready
+    return response
+
+async def refresh_thumbnail(request, stream_id):
     """Force refresh thumbnail for a specific stream"""
+    if request.method != 'POST':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
     try:
-        stream = get_object_or_404(Stream, id=stream_id, is_active=True)
+        stream = await Stream.objects.aget(id=stream_id, is_active=True)
         
         # Clear cache for this stream
-        thumbnail_service.clear_cache(str(stream.id))
+        await thumbnail_service.clear_cache(str(stream.id))
         
-        return Response(
+        return JsonResponse(
             {'message': 'Thumbnail cache cleared, next request will generate new thumbnail'}, 
             status=status.HTTP_200_OK
         )
             
     except Stream.DoesNotExist:
-        return Response(
+        return JsonResponse(
             {'error': 'Stream not found'}, 
             status=status.HTTP_404_NOT_FOUND
         )
     except Exception as e:
-        return Response(
+        return JsonResponse(
             {'error': f'Internal server error: {str(e)}'}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
-@api_view(['GET'])
-def thumbnail_cache_stats(request):
+async def thumbnail_cache_stats(request):
     """Get thumbnail cache statistics"""
+    if request.method != 'GET':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
     try:
         stats = thumbnail_service.get_cache_stats()
-        return Response(stats, status=status.HTTP_200_OK)
+        stats['scheduler'] = thumbnail_scheduler.get_stats()
+        return JsonResponse(stats, status=status.HTTP_200_OK)
     except Exception as e:
-        return Response(
+        return JsonResponse(
             {'error': f'Internal server error: {str(e)}'}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
-@api_view(['POST'])
-def clear_thumbnail_cache(request):
+async def clear_thumbnail_cache(request):
     """Clear all thumbnail cache"""
+    if request.method != 'POST':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
     try:
-        thumbnail_service.clear_cache()
-        return Response(
+        await thumbnail_service.clear_cache()
+        return JsonResponse(
             {'message': 'Thumbnail cache cleared successfully'}, 
             status=status.HTTP_200_OK
         )
     except Exception as e:
-        return Response(
+        return JsonResponse(
             {'error': f'Internal server error: {str(e)}'}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+# CSRF-exempt like the DRF views they replace; the thumbnail cache is only touched from the event loop
+refresh_thumbnail.csrf_exempt = True
+clear_thumbnail_cache.csrf_exempt = True
@@ -1,11 +1,58 @@
-import React, { useState } from 'react';
+import React, { useState, useEffect } from 'react';
 import StreamTile from './StreamTile';
 import { useNotification } from '../context/NotificationContext';
 import { config } from '../config';
 
 function StreamGrid({ streams, onRemoveStream, onEditStream, onLoadSavedStreams, loading }) {
   const [refreshKey, setRefreshKey] = useState(0);
+  const [thumbnails, setThumbnails] = useState({});
   const { showSuccess, showError } = useNotification();
+  
+  // One request for every tile's thumbnail, streamed as NDJSON so cached ones show up at once
+  const loadThumbnails = async (signal) => {
+    setThumbnails({});
+    try {
+      const response = await fetch(`${config.API_ENDPOINTS.THUMBNAILS}?format=ndjson&image=url`, { signal });
+      if (!response.ok) {
+        throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+      }
+      
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffered = '';
+      for (;;) {
+        const { done, value } = await reader.read();
+        if (done) {
+          break;
+        }
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = lines.pop();
+        const loaded = {};
+        lines.filter(line => line.trim()).forEach(line => {
+          const item = JSON.parse(line);
+          loaded[item.stream_id] = item;
+        });
+        setThumbnails(prev => ({ ...prev, ...loaded }));
+      }
+    } catch (error) {
+      if (error.name === 'AbortError') {
+        return;
+      }
+      console.error('Error loading thumbnails:', error);
+    }
+    // Tiles the response didn't cover fetch their own thumbnail
+    setThumbnails(prev => Object.fromEntries(streams.map(stream => [stream.id, prev[stream.id] || null])));
+  };
+  
+  useEffect(() => {
+    if (streams.length === 0) {
+      return undefined;
+    }
+    const controller = new AbortController();
+    loadThumbnails(controller.signal);
+    return () => controller.abort();
+  }, [streams, refreshKey]);
 
   const handleRefresh = async () => {
     try {
@@ -65,6 +112,7 @@ function StreamGrid({ streams, onRemoveStream, onEditStream, onLoadSavedStreams,
             <StreamTile
               key={`${stream.id}-${refreshKey}`}
               stream={stream}
+              thumbnail={thumbnails[stream.id]}
               onRemove={onRemoveStream}
               onEdit={onEditStream}
             />
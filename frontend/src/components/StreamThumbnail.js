@@ -1,7 +1,10 @@
 import React, { useState, useEffect } from 'react';
 import { config } from '../config';
 
-function StreamThumbnail({ streamId, streamUrl, onLoad, onError, className = '', style = {} }) {
+// With `batched`, the grid fetches every tile's thumbnail in one request and hands it over
+// as `preloaded` (undefined while that request runs); tiles it failed for fetch their own.
+// Preloaded thumbnails point at the binary endpoint, so the browser cache keeps the JPEGs.
+function StreamThumbnail({ streamId, streamUrl, batched = false, preloaded, onLoad, onError, className = '', style = {} }) {
   const [thumbnail, setThumbnail] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
@@ -11,7 +14,8 @@ function StreamThumbnail({ streamId, streamUrl, onLoad, onError, className = '',
       setLoading(true);
       setError(null);
 
-      const url = `${config.API_ENDPOINTS.STREAMS}${streamId}/thumbnail/`;
+      // Binary JPEG with an ETag; the browser cache revalidates it with If-None-Match
+      const url = config.API_ENDPOINTS.THUMBNAIL_IMAGE(streamId);
       const params = new URLSearchParams();
       if (forceRefresh) {
         params.append('refresh', 'true');
@@ -23,13 +27,13 @@ function StreamThumbnail({ streamId, streamUrl, onLoad, onError, className = '',
         throw new Error(`HTTP ${response.status}: ${response.statusText}`);
       }
 
-      const data = await response.json();
+      const blob = await response.blob();
       
-      if (data.thumbnail) {
-        setThumbnail(data.thumbnail);
+      if (blob.size) {
+        setThumbnail(URL.createObjectURL(blob));
         setLoading(false);
         if (onLoad) {
-          onLoad(data);
+          onLoad({ etag: response.headers.get('ETag'), size: blob.size });
         }
       } else {
         throw new Error('No thumbnail data received');
@@ -50,8 +54,31 @@ function StreamThumbnail({ streamId, streamUrl, onLoad, onError, className = '',
   };
 
   useEffect(() => {
-    loadThumbnail();
-  }, [streamId]);
+    if (!batched) {
+      loadThumbnail();
+      return;
+    }
+    if (preloaded === undefined) {
+      return; // The grid's request is still running
+    }
+    if (preloaded && (preloaded.image_url || preloaded.thumbnail)) {
+      setThumbnail(preloaded.image_url ? `${config.API_BASE_URL}${preloaded.image_url}` : preloaded.thumbnail);
+      setError(null);
+      setLoading(false);
+      if (onLoad) {
+        onLoad({ etag: preloaded.etag, size: preloaded.size });
+      }
+    } else {
+      loadThumbnail();
+    }
+  }, [streamId, batched, preloaded]);
+
+  // Release the previous object URL when it is replaced or the tile goes away
+  useEffect(() => () => {
+    if (thumbnail && thumbnail.startsWith('blob:')) {
+      URL.revokeObjectURL(thumbnail);
+    }
+  }, [thumbnail]);
 
   // Loading state
   if (loading) {
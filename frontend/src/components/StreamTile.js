@@ -3,7 +3,10 @@ import EditStreamModal from './EditStreamModal';
 import StreamThumbnail from './StreamThumbnail';
 import { config } from '../config';
 
-function StreamTile({ stream, onRemove, onEdit }) {
+// Grid tiles play the small 'low' rendition, the expanded view the full-resolution one
+const streamQuality = (expanded) => (expanded ? 'medium' : 'low');
+
+function StreamTile({ stream, thumbnail, onRemove, onEdit }) {
   const [status, setStatus] = useState('stopped'); // stopped, connecting, playing, error
   const [errorMessage, setErrorMessage] = useState('');
   const [isPlaying, setIsPlaying] = useState(false);
@@ -99,7 +102,7 @@ function StreamTile({ stream, onRemove, onEdit }) {
     }
   };
 
-  const initializeJSMpeg = () => {
+  const initializeJSMpeg = (quality = streamQuality(isExpanded)) => {
     console.log('initializeJSMpeg called');
     if (playerRef.current) {
       // Player already exists, don't reinitialize
@@ -127,7 +130,7 @@ function StreamTile({ stream, onRemove, onEdit }) {
       }
 
       // Create a separate WebSocket URL for JSMpeg with video_only=true
-      const wsUrl = config.WS_ENDPOINTS.STREAM(stream.id, true, clientIdRef.current);
+      const wsUrl = config.WS_ENDPOINTS.STREAM(stream.id, true, clientIdRef.current, quality);
       
       console.log('Initializing JSMpeg with URL:', wsUrl);
       console.log('Canvas element:', canvasRef.current);
@@ -322,7 +325,18 @@ function StreamTile({ stream, onRemove, onEdit }) {
 
 
   const handleExpand = () => {
-    setIsExpanded(!isExpanded);
+    const expanded = !isExpanded;
+    setIsExpanded(expanded);
+    if (playerRef.current) {
+      // Switch renditions: the control connection and the shared ingest keep running
+      try {
+        playerRef.current.destroy();
+      } catch (error) {
+        console.error('Error destroying player:', error);
+      }
+      playerRef.current = null;
+      initializeJSMpeg(streamQuality(expanded));
+    }
   };
 
   const handleRemove = () => {
@@ -429,6 +443,8 @@ function StreamTile({ stream, onRemove, onEdit }) {
           <StreamThumbnail
             streamId={stream.id}
             streamUrl={stream.url}
+            batched
+            preloaded={thumbnail}
             className="stream-thumbnail-container"
             style={{
               position: 'absolute',
@@ -468,7 +484,7 @@ function StreamTile({ stream, onRemove, onEdit }) {
           {isExpanded ? '✕' : '⤢'}
         </button>
         
-        {status === 'connecting' && (
+        {['connecting', 'reconnecting', 'stalled'].includes(status) && (
           <div className="stream-overlay">
             <div className="loading-spinner"></div>
           </div>
@@ -20,14 +20,18 @@ export const config = {
     STREAMS: `${API_BASE_URL}/api/streams/`,
     HEALTH: `${API_BASE_URL}/api/health/`,
     THUMBNAIL: (streamId) => `${API_BASE_URL}/api/streams/${streamId}/thumbnail/`,
+    THUMBNAIL_IMAGE: (streamId) => `${API_BASE_URL}/api/streams/${streamId}/thumbnail/image/`,
     THUMBNAIL_REFRESH: (streamId) => `${API_BASE_URL}/api/streams/${streamId}/thumbnail/refresh/`,
+    THUMBNAILS: `${API_BASE_URL}/api/thumbnails/`,
     THUMBNAIL_CACHE_STATS: `${API_BASE_URL}/api/thumbnails/cache/stats/`,
     THUMBNAIL_CACHE_CLEAR: `${API_BASE_URL}/api/thumbnails/cache/clear/`,
   },
   WS_ENDPOINTS: {
-    STREAM: (id, videoOnly = false, clientId = null) => {
-      const baseUrl = `${WS_BASE_URL}/ws/stream?id=${id}&video_only=${videoOnly}`;
-      return clientId ? `${baseUrl}&client_id=${clientId}` : baseUrl;
+    STREAM: (id, videoOnly = false, clientId = null, quality = null) => {
+      let url = `${WS_BASE_URL}/ws/stream?id=${id}&video_only=${videoOnly}`;
+      if (clientId) url += `&client_id=${clientId}`;
+      if (quality) url += `&quality=${quality}`;
+      return url;
     },
   }
 };